@@ -0,0 +1,62 @@
+"""
+Microbenchmark of the error code dispatch.
+
+Measures cost of finding handler and exception classes for
+known and unknown error codes and checks that it does not grow
+with the number of registered handlers.
+
+Usage: python -m benchmarks.bench_error_dispatch
+"""
+
+import inspect
+import sys
+import timeit
+
+from vk_api import errorhandlers
+from vk_api import vk_exceptions
+
+NUMBER = 200000
+CODES = (1, 6, 14, 603, 999999)
+
+
+def reflective_lookup(code):
+    """Lookup by scanning module members, as it was done before"""
+    module_classes = inspect.getmembers(sys.modules[vk_exceptions.__name__],
+                                        inspect.isclass)
+    for _, cls in module_classes:
+        if vk_exceptions.is_valid_error_cls(cls) and cls.error_code == code:
+            return cls
+    return vk_exceptions.UnknownError
+
+
+def time_per_call(fn, code, number=NUMBER):
+    seconds = timeit.timeit(lambda: fn(code), number=number)
+    return seconds / number * 1e9
+
+
+def dispatch(code):
+    errorhandlers.get_handler_by_error_code(code)
+    vk_exceptions.get_exception_class_by_code(code)
+
+
+def main():
+    print("{:>10} {:>14} {:>14}".format("code", "dispatch, ns", "scan, ns"))
+    for code in CODES:
+        print("{:>10} {:>14.0f} {:>14.0f}".format(
+            code,
+            time_per_call(dispatch, code),
+            time_per_call(reflective_lookup, code, number=2000)))
+
+    handlers_count = len(errorhandlers._handlers)
+    before = time_per_call(dispatch, 999999)
+    for code in range(10000, 20000):
+        errorhandlers.register_handler(code, errorhandlers.DefaultHandler)
+    after = time_per_call(dispatch, 999999)
+    print("\nUnknown code dispatch with {} handlers: {:.0f} ns, "
+          "with {} handlers: {:.0f} ns".format(handlers_count, before,
+                                               len(errorhandlers._handlers),
+                                               after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Microbenchmark of the method proxy dispatch.
+
+Compares cost of calling method through ``api.users.get(...)``
+attribute chain with calling ``api.api_method`` directly.
+Network is not involved, api_method is replaced with a stub.
+
+Usage: python -m benchmarks.bench_method_proxy
+"""
+
+import timeit
+
+from vk_api.api import API
+
+NUMBER = 1000000
+
+
+def stub_api_method(method_name, **kwargs):
+    return None
+
+
+def main():
+    api = API(request_delay=0)
+    api.api_method = stub_api_method
+    users_get = api.users.get
+
+    cases = [
+        ("api.api_method('users.get', ...)",
+         lambda: api.api_method("users.get", user_ids=1)),
+        ("api.users.get(...)",
+         lambda: api.users.get(user_ids=1)),
+        ("users_get = api.users.get; users_get(...)",
+         lambda: users_get(user_ids=1)),
+        ("api.photos.getAlbums.resolve_method_name()",
+         lambda: api.photos.getAlbums.resolve_method_name()),
+    ]
+    for name, fn in cases:
+        seconds = timeit.timeit(fn, number=NUMBER)
+        print("{:<45} {:>8.0f} ns".format(name, seconds / NUMBER * 1e9))
+
+
+if __name__ == "__main__":
+    main()
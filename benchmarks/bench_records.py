@@ -0,0 +1,109 @@
+"""
+Benchmark of typed records against raw dictionaries.
+
+Measures memory retained by a list of decoded users and the
+cost of reading plain and nested fields from them. Nested fields
+are decoded on the first access, so its cost is reported separately
+from the cost of the repeated access.
+
+Usage: python -m benchmarks.bench_records
+"""
+
+import json
+import sys
+import timeit
+import tracemalloc
+
+from vk_api.models import User
+
+COUNT = 100000
+NUMBER = 1000000
+
+
+def make_payload(count=COUNT):
+    """Users as returned by users.get with fields typical for crawling:
+    sex,bdate,city,country,photo_100,online,domain,screen_name,
+    verified,followers_count,last_seen"""
+    users = [{"id": i, "first_name": "Name{}".format(i),
+              "last_name": "Surname{}".format(i), "sex": i % 3,
+              "bdate": "1.1", "is_closed": False, "can_access_closed": True,
+              "screen_name": "id{}".format(i), "domain": "id{}".format(i),
+              "online": 0, "verified": 0, "followers_count": i % 500,
+              "photo_100": "https://sun.userapi.com/{}.jpg".format(i),
+              "city": {"id": i % 100, "title": "City{}".format(i % 100)},
+              "country": {"id": 1, "title": "Country"},
+              "last_seen": {"time": 1500000000 + i, "platform": 7}}
+             for i in range(count)]
+    return json.dumps(users)
+
+
+def retained_memory(build):
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    payload = make_payload()
+    raw_user = json.loads(payload)[0]
+
+    def decode_nested(users):
+        for user in users:
+            user.city, user.country, user.last_seen
+        return users
+
+    sizes = [
+        ("dicts", retained_memory(lambda: json.loads(payload))),
+        ("records", retained_memory(
+            lambda: [User.from_dict(u) for u in json.loads(payload)])),
+        ("records, nested decoded", retained_memory(
+            lambda: decode_nested([User.from_dict(u)
+                                   for u in json.loads(payload)]))),
+    ]
+    print("Memory retained by {} users (field values included):".format(COUNT))
+    for name, size in sizes:
+        print("{:<24} {:>8.1f} MiB {:>6.2f}x".format(
+            name, size / 2.0 ** 20, sizes[0][1] / float(size)))
+
+    record = decode_nested([User.from_dict(raw_user)])[0]
+    print("Container size of a single user: dict {} bytes "
+          "(+{} nested), record {} bytes (+{} nested)".format(
+              sys.getsizeof(raw_user),
+              sum(sys.getsizeof(raw_user[k])
+                  for k in ("city", "country", "last_seen")),
+              sys.getsizeof(record),
+              sum(sys.getsizeof(getattr(record, k))
+                  for k in ("city", "country", "last_seen"))))
+
+    number = NUMBER // 10
+    build = timeit.timeit(lambda: User.from_dict(raw_user), number=number)
+    print("\nUser.from_dict: {:.0f} ns".format(build / number * 1e9))
+    first = timeit.timeit(lambda: User.from_dict(raw_user).city.title,
+                          number=number)
+    print("First record.city.title: {:.0f} ns (nested records decoded)".format(
+        (first - build) / number * 1e9))
+
+    raw = json.loads(payload)[0]
+    user = User.from_dict(raw)
+    user.city  # decode nested records once, the rest is repeated access
+    cases = [
+        ("dict['first_name']", lambda: raw["first_name"]),
+        ("record.first_name", lambda: user.first_name),
+        ("dict['city']['title']", lambda: raw["city"]["title"]),
+        ("dict['last_seen']['time']", lambda: raw["last_seen"]["time"]),
+        ("record.city.title", lambda: user.city.title),
+        ("record.last_seen.time", lambda: user.last_seen.time),
+        ("dict.get('bdate')", lambda: raw.get("bdate")),
+        ("record.bdate (missing)", lambda: user.bdate),
+    ]
+    print()
+    for name, fn in cases:
+        seconds = timeit.timeit(fn, number=NUMBER)
+        print("{:<26} {:>8.1f} ns".format(name, seconds / NUMBER * 1e9))
+
+
+if __name__ == "__main__":
+    main()
@@ -21,5 +21,7 @@ setup(name='vk_api',
       license='MIT',
       packages=['vk_api'],
       zip_safe=False,
-      install_requires=['requests>=2.4.3']
+      python_requires='>=3.8',
+      install_requires=['requests>=2.4.3'],
+      extras_require={'async': ['aiohttp>=3.3']}
       )
@@ -0,0 +1,363 @@
+"""
+Asyncio version of the API client.
+
+Requires aiohttp to be installed. Method calls keep the same
+attribute interface, but have to be awaited:
+
+>>> async with AsyncAPI(access_token=token) as api:
+...     r = await api.wall.get(owner_id=1)
+"""
+import asyncio
+import logging
+import os
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from . import conf
+from . import jsonlib
+from . import models
+from . import vk_exceptions
+from .api import API, MethodChunk, process_error_response
+from .longpoll import GroupLongPoll, LongPoll
+
+
+def _encode_params(params):
+    """aiohttp accepts only strings as query values,
+    None values are dropped the same way requests does"""
+    return {k: str(v) for k, v in params.items() if v is not None}
+
+
+class AsyncRateLimiter(object):
+    """Asyncio wrapper around the token bucket. Waiting for the
+    free slot does not block the event loop, while the bucket
+    itself may still be shared with blocking API instances.
+
+    :param bucket: token bucket slots are reserved from
+    :type bucket: vk_api.ratelimit.TokenBucket
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    async def acquire(self, tokens=1):
+        wait = self.bucket.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        self.bucket.on_success()
+
+    def on_throttle(self):
+        self.bucket.on_throttle()
+
+
+class AsyncHTTPTransport(object):
+    """Pooled asyncio HTTP transport built on top of aiohttp.ClientSession.
+    Session is created lazily, so the transport may be constructed
+    outside of the running event loop.
+
+    :param pool_maxsize: maximum number of simultaneously open connections
+    :param pool_maxsize_per_host: maximum number of connections to a single host
+    :param timeout: (connect, read) timeout tuple or a single number
+    :param keep_alive: whether connections should be kept open between calls
+    :param session: already configured aiohttp session to be used
+    :type pool_maxsize: int
+    :type pool_maxsize_per_host: int
+    :type timeout: tuple or float
+    :type keep_alive: bool
+    :type session: aiohttp.ClientSession
+    """
+
+    def __init__(self,
+                 pool_maxsize=conf.AIO_POOL_MAXSIZE,
+                 pool_maxsize_per_host=conf.HTTP_POOL_MAXSIZE,
+                 timeout=conf.HTTP_TIMEOUT,
+                 keep_alive=True,
+                 session=None):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required to use asyncio transport.")
+        self.pool_maxsize = pool_maxsize
+        self.pool_maxsize_per_host = pool_maxsize_per_host
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._owns_session = session is None
+        self._session = session
+
+    @property
+    def session(self):
+        if self._session is None:
+            if isinstance(self.timeout, tuple):
+                connect, read = self.timeout
+                timeout = aiohttp.ClientTimeout(sock_connect=connect,
+                                                sock_read=read)
+            else:
+                timeout = aiohttp.ClientTimeout(total=self.timeout)
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_maxsize,
+                limit_per_host=self.pool_maxsize_per_host,
+                force_close=not self.keep_alive)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=timeout)
+        return self._session
+
+    async def get_json(self, url, params=None, loads=jsonlib.loads):
+        """Sends GET request and returns JSON body decoded with ``loads``"""
+        async with self.session.get(url, params=params) as r:
+            return await r.json(content_type=None, loads=loads)
+
+    async def post_json(self, url, data=None, loads=jsonlib.loads):
+        """Sends POST request and returns JSON body decoded with ``loads``"""
+        async with self.session.post(url, data=data) as r:
+            return await r.json(content_type=None, loads=loads)
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncMethodChunk(MethodChunk):
+    """Method chunk of AsyncAPI, calls return coroutines.
+    Helpers built on top of blocking calls are not supported."""
+
+    __slots__ = ()
+
+    async def records(self, record_type=None, **kwargs):
+        """Asyncio version of MethodChunk.records"""
+        if record_type is None:
+            record_type = models.record_type_for(self._method_name)
+        return models.from_response(await self(**kwargs), record_type)
+
+    def _not_supported(self, helper):
+        msg = "{}.{} is not supported by AsyncAPI."
+        raise NotImplementedError(msg.format(self._method_name, helper))
+
+    def ids(self, *args, **kwargs):
+        self._not_supported("ids")
+
+    def stream(self, *args, **kwargs):
+        self._not_supported("stream")
+
+    def iter(self, *args, **kwargs):
+        self._not_supported("iter")
+
+    def iter_bulk(self, *args, **kwargs):
+        self._not_supported("iter_bulk")
+
+
+class AsyncAPI(API):
+    """Asyncio VK API client. Accepts the same arguments as API,
+    apart from the transport which should be AsyncHTTPTransport
+    and rate limiter which may be either token bucket or
+    AsyncRateLimiter instance. Single-flight and retry policy
+    are not supported, neither are batches, map, streaming
+    and loaders.
+    """
+
+    method_chunk_class = AsyncMethodChunk
+
+    def __init__(self, *args, **kwargs):
+        for name in ("single_flight", "retry_policy"):
+            if kwargs.get(name):
+                raise ValueError(
+                    "{} is not supported by AsyncAPI.".format(name))
+        if kwargs.get("transport") is None:
+            kwargs["transport"] = AsyncHTTPTransport(
+                session=kwargs.pop("session", None))
+        limiter = kwargs.get("rate_limiter")
+        if limiter is not None and not isinstance(limiter, AsyncRateLimiter):
+            kwargs["rate_limiter"] = AsyncRateLimiter(limiter)
+        super(AsyncAPI, self).__init__(*args, **kwargs)
+
+    @property
+    def rate_limiter(self):
+        limiter = super(AsyncAPI, self).rate_limiter
+        if not isinstance(limiter, AsyncRateLimiter):
+            limiter = AsyncRateLimiter(limiter)
+        return limiter
+
+    async def is_valid_access_token(self):
+        is_valid = True
+        try:
+            await self.api_method("isAppUser")
+        except vk_exceptions.API_Error:
+            is_valid = False
+        return is_valid
+
+    async def api_method(self, method_name, **kwargs):
+        """Asyncio version of API.api_method.
+        Usage example:
+
+        >>> r = await api.api_method("wall.get", owner_id="1")
+
+        :param method_name: name of the VK API method to be called
+        :type method_name: str or unicode
+        :param kwargs: method parameters passed to method
+        :returns: api response dictionary
+        :rtype: dictionary
+        """
+        request_api_version = kwargs.get('v')
+        if not request_api_version:
+            kwargs["v"] = self.api_version
+        if self._access_token:
+            kwargs["access_token"] = self._access_token
+
+        cache = self.cache
+        if cache is not None:
+            r = cache.get(method_name, kwargs)
+            if r is not None:
+                return r
+        url = conf.API_BASE_URL + method_name
+        limiter = self.rate_limiter
+        await limiter.acquire()
+        r = await self.transport.get_json(url, params=_encode_params(kwargs),
+                                          loads=self.json_loads)
+        if "error" in r:
+            return process_error_response(self, r)
+        limiter.on_success()
+        if cache is not None:
+            cache.set(method_name, kwargs, r)
+        return r
+
+    @property
+    def loaders(self):
+        raise NotImplementedError("Loaders are not supported by AsyncAPI.")
+
+    def map(self, *args, **kwargs):
+        raise NotImplementedError("map is not supported by AsyncAPI, "
+                                  "use asyncio.gather instead.")
+
+    def stream_items(self, *args, **kwargs):
+        raise NotImplementedError("Streaming is not supported by AsyncAPI.")
+
+    def batch(self, *args, **kwargs):
+        raise NotImplementedError("Batches are not supported by AsyncAPI.")
+
+    async def upload_photos_to_user_album(self, album_id,
+                                          group_id="",
+                                          images=None):
+        """Uploads specified image files to the specified album"""
+        if not images:
+            return
+        for i in images:
+            assert os.path.exists(i) and os.path.isfile(i)
+        if len(images) > conf.MAX_ALBUM_UPLOAD_IMAGES:
+            msg = "Sending more than {} image files is now allowed."
+            raise ValueError(msg.format(conf.MAX_ALBUM_UPLOAD_IMAGES))
+        params = {"album_id": album_id}
+        if group_id:
+            params["group_id"] = group_id
+        upload_url_resp = await self.photos.getUploadServer(**params)
+        upload_url = upload_url_resp['response']['upload_url']
+
+        img_files = [open(f, 'rb') for f in images]
+        try:
+            img_data = aiohttp.FormData()
+            for i, f in enumerate(img_files):
+                img_data.add_field('file{}'.format(i), f,
+                                   filename=os.path.basename(f.name))
+            r = await self.transport.post_json(upload_url, data=img_data,
+                                               loads=self.json_loads)
+        finally:
+            [i.close() for i in img_files]
+        return await self.photos.save(server=r['server'],
+                                      photos_list=r['photos_list'],
+                                      hash=r['hash'],
+                                      **params)
+
+    async def upload_profile_photo(self, photo, profile_id):
+        upload_url_resp = await self.photos.getOwnerPhotoUploadServer(
+            owner_id=profile_id)
+        upload_url = upload_url_resp['response']['upload_url']
+        assert os.path.exists(photo) and os.path.isfile(photo)
+        with open(photo, 'rb') as f:
+            img_data = aiohttp.FormData()
+            img_data.add_field('photo', f, filename=os.path.basename(photo))
+            r = await self.transport.post_json(upload_url, data=img_data,
+                                               loads=self.json_loads)
+        return await self.photos.saveOwnerPhoto(server=r['server'],
+                                                hash=r['hash'],
+                                                photo=r['photo'])
+
+    async def close(self):
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncLongPoll(LongPoll):
+    """Asyncio version of the user Long Poll client, events
+    are received by iterating over it:
+
+    >>> async for event in AsyncLongPoll(api):
+    ...     print(event.type)
+
+    :param api: AsyncAPI object instance
+    """
+
+    transient_errors = ((aiohttp.ClientError, asyncio.TimeoutError)
+                        if aiohttp is not None else (asyncio.TimeoutError,))
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("sleep", asyncio.sleep)
+        super(AsyncLongPoll, self).__init__(*args, **kwargs)
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            read_timeout = self.wait + conf.LONGPOLL_TIMEOUT_MARGIN
+            self._transport = AsyncHTTPTransport(
+                pool_maxsize=1, pool_maxsize_per_host=1,
+                timeout=(conf.HTTP_TIMEOUT[0], read_timeout))
+        return self._transport
+
+    async def update_server(self):
+        self.set_server(await self._api.api_method(self.server_method,
+                                                   **self.server_params()))
+
+    async def check(self):
+        if self.key is None:
+            await self.update_server()
+        r = await self.transport.get_json(
+            self.poll_url(), params=_encode_params(self.poll_params()),
+            loads=self._api.json_loads)
+        return self.process_response(r)
+
+    async def listen(self):
+        delays = self.reconnect_delays()
+        while True:
+            try:
+                events = await self.check()
+            except self.transient_errors as e:
+                delay = next(delays)
+                logging.warning("Long Poll request failed: {}, reconnecting "
+                                "in {} s.".format(e, delay))
+                await self._sleep(delay)
+                continue
+            delays = self.reconnect_delays()
+            for event in events:
+                yield event
+
+    def __aiter__(self):
+        return self.listen()
+
+    async def close(self):
+        if self._transport is not None:
+            await self._transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncGroupLongPoll(AsyncLongPoll, GroupLongPoll):
+    """Asyncio version of the community Long Poll client"""
@@ -1,29 +1,38 @@
-from __future__ import print_function, unicode_literals
-
-import time
-import requests
 import webbrowser
+import requests
 import re
 import os
+import threading
+from collections import deque
+from contextlib import closing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import logging
 
 from . import conf
+from . import jsonlib
+from . import models
 from . import utils
 from . import vk_exceptions
 from .import errorhandlers
+from . import ratelimit
+from .idlist import IDList
+from .loaders import Loaders
+from .singleflight import SingleFlight
+from .transport import HTTPTransport
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger("requests").setLevel(logging.WARNING)
 
 
-def process_error_response(vk, json_response):
+def process_error_response(vk, json_response, limiter=None):
     """
     When response with error code is returned it is processed
     correct error handler is chosed by this method
 
     :param vk: VK API object instance
     :param json_response: VK API response, containing error code and message
+    :param limiter: rate limiter used for the request, API's one by default
     :type json_response: dict
     :type vk: API
     """
@@ -34,49 +43,145 @@ def process_error_response(vk, json_response):
     json_response = json_response["error"]
 
     error_code = json_response["error_code"]
+    if int(error_code) in conf.THROTTLE_ERROR_CODES:
+        if limiter is None:
+            limiter = getattr(vk, "rate_limiter", None)
+        if limiter is not None:
+            limiter.on_throttle()
 
     error_handler = errorhandlers.get_handler_by_error_code(error_code)
-    error_handler(vk, json_response).handle()
+    return error_handler(vk, json_response).handle()
 
 
 class MethodChunk(object):
+    """Part of the dotted method name, e.g. ``api.wall`` or ``api.wall.get``.
+    Child chunks are created once and stored in the instance dictionary,
+    and the full method name is computed on creation, so repeated
+    calls are cheap.
+    """
 
-    __slots__ = ("_name", "_api", "_parent")
+    __slots__ = ("_name", "_api", "_parent", "_method_name", "__dict__")
 
     def __init__(self, name, api, parent=None):
         self._name = name
         self._api = api
         self._parent = parent
+        if isinstance(parent, MethodChunk):
+            self._method_name = parent._method_name + "." + name
+        else:
+            self._method_name = name
 
     def resolve_method_name(self):
-        """Assembles full method name from parent names"""
-        name_parts = []
-        node = self
-        while isinstance(node, MethodChunk):
-            name_parts.append(node._name)
-            node = node._parent
-        method_name = ".".join(reversed(name_parts))
-        return method_name
+        """Returns full method name assembled from parent names"""
+        return self._method_name
 
     def __call__(self, **kwargs):
-        method_name = self.resolve_method_name()
-        return self._api.api_method(method_name, **kwargs)
+        return self._api.api_method(self._method_name, **kwargs)
+
+    def ids(self, page_size=conf.IDS_PAGE_SIZE, **kwargs):
+        """Fetches every page of the method returning IDs and
+        collects them into compact IDList.
+        Usage example:
+
+        >>> members = api.groups.getMembers.ids(group_id=1)
+        >>> 1 in members
+
+        :param page_size: number of IDs requested per call
+        :param kwargs: parameters passed to iter
+        :rtype: vk_api.idlist.IDList
+        """
+        return IDList.from_iterable(self.iter(page_size=page_size, **kwargs))
+
+    def records(self, record_type=None, **kwargs):
+        """Calls method and converts returned objects to typed records,
+        see vk_api.models. Methods returning IDs by default (friends.get,
+        groups.getMembers) should be called with ``fields``.
+
+        >>> user = api.users.get.records(user_ids=1, fields="city")[0]
+        >>> user.city.title
+
+        :param record_type: record class, guessed from the method name
+            if not passed
+        :param kwargs: method parameters
+        """
+        if record_type is None:
+            record_type = models.record_type_for(self._method_name)
+        return models.from_response(self(**kwargs), record_type)
+
+    def stream(self, **kwargs):
+        """Yields items of the method response while it is being read,
+        see API.stream_items"""
+        return self._api.stream_items(self._method_name, **kwargs)
+
+    def iter(self, page_size=conf.DEFAULT_PAGE_SIZE,
+             prefetch=conf.PAGINATION_PREFETCH, offset=0, limit=None,
+             **kwargs):
+        """Lazily iterates over items of the paginated method,
+        following pages are fetched in background.
+        Usage example:
+
+        >>> for post in api.wall.get.iter(owner_id=1, page_size=100):
+        ...     print(post["id"])
+
+        :param page_size: number of items requested per call
+        :param prefetch: number of pages fetched ahead of the consumer
+        :param offset: offset of the first item to be returned
+        :param limit: maximum number of items to be returned
+        :param kwargs: method parameters passed to every call
+        """
+        from .pagination import iterate_method
+        return iterate_method(self._api, self.resolve_method_name(),
+                              page_size=page_size, prefetch=prefetch,
+                              offset=offset, limit=limit, **kwargs)
+
+    def iter_bulk(self, page_size=conf.DEFAULT_PAGE_SIZE,
+                  prefetch=conf.PAGINATION_PREFETCH, offset=0, limit=None,
+                  max_pages=conf.EXECUTE_MAX_CALLS, **kwargs):
+        """Same as iter, but fetches up to ``max_pages`` pages
+        per HTTP request with generated execute code.
+        Usage example:
+
+        >>> members = api.groups.getMembers.iter_bulk(group_id=1,
+        ...                                           page_size=1000)
+
+        :param max_pages: maximum number of method calls per execute request
+        """
+        from .pagination import iterate_method_bulk
+        return iterate_method_bulk(self._api, self.resolve_method_name(),
+                                   page_size=page_size, prefetch=prefetch,
+                                   offset=offset, limit=limit,
+                                   max_pages=max_pages, **kwargs)
 
     def __getattr__(self, attr):
         if attr not in self.__slots__:
-            return MethodChunk(attr, self._api, self)
+            # Stored as instance attribute, so __getattr__ is not
+            # called on the subsequent accesses
+            return self.__dict__.setdefault(attr,
+                                            type(self)(attr, self._api, self))
         return object.__getattr__(self, attr)
 
 
 class API(object):
 
+    # Class of the ``api.wall``-like attributes
+    method_chunk_class = MethodChunk
+
     def __init__(self,
                  access_token=None,
                  use_settings=False,
                  settings_file=None,
                  api_version=conf.DEFAULT_API_VERSION,
                  request_delay=conf.API_CALL_DELAY,
-                 permissions=conf.DEFAULT_PERMISSIONS):
+                 permissions=conf.DEFAULT_PERMISSIONS,
+                 transport=None,
+                 session=None,
+                 rate_limiter=None,
+                 request_burst=conf.API_CALL_BURST,
+                 adaptive_rate=False,
+                 cache=None,
+                 single_flight=None,
+                 retry_policy=None,
+                 json_loads=None):
 
         self._use_settings = use_settings
         self._access_token = access_token
@@ -84,13 +189,32 @@ class API(object):
             self._settings_file = settings_file if settings_file else conf.DEFAULT_SETTINGS_FILE
         self.manage_settings()
 
-        self.first_time = time.time()
-        self._called_first_time = True
-
         self.api_version = api_version
         self.delay = request_delay
+        self.burst = request_burst
+        self.adaptive_rate = adaptive_rate
         self.permissions = permissions
 
+        self.cache = cache
+        self._loaders = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if single_flight is True:
+            single_flight = SingleFlight()
+        self.single_flight = single_flight or None
+        self.retry_policy = retry_policy
+        self.json_loads = json_loads or jsonlib.loads
+        self._rate_limiter = rate_limiter
+        if rate_limiter is None and not request_delay:
+            if adaptive_rate:
+                raise ValueError("Adaptive rate requires initial "
+                                 "request delay.")
+            self._rate_limiter = ratelimit.TokenBucket(None)
+
+        if transport is None:
+            transport = HTTPTransport(session=session)
+        self.transport = transport
+
         if not self._access_token:
             logging.debug("No access token provided, using public methods.")
 
@@ -104,6 +228,35 @@ class API(object):
         if self._use_settings and self._settings_file:
             utils.json_to_file({"access_token": value}, self._settings_file)
 
+    @property
+    def loaders(self):
+        """Loaders batching requests of single users, groups and posts"""
+        with self._lock:
+            if self._loaders is None:
+                self._loaders = Loaders(self)
+        return self._loaders
+
+    @property
+    def last_method_url(self):
+        """URL of the last method called by the current thread"""
+        return getattr(self._local, "last_method_url", None)
+
+    @last_method_url.setter
+    def last_method_url(self, value):
+        self._local.last_method_url = value
+
+    @property
+    def rate_limiter(self):
+        """Rate limiter every call has to pass through. Unless specified
+        explicitly, limiter is shared between all API instances
+        using the same access token"""
+        if self._rate_limiter is not None:
+            return self._rate_limiter
+        return ratelimit.get_shared_limiter(self._access_token,
+                                            delay=self.delay,
+                                            capacity=self.burst,
+                                            adaptive=self.adaptive_rate)
+
     def manage_settings(self):
         """Makes sure that settings file always exists"""
         if not self._use_settings:
@@ -194,32 +347,175 @@ class API(object):
 
         .. _method: https://new.vk.com/dev/methods
         """
-
-        # Calculate time difference between requests
-        # and prohibit API calls in single-threaded environment
-        second_time = time.time()
-        request_time_diff = second_time - self.first_time
-        if request_time_diff < conf.API_CALL_DELAY:
-            if not self._called_first_time:
-                time_to_sleep = conf.API_CALL_DELAY - request_time_diff
-                time.sleep(time_to_sleep + 0.01)
-            else:
-                self._called_first_time = True
-
         request_api_version = kwargs.get('v')
         if not request_api_version:
             kwargs["v"] = self.api_version
         if self._access_token:
             kwargs["access_token"] = self._access_token
 
+        cache = self.cache
+        if cache is not None:
+            r = cache.get(method_name, kwargs)
+            if r is not None:
+                return r
+        if self.single_flight is not None:
+            r = self.single_flight.call_method(method_name, kwargs,
+                                               self._fetch)
+        else:
+            r = self._fetch(method_name, kwargs)
+        if cache is not None:
+            cache.set(method_name, kwargs, r)
+        return r
+
+    def _fetch(self, method_name, params):
+        if self.retry_policy is None:
+            return self._send_request(method_name, params)
+        return self.retry_policy.call(self._send_request, method_name, params)
+
+    def _send_request(self, method_name, params, limiter=None):
         url = conf.API_BASE_URL + method_name
-        r = requests.get(url, params=kwargs)
+        if limiter is None:
+            limiter = self.rate_limiter
+        limiter.acquire()
+        try:
+            r = self.transport.get(url, params=params)
+        except requests.ConnectionError:
+            # Request has not reached VK, so the slot is not used up
+            limiter.release()
+            raise
+        r.raise_for_status()
         self.last_method_url = r.url
-        r = r.json()
+        r = self.json_loads(r.content)
         if "error" in r:
-            return process_error_response(self, r)
+            return process_error_response(self, r, limiter)
+        limiter.on_success()
         return r
 
+    def map(self, method, kwargs_iterable, workers=conf.MAP_WORKERS,
+            ordered=True, return_exceptions=False):
+        """Calls method with every set of parameters on the pool of
+        threads, all calls share API's rate limiter. Parameters are
+        consumed lazily and only a bounded number of calls is in flight.
+        Usage example:
+
+        >>> for r in api.map("users.get", ({"user_ids": i} for i in ids)):
+        ...     print(r["response"])
+
+        :param method: method name or method object, e.g. api.users.get
+        :param kwargs_iterable: iterable of method parameters dictionaries
+        :param workers: number of threads making calls
+        :param ordered: yield results in order of parameters,
+                        otherwise in order of completion
+        :param return_exceptions: yield exceptions instead of raising them
+        :type method: str or unicode or MethodChunk
+        :type kwargs_iterable: iterable
+        :type workers: int
+        :type ordered: bool
+        :type return_exceptions: bool
+        """
+        if isinstance(method, MethodChunk):
+            method = method.resolve_method_name()
+
+        def call(kwargs):
+            try:
+                return self.api_method(method, **kwargs)
+            except Exception as e:
+                if return_exceptions:
+                    return e
+                raise
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        max_pending = workers * 2
+        pending = deque() if ordered else set()
+        kwargs_iterator = iter(kwargs_iterable)
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    try:
+                        kwargs = next(kwargs_iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = executor.submit(call, kwargs)
+                    if ordered:
+                        pending.append(future)
+                    else:
+                        pending.add(future)
+                if not pending:
+                    break
+                if ordered:
+                    yield pending.popleft().result()
+                else:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def stream_items(self, method_name, **kwargs):
+        """Calls method and yields items of ``response.items`` one by one
+        while the response body is being read, so huge responses are
+        never kept in memory as a whole. Response cache, single-flight
+        and retry policy are not applied to streamed calls: items may be
+        yielded already, so HTTP errors and throttling errors are raised
+        to the caller instead of being retried.
+        Usage example:
+
+        >>> for member in api.stream_items("groups.getMembers", group_id=1,
+        ...                                count=1000, fields="city"):
+        ...     print(member["id"])
+
+        :param method_name: name of the VK API method to be called
+        :param kwargs: method parameters passed to method
+        :raises ValueError: if response is not an object with items array
+        """
+        if not kwargs.get('v'):
+            kwargs["v"] = self.api_version
+        if self._access_token:
+            kwargs["access_token"] = self._access_token
+        return self._stream_items(method_name, kwargs)
+
+    def _stream_items(self, method_name, params, limiter=None):
+        url = conf.API_BASE_URL + method_name
+        if limiter is None:
+            limiter = self.rate_limiter
+        limiter.acquire()
+        try:
+            r = self.transport.get(url, params=params, stream=True)
+        except requests.ConnectionError:
+            # Request has not reached VK, so the slot is not used up
+            limiter.release()
+            raise
+        with closing(r):
+            r.raise_for_status()
+            self.last_method_url = r.url
+            chunks = r.iter_content(chunk_size=conf.STREAM_CHUNK_SIZE)
+            try:
+                for item in jsonlib.iter_items(chunks):
+                    yield item
+            except jsonlib.StreamedErrorResponse as e:
+                process_error_response(self, e.response, limiter)
+                return
+        limiter.on_success()
+
+    def batch(self, max_size=conf.EXECUTE_MAX_CALLS, max_latency=None):
+        """Creates batch coalescing method calls into execute requests.
+        Usage example:
+
+        >>> with api.batch() as b:
+        ...     r = b.users.get(user_ids=1)
+        >>> r.result()
+
+        :param max_size: maximum number of calls inside a single execute
+        :param max_latency: time in seconds pending calls may wait to be sent
+        :rtype: vk_api.batch.Batch
+        """
+        from .batch import Batch
+        return Batch(self, max_size=max_size, max_latency=max_latency)
+
     @staticmethod
     def construct_auth_dialog_url(permissions=conf.DEFAULT_PERMISSIONS,
                                   api_version=conf.DEFAULT_API_VERSION,
@@ -249,60 +545,42 @@ response_type=token'.format(conf.AUTH_BASE_URL, app_id, perms, api_version)
 
     def __getattr__(self, attr):
         if attr in conf.METHOD_DOMAINS:
-            return MethodChunk(attr, api=self)
+            # Stored as instance attribute, so __getattr__ is not
+            # called on the subsequent accesses
+            return self.__dict__.setdefault(
+                attr, self.method_chunk_class(attr, api=self))
         return object.__getattr__(self, attr)
 
     def upload_photos_to_user_album(self, album_id,
                                     group_id="",
-                                    images=None):
-        """Uploads specified image files to the specified album"""
-        # TODO: if number of image files is greater then MAXIMUM number
-        # call upload function multiple times
+                                    images=None,
+                                    workers=conf.UPLOAD_WORKERS):
+        """Uploads specified image files to the specified album.
+        Any number of files may be passed, they are uploaded in groups
+        of conf.MAX_ALBUM_UPLOAD_IMAGES in parallel, see PhotoUploader.
+
+        :return: UploadResult of every file in the order of images
+        :rtype: list
+        """
         if not images:
-            return
-        for i in images:
-            assert os.path.exists(i) and os.path.isfile(i)
-        if len(images) > conf.MAX_ALBUM_UPLOAD_IMAGES:
-            msg = "Sending more than {} image files is now allowed."
-            print(msg.format(conf.MAX_ALBUM_UPLOAD_IMAGES))
-            return
-        if group_id:
-            upload_url_resp = self.photos.getUploadServer(album_id=album_id,
-                                                          group_id=group_id)
-        else:
-            upload_url_resp = self.photos.getUploadServer(album_id=album_id)
-
-        upload_url = upload_url_resp['response']['upload_url']
-
-        img_files = [open(f, 'rb') for f in images]
-        img_data = {'file{}'.format(i): f for i, f in enumerate(img_files)}
-
-        r = requests.post(upload_url, files=img_data)
-        [i.close() for i in img_files]
-        r = r.json()
-        if group_id:
-            self.photos.save(server=r['server'],
-                             photos_list=r['photos_list'],
-                             hash=r['hash'],
-                             album_id=album_id,
-                             group_id=group_id)
-        else:
-            self.photos.save(server=r['server'],
-                             photos_list=r['photos_list'],
-                             hash=r['hash'],
-                             album_id=album_id)
+            return []
+        from .upload import PhotoUploader
+        uploader = PhotoUploader(self, album_id, group_id=group_id,
+                                 workers=workers)
+        results = {r.path: r for r in uploader.upload(images)}
+        return [results[i] for i in images]
 
     def upload_profile_photo(self, photo, profile_id):
         upload_url_resp = self.photos.getOwnerPhotoUploadServer(owner_id=profile_id)
         upload_url = upload_url_resp['response']['upload_url']
         # TODO: handle _square_crop params
         assert os.path.exists(photo) and os.path.isfile(photo)
-        img_data = {'photo': open(photo, 'rb')}
-        r = requests.post(upload_url, files=img_data)
-        r = r.json()
-        self.photos.saveOwnerPhoto(server=r['server'],
-                                   hash=r['hash'],
-                                   photo=r['photo'])
+        with open(photo, 'rb') as f:
+            r = self.transport.post(upload_url, files={'photo': f})
+        r = self.json_loads(r.content)
+        return self.photos.saveOwnerPhoto(server=r['server'],
+                                          hash=r['hash'],
+                                          photo=r['photo'])
 
 
 def main():
@@ -0,0 +1,196 @@
+"""
+Coalescing of API calls into ``execute`` requests.
+
+VK allows up to 25 API calls to be done inside a single
+``execute`` request, which costs only one HTTP round trip
+and one rate limit slot.
+"""
+import json
+import threading
+from concurrent.futures import Future
+
+from . import conf
+from . import errorhandlers
+from . import vk_exceptions
+from .api import MethodChunk
+
+
+def _normalize_value(value):
+    """Sequences of IDs (lists, sets, IDList) are passed
+    as comma-separated strings, the same way requests sends them"""
+    if value is None or isinstance(value, (str, int, float, dict)):
+        return value
+    try:
+        return ",".join(str(v) for v in value)
+    except TypeError:
+        return value
+
+
+def compile_call(method_name, params):
+    """Compiles VKScript expression calling the method
+
+    :raises TypeError: if parameter value can not be encoded
+    """
+    params = {k: _normalize_value(v) for k, v in params.items()}
+    return "API.{}({})".format(method_name,
+                               json.dumps(params, ensure_ascii=False))
+
+
+def compile_execute_code(calls):
+    """Compiles VKScript code calling every method with its parameters
+    and returning list of their results
+
+    :param calls: sequence of (method_name, params) pairs
+    :type calls: list
+    :return: VKScript code to be passed to the execute method
+    :rtype: str or unicode
+    """
+    statements = [compile_call(method_name, params)
+                  for method_name, params in calls]
+    return "return [{}];".format(",".join(statements))
+
+
+class BatchCall(object):
+    __slots__ = ("method_name", "params", "future")
+
+    def __init__(self, method_name, params):
+        self.method_name = method_name
+        self.params = params
+        self.future = Future()
+
+
+class Batch(object):
+    """Collects API calls and sends them as few ``execute``
+    requests as possible. Every call returns a future which
+    gets either response dictionary (the same one ``api_method``
+    would return) or the API exception for that particular call.
+
+    Usage example:
+
+    >>> with api.batch() as b:
+    ...     first = b.users.get(user_ids=1)
+    ...     second = b.wall.get(owner_id=1)
+    >>> first.result()["response"]
+
+    Pending calls are sent when the context manager exits,
+    when ``max_size`` calls have been collected or, if ``max_latency``
+    is set, after that many seconds since the first pending call.
+
+    :param api: API object instance used to send execute requests
+    :param max_size: maximum number of calls inside a single execute
+    :param max_latency: time in seconds pending calls may wait to be sent
+    :type api: API
+    :type max_size: int
+    :type max_latency: float
+    """
+
+    def __init__(self, api, max_size=conf.EXECUTE_MAX_CALLS, max_latency=None):
+        if not 1 <= max_size <= conf.EXECUTE_MAX_CALLS:
+            msg = "Batch size should be between 1 and {}."
+            raise ValueError(msg.format(conf.EXECUTE_MAX_CALLS))
+        self._api = api
+        self.max_size = max_size
+        self.max_latency = max_latency
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def api_method(self, method_name, **kwargs):
+        """Schedules API method call
+
+        :param method_name: name of the VK API method to be called
+        :param kwargs: method parameters passed to method
+        :rtype: concurrent.futures.Future
+        """
+        call = BatchCall(method_name, kwargs)
+        with self._lock:
+            self._pending.append(call)
+            is_full = len(self._pending) >= self.max_size
+            if not is_full and self.max_latency and self._timer is None:
+                self._timer = threading.Timer(self.max_latency, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if is_full:
+            self.flush()
+        return call.future
+
+    def flush(self):
+        """Sends all pending calls"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for i in range(0, len(pending), self.max_size):
+            self._send(pending[i:i + self.max_size])
+
+    def cancel(self):
+        """Drops all pending calls without sending them"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for call in pending:
+            call.future.cancel()
+
+    def _send(self, calls):
+        statements = []
+        compiled = []
+        for call in calls:
+            # Call with parameters which can not be encoded fails
+            # alone, so the rest of the calls is still sent
+            try:
+                statements.append(compile_call(call.method_name, call.params))
+            except (TypeError, ValueError) as e:
+                call.future.set_exception(e)
+                continue
+            compiled.append(call)
+        if not compiled:
+            return
+        calls = compiled
+        code = "return [{}];".format(",".join(statements))
+        try:
+            r = self._api.api_method("execute", code=code)
+        except Exception as e:
+            for call in calls:
+                call.future.set_exception(e)
+            return
+        results = r.get("response") or [False] * len(calls)
+        errors = list(r.get("execute_errors", []))
+        for call, result in zip(calls, results):
+            if result is False:
+                error = self._pop_error(errors, call.method_name)
+                if error is not None:
+                    exc = errorhandlers.build_exception(error)
+                    call.future.set_exception(exc)
+                    continue
+            call.future.set_result({"response": result})
+        if len(results) < len(calls):
+            # Futures of calls without results would never be resolved
+            error = vk_exceptions.API_Error(
+                "execute returned {} results for {} calls.".format(
+                    len(results), len(calls)))
+            for call in calls[len(results):]:
+                call.future.set_exception(error)
+
+    @staticmethod
+    def _pop_error(errors, method_name):
+        for i, error in enumerate(errors):
+            if error.get("method") == method_name:
+                return errors.pop(i)
+        return None
+
+    def __getattr__(self, attr):
+        if attr in conf.METHOD_DOMAINS:
+            return self.__dict__.setdefault(attr, MethodChunk(attr, api=self))
+        return object.__getattribute__(self, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.cancel()
@@ -0,0 +1,303 @@
+"""
+Caching of responses of idempotent read methods.
+
+Only methods matching the allow-list of prefixes and having
+read-only action name (get*, search*, resolve*, ...) may be cached,
+so write methods like wall.post or messages.send are never cached.
+
+Responses are stored either in memory or in the SQLite database
+file which may be shared by several processes.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from . import conf
+
+from urllib.parse import urlencode
+
+
+def _match_prefix(method_name, prefixes):
+    """Returns the longest prefix the method name starts with"""
+    matched = None
+    for prefix in prefixes:
+        if method_name.startswith(prefix):
+            if matched is None or len(prefix) > len(matched):
+                matched = prefix
+    return matched
+
+
+def is_read_method(method_name):
+    """Check whether method only reads data, judging by its action name
+
+    :param method_name: full method name, e.g. users.get
+    :rtype: bool
+    """
+    action = method_name.rpartition(".")[2]
+    return action.startswith(conf.READ_METHOD_ACTIONS)
+
+
+def _normalize_value(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return ",".join(str(v) for v in value)
+    return str(value)
+
+
+def make_cache_key(method_name, params, ignore_token=False):
+    """Builds key identifying method call, parameters order
+    and value types do not matter
+
+    :param method_name: name of the called method
+    :param params: method parameters
+    :param ignore_token: do not include access token into the key
+    :type method_name: str or unicode
+    :type params: dict
+    :rtype: str or unicode
+    """
+    items = sorted((k, _normalize_value(v)) for k, v in params.items()
+                   if v is not None and
+                   not (ignore_token and k == "access_token"))
+    return "{}?{}".format(method_name, urlencode(items))
+
+
+class MemoryStorage(object):
+    """Thread-safe in-memory storage with LRU eviction.
+    Responses are kept serialized to JSON, so every get returns
+    a new copy which may be freely modified by the caller.
+
+    :param max_size: maximum number of stored entries
+    :type max_size: int
+    """
+
+    def __init__(self, max_size=conf.CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(value)
+
+    def set(self, key, value, expires_at):
+        value = json.dumps(value)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStorage(object):
+    """Persistent storage keeping compressed JSON responses in the
+    SQLite database file. Database is opened in WAL mode, so it may be
+    safely used by several threads and processes at once.
+    Once total size of stored responses exceeds ``max_bytes``,
+    expired and then least recently used entries are evicted.
+
+    :param path: path to the database file
+    :param max_bytes: maximum total size of compressed responses
+    :param compress_level: zlib compression level
+    :param timeout: seconds to wait for the database lock held by other process
+    :type path: str or unicode
+    :type max_bytes: int
+    :type compress_level: int
+    :type timeout: float
+    """
+
+    _schema = """CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    )"""
+
+    def __init__(self, path=conf.CACHE_SQLITE_FILE,
+                 max_bytes=conf.CACHE_SQLITE_MAX_BYTES,
+                 compress_level=6,
+                 timeout=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as c:
+            c.execute(self._schema)
+            c.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                      "ON responses (accessed_at)")
+
+    def _connection(self):
+        """Returns connection owned by the current thread"""
+        c = getattr(self._local, "connection", None)
+        if c is None:
+            c = sqlite3.connect(self.path, timeout=self.timeout)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = c
+        return c
+
+    @staticmethod
+    def _hash_key(key):
+        # Keys contain access tokens which should not be stored as is
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def get(self, key, now):
+        key = self._hash_key(key)
+        with self._connection() as c:
+            row = c.execute("SELECT value, expires_at FROM responses "
+                            "WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                c.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            c.execute("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                      (now, key))
+        return json.loads(zlib.decompress(value).decode("utf-8"))
+
+    def set(self, key, value, expires_at):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        data = sqlite3.Binary(zlib.compress(data, self.compress_level))
+        with self._connection() as c:
+            c.execute("INSERT OR REPLACE INTO responses "
+                      "(key, value, size, expires_at, accessed_at) "
+                      "VALUES (?, ?, ?, ?, ?)",
+                      (self._hash_key(key), data, len(data), expires_at,
+                       time.time()))
+        self._writes += 1
+        if self._writes % conf.CACHE_SQLITE_EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self, now=None):
+        """Removes expired entries and, if the storage is still too big,
+        least recently used entries"""
+        now = time.time() if now is None else now
+        with self._connection() as c:
+            c.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            total = c.execute("SELECT COALESCE(SUM(size), 0) "
+                              "FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = c.execute("SELECT key, size FROM responses "
+                             "ORDER BY accessed_at, rowid")
+            to_delete = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                total -= size
+            c.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def clear(self):
+        with self._connection() as c:
+            c.execute("DELETE FROM responses")
+
+    def close(self):
+        c = getattr(self._local, "connection", None)
+        if c is not None:
+            c.close()
+            self._local.connection = None
+
+    def __len__(self):
+        with self._connection() as c:
+            return c.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache(object):
+    """Response cache used by API.api_method.
+
+    :param storage: storage backend, in-memory LRU storage by default
+    :param ttl: default time to live of the cached response in seconds
+    :param method_ttls: mapping of method name prefixes to their TTLs
+    :param cacheable_prefixes: method name prefixes allowed to be cached
+    :param public_prefixes: prefixes of methods whose responses do not
+                            depend on the access token
+    :type ttl: float
+    :type method_ttls: dict
+    :type cacheable_prefixes: tuple
+    :type public_prefixes: tuple
+    """
+
+    def __init__(self,
+                 storage=None,
+                 ttl=conf.CACHE_DEFAULT_TTL,
+                 method_ttls=None,
+                 cacheable_prefixes=conf.CACHEABLE_METHOD_PREFIXES,
+                 public_prefixes=conf.PUBLIC_METHOD_PREFIXES,
+                 clock=time.time):
+        self.storage = storage if storage is not None else MemoryStorage()
+        self.ttl = ttl
+        self.method_ttls = dict(conf.CACHE_METHOD_TTLS)
+        if method_ttls:
+            self.method_ttls.update(method_ttls)
+        self.cacheable_prefixes = tuple(cacheable_prefixes)
+        self.public_prefixes = tuple(public_prefixes)
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def is_cacheable(self, method_name):
+        return (_match_prefix(method_name, self.cacheable_prefixes) is not None
+                and is_read_method(method_name))
+
+    def get_ttl(self, method_name):
+        prefix = _match_prefix(method_name, self.method_ttls)
+        return self.method_ttls[prefix] if prefix is not None else self.ttl
+
+    def make_key(self, method_name, params):
+        is_public = _match_prefix(method_name, self.public_prefixes) is not None
+        return make_cache_key(method_name, params, ignore_token=is_public)
+
+    def get(self, method_name, params):
+        """Returns cached response or None if there is no
+        cached response or method can not be cached"""
+        if not self.is_cacheable(method_name):
+            return None
+        value = self.storage.get(self.make_key(method_name, params),
+                                 self._clock())
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, method_name, params, response):
+        if not self.is_cacheable(method_name):
+            return
+        expires_at = self._clock() + self.get_ttl(method_name)
+        self.storage.set(self.make_key(method_name, params), response,
+                         expires_at)
+
+    def clear(self):
+        self.storage.clear()
+
+    def stats(self):
+        """Returns cache hit/miss counters
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
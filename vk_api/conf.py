@@ -1,4 +1,12 @@
 API_CALL_DELAY = 0.36
+# Number of requests that may be sent at once before delay applies
+API_CALL_BURST = 1
+# Adaptive rate limiter settings, rates are in requests per second
+ADAPTIVE_MIN_RATE = 0.5
+ADAPTIVE_MAX_RATE = 20
+ADAPTIVE_RATE_INCREASE = 0.05
+ADAPTIVE_RATE_DECREASE = 0.5
+ADAPTIVE_RATE_COOLDOWN = 1
 API_BASE_URL = "https://api.vk.com/method/"
 AUTH_BASE_URL = "https://oauth.vk.com/authorize?"
 APP_ID = "4169750"
@@ -10,13 +18,111 @@ DEFAULT_PERMISSIONS = ("friends", "photos", "audio", "video", "status",
                        "wall", "messages",)
 MAX_ALBUM_UPLOAD_IMAGES = 5
 MAX_WALL_UPLOAD_IMAGES = 6
+# Number of upload requests sent at once by PhotoUploader
+UPLOAD_WORKERS = 4
+# Size of chunks files are streamed in when uploaded
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Number of files downloaded at once by Downloader
+DOWNLOAD_WORKERS = 8
+# Size of chunks downloaded files are written in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Number of per-host connection pools kept by Downloader, media
+# is served from many CDN hosts
+DOWNLOAD_POOL_CONNECTIONS = 32
+# Maximum number of API calls allowed inside single execute request
+EXECUTE_MAX_CALLS = 25
+
+# Maximum number of IDs accepted by methods in a single call
+USERS_GET_MAX_IDS = 1000
+GROUPS_GET_MAX_IDS = 500
+WALL_GET_MAX_IDS = 100
+# Time in seconds loaders collect IDs before sending them
+LOADER_WAIT = 0.01
+
+# JSON libraries used to decode responses, in order of preference
+JSON_LIBRARIES = ("orjson", "ujson", "simplejson")
+# Size of chunks read when response is decoded incrementally
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Time in seconds Long Poll server holds request open
+LONGPOLL_WAIT = 25
+# Extra time in seconds to wait for Long Poll response before timing out
+LONGPOLL_TIMEOUT_MARGIN = 10
+# Return attachments, extended events and random_id
+LONGPOLL_MODE = 2 | 8 | 128
+LONGPOLL_VERSION = 3
+# Delay in seconds before reconnecting to Long Poll server after
+# network error, doubled after every failed attempt up to the maximum
+LONGPOLL_RECONNECT_DELAY = 1
+LONGPOLL_RECONNECT_MAX_DELAY = 60
+
+# Number of posts requested per call by incremental sync
+WALL_SYNC_PAGE_SIZE = 100
+NEWSFEED_SYNC_PAGE_SIZE = 100
+
+# Maximum number of friends returned by a single friends.get call
+FRIENDS_GET_MAX_COUNT = 5000
+# Size in bytes of pages of the bitmap of users seen by the graph crawler
+GRAPH_BITMAP_PAGE_SIZE = 8192
+# Number of IDs read at once from graph files
+GRAPH_READ_CHUNK = 1 << 20
+
+# Page size used to fetch ID lists, maximum for most methods returning IDs
+IDS_PAGE_SIZE = 1000
+# Number of IDs sorted at once when IDList is built
+IDLIST_SORT_CHUNK = 1000000
+
+# Default number of threads used by API.map
+MAP_WORKERS = 4
+
+DEFAULT_PAGE_SIZE = 100
+# Number of pages fetched in background ahead of the consumer
+PAGINATION_PREFETCH = 2
+
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 10
+# Total connection limit of the asyncio transport
+AIO_POOL_MAXSIZE = 100
+# (connect, read) timeouts in seconds
+HTTP_TIMEOUT = (5, 30)
 
 AUTH_ERROR_CODE = 5
 CAPTCHA_ERROR_CODE = 14
 
+# Too many requests per second and flood control
+THROTTLE_ERROR_CODES = (6, 9)
+# Time in seconds tokens hitting flood limits are not used by token pool
+TOKEN_SIDELINE_TIME = 60
+# Too many requests per second, flood control and internal server error
+RETRYABLE_ERROR_CODES = (6, 9, 10)
+RETRYABLE_HTTP_STATUSES = (429, 500, 502, 503, 504)
+RETRY_MAX_RETRIES = 5
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 30
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_PER_SECOND = 1
+RETRY_BUDGET_CAPACITY = 10
+
 METHOD_DOMAINS = {"users", "auth", "wall", "photos", "friends", "widgets",
                   "storage", "status", "audio", "pages", "groups", "board",
                   "video", "notes", "places", "account", "messages",
                   "newsfeed", "likes", "polls", "docs", "fave",
                   "notifications", "stats", "search", "apps", "utils",
                   "database", "gifts", "execute", "market"}
+
+# Response cache settings
+CACHE_MAX_SIZE = 10000
+CACHE_DEFAULT_TTL = 300
+CACHEABLE_METHOD_PREFIXES = ("users.get", "groups.getById", "database.",
+                             "utils.resolveScreenName", "utils.getServerTime")
+# Methods whose responses do not depend on the access token
+PUBLIC_METHOD_PREFIXES = ("database.", "utils.resolveScreenName")
+CACHE_METHOD_TTLS = {"database.": 86400,
+                     "utils.resolveScreenName": 3600,
+                     "utils.getServerTime": 1}
+CACHE_SQLITE_FILE = "vk_api_cache.sqlite"
+CACHE_SQLITE_MAX_BYTES = 256 * 1024 * 1024
+# Number of writes between checks of the SQLite cache size
+CACHE_SQLITE_EVICT_EVERY = 100
+# Action names of methods which only read data
+READ_METHOD_ACTIONS = ("get", "search", "resolve", "is", "check")
@@ -0,0 +1,275 @@
+"""
+Bulk downloads of media returned by the API.
+
+Photos, documents and videos found in response items (including
+attachments of posts and messages) are downloaded in parallel over
+pooled connections. Files are written to ``.part`` files first and
+renamed once complete, interrupted downloads are resumed with Range
+requests.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import closing
+
+from . import conf
+from .transport import HTTPTransport
+
+# Photo size types from the smallest to the largest
+PHOTO_SIZE_TYPES = "smopqrxyzw"
+# Keys of photo URLs in objects of the old API versions
+_PHOTO_URL_KEYS = ("photo_2560", "photo_1280", "photo_807",
+                   "photo_604", "photo_130", "photo_75")
+
+
+def _size_rank(size):
+    area = (size.get("width") or 0) * (size.get("height") or 0)
+    return area, PHOTO_SIZE_TYPES.find(size.get("type", ""))
+
+
+def best_photo_url(photo):
+    """Returns URL of the largest variant of the photo
+
+    :param photo: photo object
+    :type photo: dict
+    :rtype: str or unicode or None
+    """
+    sizes = photo.get("sizes")
+    if sizes:
+        size = max(sizes, key=_size_rank)
+        return size.get("url") or size.get("src")
+    for key in _PHOTO_URL_KEYS:
+        if photo.get(key):
+            return photo[key]
+    return None
+
+
+def best_video_url(video):
+    """Returns URL of the largest video file, available only
+    for videos of the current user or application
+
+    :rtype: str or unicode or None
+    """
+    files = video.get("files") or {}
+    mp4 = [(int(k[4:]), url) for k, url in files.items()
+           if k.startswith("mp4_") and k[4:].isdigit()]
+    return max(mp4)[1] if mp4 else None
+
+
+def _media_name(obj, ext):
+    return "{}_{}.{}".format(obj.get("owner_id"), obj.get("id"), ext)
+
+
+def iter_media(items):
+    """Yields (url, file_name) pairs of media found in the items.
+    Items may be photos, documents, videos, attachments or any
+    objects having ``attachments`` (posts, comments, messages),
+    ``copy_history`` or ``fwd_messages``.
+
+    :param items: response items or typed records
+    :type items: iterable
+    """
+    for item in items:
+        if hasattr(item, "to_dict"):
+            item = item.to_dict()
+        if "type" in item and item.get("type") in item:
+            # Attachment: {"type": "photo", "photo": {...}}
+            kind, obj = item["type"], item[item["type"]]
+        elif "sizes" in item or "photo_604" in item or "photo_130" in item:
+            kind, obj = "photo", item
+        elif "ext" in item and "url" in item:
+            kind, obj = "doc", item
+        elif "files" in item:
+            kind, obj = "video", item
+        else:
+            kind, obj = None, item
+
+        if kind == "photo":
+            url = best_photo_url(obj)
+            if url:
+                yield url, _media_name(obj, "jpg")
+        elif kind == "doc":
+            yield obj["url"], _media_name(obj, obj.get("ext") or "bin")
+        elif kind == "video":
+            url = best_video_url(obj)
+            if url:
+                yield url, _media_name(obj, "mp4")
+
+        for key in ("attachments", "copy_history", "fwd_messages"):
+            if obj.get(key):
+                for media in iter_media(obj[key]):
+                    yield media
+
+
+class DownloadResult(object):
+    """Outcome of a single download
+
+    :ivar url: URL of the file
+    :ivar path: path the file has been written to
+    :ivar size: number of bytes received during this download
+    :ivar seconds: time spent downloading
+    :ivar error: exception raised while downloading, if any
+    """
+
+    __slots__ = ("url", "path", "size", "seconds", "error")
+
+    def __init__(self, url, path, size=0, seconds=0.0, error=None):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def bytes_per_second(self):
+        return self.size / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return "DownloadResult({!r}, ok={})".format(self.path, self.ok)
+
+
+class Downloader(object):
+    """Downloads media files in parallel.
+    Usage example:
+
+    >>> photos = api.photos.get(album_id="wall")["response"]["items"]
+    >>> downloader = Downloader()
+    >>> for result in downloader.download(photos, "photos"):
+    ...     print(result.path, result.bytes_per_second)
+    >>> downloader.stats()
+
+    :param transport: HTTP transport, by default the one pooling
+                      ``workers`` connections to every host is created
+    :param workers: number of files downloaded at once
+    :param chunk_size: size of chunks written to disk
+    :type transport: vk_api.transport.HTTPTransport
+    :type workers: int
+    :type chunk_size: int
+    """
+
+    def __init__(self, transport=None, workers=conf.DOWNLOAD_WORKERS,
+                 chunk_size=conf.DOWNLOAD_CHUNK_SIZE):
+        if transport is None:
+            transport = HTTPTransport(
+                pool_connections=conf.DOWNLOAD_POOL_CONNECTIONS,
+                pool_maxsize=workers)
+        self.transport = transport
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._stats = {"files": 0, "failed": 0, "bytes": 0}
+        self._started = None
+
+    def stats(self):
+        """Returns number of downloaded and failed files,
+        received bytes and overall throughput
+
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            started = self._started
+        elapsed = time.time() - started if started is not None else 0.0
+        stats["seconds"] = elapsed
+        stats["bytes_per_second"] = stats["bytes"] / elapsed if elapsed else 0.0
+        return stats
+
+    def download_file(self, url, path):
+        """Downloads a single file, resuming previously interrupted
+        download if ``path + '.part'`` exists. Existing files are skipped.
+
+        :rtype: DownloadResult
+        """
+        if os.path.exists(path):
+            return DownloadResult(url, path)
+        part_path = path + ".part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": "bytes={}-".format(offset)} if offset else {}
+        started = time.time()
+        size = 0
+        r = self.transport.get(url, headers=headers, stream=True)
+        with closing(r):
+            if r.status_code == 416 and offset:
+                # The part file is complete already
+                pass
+            else:
+                r.raise_for_status()
+                mode = "ab" if offset and r.status_code == 206 else "wb"
+                with open(part_path, mode) as f:
+                    for chunk in r.iter_content(self.chunk_size):
+                        f.write(chunk)
+                        size += len(chunk)
+        os.replace(part_path, path)
+        return DownloadResult(url, path, size, time.time() - started)
+
+    def _download(self, url, path):
+        try:
+            result = self.download_file(url, path)
+        except Exception as e:
+            result = DownloadResult(url, path, error=e)
+        with self._lock:
+            if result.ok:
+                self._stats["files"] += 1
+                self._stats["bytes"] += result.size
+            else:
+                self._stats["failed"] += 1
+        return result
+
+    def download(self, items, directory):
+        """Downloads media found in the items into the directory,
+        yielding DownloadResult in order of completion. Items are
+        consumed lazily and only a bounded number of downloads is
+        in flight. Errors are reported in results instead of being raised.
+
+        :param items: response items, see iter_media
+        :param directory: directory files are written to
+        :type items: iterable
+        :type directory: str or unicode
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._lock:
+            if self._started is None:
+                self._started = time.time()
+        media = iter_media(items)
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        max_pending = self.workers * 2
+        pending = set()
+        seen = set()
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    try:
+                        url, name = next(media)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    path = os.path.join(directory, name)
+                    if path in seen:
+                        continue
+                    seen.add(path)
+                    pending.add(executor.submit(self._download, url, path))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
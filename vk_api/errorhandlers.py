@@ -1,24 +1,46 @@
-import sys
-import inspect
 import webbrowser
 
-import requests
-
 from . import vk_exceptions
 
+_handlers = {}
+
+
+def register_handler(error_code, handler_cls):
+    """Registers handler class for the specified error code,
+    previously registered handler is replaced.
+    Handler is instantiated with API object and error response
+    and should implement ``handle`` method.
+
+    :param error_code: API error code
+    :param handler_cls: handler class
+    :type error_code: int
+    """
+    _handlers[int(error_code)] = handler_cls
+
 
 def get_handler_by_error_code(error_code):
-    module_classes = inspect.getmembers(sys.modules[__name__], inspect.isclass)
-    print(module_classes)
-    handlers = (h[1] for h in module_classes
-                if hasattr(h[1], 'ERROR_CODE'))
-    handler = None
-    for h in handlers:
-        if int(h.ERROR_CODE) == int(error_code):
-            handler = h
-    if handler is None:
-        handler = DefaultHandler
-    return handler
+    """Returns handler class registered for the error code,
+    otherwise returns DefaultHandler
+
+    :param error_code: API error code
+    :type error_code: int
+    """
+    return _handlers.get(int(error_code), DefaultHandler)
+
+
+def build_exception(error_response):
+    """Creates exception instance corresponding to the error response
+
+    :param error_response: error dictionary containing error code and message
+    :type error_response: dict
+    :rtype: vk_exceptions.API_Error
+    """
+    error_code = error_response["error_code"]
+    err_cls = vk_exceptions.get_exception_class_by_code(error_code)
+    err_msg = "Error code {}\n".format(error_code)
+    err_msg += err_cls.error_msg
+    err_msg += error_response['error_msg']
+    return err_cls(err_msg)
 
 
 class CaptchaHandler(object):
@@ -39,7 +61,7 @@ class CaptchaHandler(object):
             new_method_url = "{}&captcha_sid={}&captcha_key={}".format(*args)
 
             # FIXME: this logic is completely broken!
-            r = requests.get(new_method_url)
+            r = self.vk.transport.get(new_method_url)
             if "error" not in r:
                 self.last_method_url = new_method_url
                 return r.json()
@@ -55,9 +77,7 @@ class DefaultHandler(object):
         self.error_response = error_response
 
     def handle(self):
-        error_code = self.error_response["error_code"]
-        err_cls = vk_exceptions.get_exception_class_by_code(error_code)
-        err_msg = "Error code {}\n".format(error_code)
-        err_msg += err_cls.error_msg
-        err_msg += self.error_response['error_msg']
-        raise err_cls(err_msg)
+        raise build_exception(self.error_response)
+
+
+register_handler(CaptchaHandler.ERROR_CODE, CaptchaHandler)
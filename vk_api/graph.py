@@ -0,0 +1,420 @@
+"""
+Breadth-first crawler of the friends graph.
+
+Friend lists are requested through ``execute`` batches, so every
+request carries up to 25 friends.get calls and passes through the
+API rate limiter. The graph is written to disk in compressed sparse
+row (CSR) format: ``nodes.bin`` holds IDs of crawled users,
+``offsets.bin`` positions of their friend lists in ``edges.bin``.
+All three are plain int64 arrays which may be memory-mapped.
+
+The frontier is kept in int64 array files, one per BFS level, and the
+set of seen users is a sparse bitmap. Progress is checkpointed after
+every batch, so a stopped crawl is resumed by calling ``crawl`` again.
+
+Usage example:
+
+>>> crawler = FriendsCrawler(api, "graph", max_depth=2)
+>>> graph = crawler.crawl(seeds=[1])
+>>> graph.neighbors(1)
+"""
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_left
+
+from . import conf
+from . import vk_exceptions
+from .idlist import IDList
+from .sync import CheckpointStore
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+NODES_FILE = "nodes.bin"
+OFFSETS_FILE = "offsets.bin"
+EDGES_FILE = "edges.bin"
+LEVEL_FILE = "level-{}.bin"
+STATE_FILE = "state.json"
+ITEM_SIZE = array("q").itemsize
+
+# Users whose friends can not be fetched, they are kept as nodes without edges
+SKIPPED_ERRORS = (vk_exceptions.AccessDeniedError,
+                  vk_exceptions.UserDeletedError,
+                  vk_exceptions.PrivateProfileError,
+                  vk_exceptions.InvalidUserID)
+
+
+class IDBitmap(object):
+    """Set of non-negative integer IDs kept as sparse bitmap,
+    one bit per ID in pages allocated on the first use.
+
+    :param ids: initial IDs
+    :param page_size: size of a single page in bytes
+    :type ids: iterable
+    :type page_size: int
+    """
+
+    __slots__ = ("_pages", "_page_bits", "_count")
+
+    def __init__(self, ids=(), page_size=conf.GRAPH_BITMAP_PAGE_SIZE):
+        self._pages = {}
+        self._page_bits = page_size * 8
+        self._count = 0
+        self.update(ids)
+
+    def add(self, object_id):
+        """Adds ID to the set
+
+        :return: True if ID has not been in the set
+        :rtype: bool
+        """
+        if object_id < 0:
+            raise ValueError("Only non-negative IDs are supported.")
+        page_no, bit = divmod(object_id, self._page_bits)
+        page = self._pages.get(page_no)
+        if page is None:
+            page = self._pages[page_no] = bytearray(self._page_bits // 8)
+        byte, mask = bit >> 3, 1 << (bit & 7)
+        if page[byte] & mask:
+            return False
+        page[byte] |= mask
+        self._count += 1
+        return True
+
+    def update(self, ids):
+        for i in ids:
+            self.add(i)
+
+    def __contains__(self, object_id):
+        if object_id < 0:
+            return False
+        page_no, bit = divmod(object_id, self._page_bits)
+        page = self._pages.get(page_no)
+        return page is not None and bool(page[bit >> 3] & (1 << (bit & 7)))
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        """Memory used by pages"""
+        return len(self._pages) * self._page_bits // 8
+
+
+def _read_array(path, chunk_items=conf.GRAPH_READ_CHUNK):
+    """Yields int64 arrays read from the file chunk by chunk"""
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_items * ITEM_SIZE)
+            if not data:
+                break
+            chunk = array("q")
+            chunk.frombytes(data)
+            yield chunk
+
+
+def _truncate(path, items):
+    with open(path, "ab") as f:
+        if f.tell() < items * ITEM_SIZE:
+            raise ValueError("{} is shorter than saved in the checkpoint, "
+                             "crawl can not be resumed.".format(path))
+        f.truncate(items * ITEM_SIZE)
+
+
+class CSRGraph(object):
+    """Graph stored in CSR files written by FriendsCrawler. Arrays are
+    memory-mapped and exposed as int64 memoryviews, so opening the graph
+    does not read it into memory.
+
+    :param directory: directory containing graph files
+    :type directory: str or unicode
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._mmaps = []
+        self.nodes = self._map(NODES_FILE)
+        self.offsets = self._map(OFFSETS_FILE)
+        self.edges = self._map(EDGES_FILE)
+        self._sorted_nodes = None
+        self._positions = None
+
+    def _map(self, name):
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return memoryview(array("q"))
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmaps.append(mm)
+        return memoryview(mm).cast("q")
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def edge_count(self):
+        return len(self.edges)
+
+    def neighbors_at(self, index):
+        """Returns friends of the index-th crawled user"""
+        return self.edges[self.offsets[index]:self.offsets[index + 1]]
+
+    def index(self, node_id):
+        """Returns position of the user among crawled nodes
+
+        :raises KeyError: if the user has not been crawled
+        """
+        if self._sorted_nodes is None:
+            order = sorted(range(len(self.nodes)), key=self.nodes.__getitem__)
+            self._positions = array("q", order)
+            self._sorted_nodes = array("q", (self.nodes[i] for i in order))
+        i = bisect_left(self._sorted_nodes, node_id)
+        if i == len(self._sorted_nodes) or self._sorted_nodes[i] != node_id:
+            raise KeyError(node_id)
+        return self._positions[i]
+
+    def neighbors(self, node_id):
+        """Returns sorted friends of the crawled user
+
+        :rtype: IDList
+        """
+        return IDList(self.neighbors_at(self.index(node_id)),
+                      assume_sorted=True)
+
+    def iter_edges(self):
+        """Yields (user_id, friend_id) pairs"""
+        nodes, offsets, edges = self.nodes, self.offsets, self.edges
+        for i in range(len(nodes)):
+            for j in range(offsets[i], offsets[i + 1]):
+                yield nodes[i], edges[j]
+
+    def to_numpy(self):
+        """Returns (nodes, offsets, edges) numpy arrays sharing
+        memory with the mapped files"""
+        if numpy is None:
+            raise ImportError("numpy is required to export graph to numpy.")
+        return tuple(numpy.frombuffer(a, dtype=numpy.int64)
+                     for a in (self.nodes, self.offsets, self.edges))
+
+    def close(self):
+        for view in (self.nodes, self.offsets, self.edges):
+            view.release()
+        for mm in self._mmaps:
+            mm.close()
+        self._mmaps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FriendsCrawler(object):
+    """Breadth-first crawler of the friends graph. Users up to
+    ``max_depth`` friendships away from the seeds are crawled, edges
+    to the users beyond that depth are kept as well.
+
+    :param api: API object instance
+    :param directory: directory graph files and checkpoint are written to
+    :param max_depth: depth of the crawl, 1 crawls seeds and their friends
+    :param max_nodes: maximum number of users crawled, crawl may be
+                      continued with greater limit later
+    :param batch_size: number of friends.get calls inside single execute
+    :param page_size: number of friends requested per friends.get call
+    :type api: API
+    :type directory: str or unicode
+    :type max_depth: int
+    :type max_nodes: int
+    :type batch_size: int
+    :type page_size: int
+    """
+
+    def __init__(self, api, directory, max_depth=1, max_nodes=None,
+                 batch_size=conf.EXECUTE_MAX_CALLS,
+                 page_size=conf.FRIENDS_GET_MAX_COUNT):
+        self._api = api
+        self.directory = directory
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.batch_size = batch_size
+        self.page_size = page_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.store = CheckpointStore(self._path(STATE_FILE))
+        self._stop = threading.Event()
+        self.seen = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def state(self):
+        return self.store.get("crawl")
+
+    def stop(self):
+        """Stops the crawl after the current batch, may be
+        called from the other thread"""
+        self._stop.set()
+
+    def stats(self):
+        """Returns progress of the crawl
+
+        :rtype: dict
+        """
+        state = self.state or {}
+        return {"depth": state.get("depth", 0),
+                "nodes": state.get("nodes", 0),
+                "edges": state.get("edges", 0),
+                "failed": state.get("failed", 0),
+                "queued": state.get("next", 0),
+                "finished": state.get("finished", False)}
+
+    def _start(self, seeds):
+        seeds = IDList(seeds)
+        with open(self._path(LEVEL_FILE.format(0)), "wb") as f:
+            seeds.array.tofile(f)
+        for name in (NODES_FILE, EDGES_FILE, LEVEL_FILE.format(1)):
+            open(self._path(name), "wb").close()
+        with open(self._path(OFFSETS_FILE), "wb") as f:
+            array("q", [0]).tofile(f)
+        state = {"depth": 0, "position": 0, "nodes": 0, "edges": 0,
+                 "next": 0, "failed": 0, "finished": False}
+        self.store.set("crawl", state)
+        return state
+
+    def _restore(self, state):
+        """Drops data written after the checkpoint and rebuilds the set
+        of seen users: every seen user is either crawled or queued"""
+        depth = state["depth"]
+        _truncate(self._path(NODES_FILE), state["nodes"])
+        _truncate(self._path(OFFSETS_FILE), state["nodes"] + 1)
+        _truncate(self._path(EDGES_FILE), state["edges"])
+        _truncate(self._path(LEVEL_FILE.format(depth + 1)), state["next"])
+        self.seen = IDBitmap()
+        for name in (NODES_FILE, LEVEL_FILE.format(depth),
+                     LEVEL_FILE.format(depth + 1)):
+            for chunk in _read_array(self._path(name)):
+                self.seen.update(chunk)
+
+    def fetch_friends(self, user_ids):
+        """Fetches friends of the users using execute batches
+
+        :return: mapping of user IDs to arrays of their friends,
+                 None for users whose friends are not available
+        :rtype: dict
+        """
+        friends = {uid: array("q") for uid in user_ids}
+        tasks = [(uid, 0) for uid in user_ids]
+        while tasks:
+            with self._api.batch(max_size=self.batch_size) as b:
+                calls = [(uid, offset, b.friends.get(user_id=uid,
+                                                     offset=offset,
+                                                     count=self.page_size))
+                         for uid, offset in tasks]
+            tasks = []
+            for uid, offset, future in calls:
+                try:
+                    r = future.result()["response"]
+                except SKIPPED_ERRORS:
+                    friends[uid] = None
+                    continue
+                friends[uid].extend(r["items"])
+                if r["items"] and offset + self.page_size < r["count"]:
+                    tasks.append((uid, offset + self.page_size))
+        return friends
+
+    def crawl(self, seeds=()):
+        """Crawls the graph starting from the seeds or resumes
+        the previously stopped crawl, seeds are ignored then.
+
+        :param seeds: IDs of users the crawl starts from
+        :type seeds: iterable
+        :rtype: CSRGraph
+        """
+        self._stop.clear()
+        state = self.state
+        if state is None:
+            state = self._start(seeds)
+        if not state["finished"]:
+            self._restore(state)
+            self._run(state)
+        return CSRGraph(self.directory)
+
+    def _run(self, state):
+        files = {name: open(self._path(name), "ab")
+                 for name in (NODES_FILE, OFFSETS_FILE, EDGES_FILE)}
+        try:
+            while not state["finished"]:
+                if not self._crawl_level(state, files):
+                    return
+                self._next_level(state)
+        finally:
+            for f in files.values():
+                f.close()
+
+    def _crawl_level(self, state, files):
+        """Crawls users of the current level
+
+        :return: False if crawl has been stopped before the level ended
+        """
+        depth = state["depth"]
+        frontier = array("q")
+        with open(self._path(LEVEL_FILE.format(depth)), "rb") as f:
+            frontier.frombytes(f.read())
+        expand = depth < self.max_depth
+        with open(self._path(LEVEL_FILE.format(depth + 1)), "ab") as next_file:
+            all_files = list(files.values()) + [next_file]
+            while state["position"] < len(frontier):
+                limit = self.batch_size
+                if self.max_nodes is not None:
+                    limit = min(limit, self.max_nodes - state["nodes"])
+                if limit <= 0 or self._stop.is_set():
+                    return False
+                position = state["position"]
+                chunk = frontier[position:position + limit]
+                friends = self.fetch_friends(chunk)
+
+                nodes, offsets = array("q"), array("q")
+                edges, queued = array("q"), array("q")
+                for uid in chunk:
+                    ids = friends[uid]
+                    if ids is None:
+                        state["failed"] += 1
+                    else:
+                        ids = IDList(ids).array
+                        edges.extend(ids)
+                        if expand:
+                            queued.extend(i for i in ids if self.seen.add(i))
+                    nodes.append(uid)
+                    offsets.append(state["edges"] + len(edges))
+
+                nodes.tofile(files[NODES_FILE])
+                offsets.tofile(files[OFFSETS_FILE])
+                edges.tofile(files[EDGES_FILE])
+                queued.tofile(next_file)
+                for f in all_files:
+                    f.flush()
+                    os.fsync(f.fileno())
+                state["position"] += len(chunk)
+                state["nodes"] += len(chunk)
+                state["edges"] += len(edges)
+                state["next"] += len(queued)
+                self.store.set("crawl", state)
+        return True
+
+    def _next_level(self, state):
+        depth = state["depth"]
+        if depth >= self.max_depth or not state["next"]:
+            state["finished"] = True
+        else:
+            state.update(depth=depth + 1, position=0, next=0)
+            open(self._path(LEVEL_FILE.format(depth + 2)), "wb").close()
+        self.store.set("crawl", state)
+        os.unlink(self._path(LEVEL_FILE.format(depth)))
+        if state["finished"]:
+            os.unlink(self._path(LEVEL_FILE.format(depth + 1)))
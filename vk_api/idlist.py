@@ -0,0 +1,173 @@
+"""
+Compact collections of integer IDs.
+
+Methods like friends.get, groups.getMembers or likes.getList return
+huge lists of IDs. Kept as Python lists every ID costs about 36 bytes,
+while IDList stores them in a sorted ``array('q')`` using 8 bytes per ID.
+"""
+import heapq
+from array import array
+from bisect import bisect_left
+
+from . import conf
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def _unique(sorted_ids):
+    """Drops duplicates from the sorted iterable of IDs"""
+    result = array("q")
+    last = None
+    for i in sorted_ids:
+        if i != last:
+            result.append(i)
+            last = i
+    return result
+
+
+def _sorted_unique(ids, chunk_size=conf.IDLIST_SORT_CHUNK):
+    """Sorts array of IDs dropping duplicates. Array is sorted
+    in chunks which are then merged, so only a single chunk is
+    kept as a list of Python ints at any time."""
+    chunks = []
+    for i in range(0, len(ids), chunk_size):
+        chunks.append(array("q", sorted(ids[i:i + chunk_size])))
+    return _unique(chunks[0] if len(chunks) == 1 else heapq.merge(*chunks))
+
+
+class IDList(object):
+    """Sorted set of integer IDs backed by ``array('q')``.
+    Supports fast membership tests, set operations and zero-copy
+    export of the underlying buffer.
+    Usage example:
+
+    >>> friends = IDList.from_iterable(api.friends.get.iter(user_id=1))
+    >>> 5 in friends
+    >>> common = friends & IDList.from_iterable(api.friends.get.iter(user_id=2))
+
+    :param ids: iterable of integer IDs
+    :param assume_sorted: IDs are already sorted and unique
+    :type ids: iterable
+    :type assume_sorted: bool
+    """
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids=(), assume_sorted=False):
+        if not isinstance(ids, array) or ids.typecode != "q":
+            ids = array("q", ids)
+        if not assume_sorted and ids:
+            ids = _sorted_unique(ids)
+        self._ids = ids
+
+    @classmethod
+    def from_iterable(cls, ids):
+        """Builds list from any iterable, e.g. generator of IDs,
+        without creating an intermediate list
+
+        :rtype: IDList
+        """
+        result = array("q")
+        result.extend(ids)
+        return cls(result)
+
+    @classmethod
+    def from_response(cls, response):
+        """Builds list from API response containing IDs
+
+        :param response: response of e.g. friends.get method
+        :type response: dict
+        :rtype: IDList
+        """
+        items = response["response"]
+        if isinstance(items, dict):
+            items = items["items"]
+        return cls(items)
+
+    @classmethod
+    def frombytes(cls, data):
+        """Restores list from the bytes returned by tobytes
+
+        :rtype: IDList
+        """
+        ids = array("q")
+        ids.frombytes(data)
+        return cls(ids, assume_sorted=True)
+
+    @property
+    def array(self):
+        """Underlying sorted array, should not be modified"""
+        return self._ids
+
+    def memoryview(self):
+        """Returns read-only memoryview of the IDs without copying them"""
+        return memoryview(self._ids).toreadonly()
+
+    def tobytes(self):
+        return self._ids.tobytes()
+
+    def to_numpy(self):
+        """Returns numpy array sharing memory with the list"""
+        if numpy is None:
+            raise ImportError("numpy is required to export IDs to numpy.")
+        return numpy.frombuffer(self._ids, dtype=numpy.int64)
+
+    def __contains__(self, object_id):
+        ids = self._ids
+        i = bisect_left(ids, object_id)
+        return i < len(ids) and ids[i] == object_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __getitem__(self, index):
+        return self._ids[index]
+
+    def __eq__(self, other):
+        if isinstance(other, IDList):
+            return self._ids == other._ids
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "IDList({} ids)".format(len(self._ids))
+
+    def intersection(self, other):
+        """Returns IDs present in both lists
+
+        :rtype: IDList
+        """
+        small, large = sorted((self, other), key=len)
+        result = array("q", (i for i in small._ids if i in large))
+        return IDList(result, assume_sorted=True)
+
+    def difference(self, other):
+        """Returns IDs not present in the other list
+
+        :rtype: IDList
+        """
+        result = array("q", (i for i in self._ids if i not in other))
+        return IDList(result, assume_sorted=True)
+
+    def union(self, other):
+        """Returns IDs present in any of the lists
+
+        :rtype: IDList
+        """
+        return IDList(_unique(heapq.merge(self._ids, other._ids)),
+                      assume_sorted=True)
+
+    __and__ = intersection
+    __sub__ = difference
+    __or__ = union
@@ -0,0 +1,179 @@
+"""
+JSON decoding of API responses.
+
+The fastest installed JSON library (orjson, ujson, simplejson)
+is used to decode responses, falling back to the standard json module.
+Huge responses may also be decoded incrementally, yielding items of
+``response.items`` one by one as the body is read from the network.
+"""
+import codecs
+import json
+import re
+
+from . import conf
+
+
+def _import_loads(name):
+    try:
+        module = __import__(name)
+    except ImportError:
+        return None
+    return module.loads
+
+
+def get_loads(preferred=conf.JSON_LIBRARIES):
+    """Returns loads function of the first installed library
+
+    :param preferred: names of JSON libraries in order of preference
+    :type preferred: tuple
+    """
+    for name in preferred:
+        loads = _import_loads(name)
+        if loads is not None:
+            return loads
+    return json.loads
+
+
+loads = get_loads()
+
+_separators_re = re.compile(r'[\s,]*')
+_error_re = re.compile(r'\s*\{\s*"error"')
+_response_re = re.compile(r'\s*\{\s*"response"\s*:\s*')
+_first_name_re = re.compile(r'\s*\{\s*"((?:[^"\\]|\\.)*)"')
+_member_re = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*')
+
+
+class StreamedErrorResponse(Exception):
+    """Raised by iter_items when API returned error response,
+    decoded response is available as ``response`` attribute"""
+
+    def __init__(self, response):
+        super(StreamedErrorResponse, self).__init__(response)
+        self.response = response
+
+
+class _StreamBuffer(object):
+    """Text buffer filled from the stream of bytes chunks,
+    consumed part is dropped whenever more data is read"""
+
+    def __init__(self, chunks, encoding):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.text += self.decoder.decode(chunk)
+                return True
+        self.text += self.decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def read_all(self):
+        while self.read_more():
+            pass
+        return self.text
+
+
+def _unexpected_end(buf):
+    if not buf.read_more():
+        raise ValueError("Unexpected end of JSON document.")
+
+
+def _seek_array(buf, key, raw_decoder):
+    """Moves buffer position past the opening bracket of ``response.key``
+    array. Only scalar members may precede the array, so the response
+    is never read into memory as a whole."""
+    # Beginning of the response object
+    while True:
+        if _error_re.match(buf.text):
+            raise StreamedErrorResponse(json.loads(buf.read_all()))
+        match = _response_re.match(buf.text)
+        if match is not None and match.end() < len(buf.text):
+            if buf.text[match.end()] != "{":
+                raise ValueError("Response is not an object with "
+                                 "{!r} array.".format(key))
+            buf.pos = match.end() + 1
+            break
+        match = _first_name_re.match(buf.text)
+        head = buf.text.lstrip()[:1]
+        if head not in ("", "{") or \
+                (match is not None and match.group(1) != "response"):
+            raise ValueError("Document is not an API response.")
+        if not buf.read_more():
+            raise ValueError("Document is not an API response.")
+
+    # Members of the response preceding the array
+    while True:
+        pos = _separators_re.match(buf.text, buf.pos).end()
+        if pos >= len(buf.text):
+            _unexpected_end(buf)
+            continue
+        if buf.text[pos] == "}":
+            raise ValueError("Response has no {!r} array.".format(key))
+        match = _member_re.match(buf.text, pos)
+        if match is None or match.end() >= len(buf.text):
+            _unexpected_end(buf)
+            continue
+        name = json.loads('"{}"'.format(match.group(1)))
+        start = match.end()
+        if name == key:
+            if buf.text[start] != "[":
+                raise ValueError("Response {!r} is not an array.".format(key))
+            buf.pos = start + 1
+            return
+        if buf.text[start] in "[{":
+            raise ValueError("Response {!r} array has to precede other "
+                             "arrays and objects.".format(key))
+        try:
+            _, end = raw_decoder.raw_decode(buf.text, start)
+        except ValueError:
+            end = None
+        if end is None or (end >= len(buf.text) and not buf.eof):
+            _unexpected_end(buf)
+            continue
+        buf.pos = end
+
+
+def iter_items(chunks, key="items", encoding="utf-8"):
+    """Yields elements of ``response.key`` array of the API response,
+    e.g. items of ``{"response": {"count": 2, "items": [...]}}``,
+    reading the document chunk by chunk. Only the current element
+    and the unparsed rest of the last chunk are kept in memory.
+
+    :param chunks: iterable of bytes chunks of the JSON document
+    :param key: name of the array to be iterated over
+    :param encoding: document encoding
+    :type chunks: iterable
+    :type key: str or unicode
+    :raises StreamedErrorResponse: if document is an error response
+    :raises ValueError: if response is not an object having the array,
+        or the array is preceded by other arrays or objects
+    """
+    buf = _StreamBuffer(chunks, encoding)
+    raw_decoder = json.JSONDecoder()
+    _seek_array(buf, key, raw_decoder)
+
+    while True:
+        buf.pos = _separators_re.match(buf.text, buf.pos).end()
+        if buf.pos >= len(buf.text):
+            _unexpected_end(buf)
+            continue
+        if buf.text[buf.pos] == "]":
+            return
+        try:
+            item, end = raw_decoder.raw_decode(buf.text, buf.pos)
+        except ValueError:
+            end = None
+        # Element at the very end of the buffer (e.g. number) may
+        # be incomplete, so it is parsed again with more data
+        if end is None or (end >= len(buf.text) and not buf.eof):
+            _unexpected_end(buf)
+            continue
+        buf.pos = end
+        yield item
@@ -0,0 +1,184 @@
+"""
+DataLoader-style batching of requests for single objects.
+
+Loaders collect individual object IDs requested during a short
+time window and fetch them with a single call of the method
+accepting comma-separated list of IDs (users.get, groups.getById, ...).
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from . import conf
+from .cache import make_cache_key
+
+
+class _PendingBatch(object):
+    __slots__ = ("params", "futures", "timer")
+
+    def __init__(self, params):
+        self.params = params
+        self.futures = OrderedDict()
+        self.timer = None
+
+
+class Loader(object):
+    """Base loader class. Subclasses define which method is called,
+    which parameter holds the list of IDs and how the ID of every
+    returned object is determined.
+
+    :param api: API object instance used to make calls
+    :param wait: time in seconds requests are collected before being sent
+    :param max_batch_size: maximum number of IDs sent in a single call
+    :type api: API
+    :type wait: float
+    :type max_batch_size: int
+    """
+    method_name = None
+    ids_param = None
+    max_batch_size = None
+
+    def __init__(self, api, wait=conf.LOADER_WAIT, max_batch_size=None):
+        self._api = api
+        self.wait = wait
+        if max_batch_size is not None:
+            self.max_batch_size = max_batch_size
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_id(object_id):
+        return int(object_id)
+
+    @staticmethod
+    def get_id(item):
+        return item["id"]
+
+    def load(self, object_id, **params):
+        """Requests single object, which will be fetched together
+        with other objects requested with the same parameters.
+
+        :param object_id: ID of the object to be loaded
+        :param params: additional method parameters, e.g. fields
+        :return: future resolved with object dictionary or None
+                 if the object was not returned by VK
+        :rtype: concurrent.futures.Future
+        """
+        object_id = self.normalize_id(object_id)
+        key = make_cache_key(self.method_name, params)
+        to_dispatch = None
+        with self._lock:
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = _PendingBatch(params)
+                if self.wait:
+                    batch.timer = threading.Timer(self.wait, self._dispatch_key,
+                                                  args=(key,))
+                    batch.timer.daemon = True
+                    batch.timer.start()
+            future = batch.futures.get(object_id)
+            if future is None:
+                future = batch.futures[object_id] = Future()
+            if len(batch.futures) >= self.max_batch_size or not self.wait:
+                to_dispatch = self._pop_batch(key)
+        if to_dispatch is not None:
+            self._send(to_dispatch)
+        return future
+
+    def load_many(self, object_ids, **params):
+        """Requests several objects at once
+
+        :rtype: list of concurrent.futures.Future
+        """
+        return [self.load(object_id, **params) for object_id in object_ids]
+
+    def dispatch(self):
+        """Sends all pending requests without waiting"""
+        with self._lock:
+            batches = [self._pop_batch(key) for key in list(self._batches)]
+        for batch in batches:
+            self._send(batch)
+
+    def _pop_batch(self, key):
+        batch = self._batches.pop(key)
+        if batch.timer is not None:
+            batch.timer.cancel()
+        return batch
+
+    def _dispatch_key(self, key):
+        with self._lock:
+            if key not in self._batches:
+                return
+            batch = self._pop_batch(key)
+        self._send(batch)
+
+    def _send(self, batch):
+        ids = list(batch.futures)
+        params = dict(batch.params)
+        params[self.ids_param] = ",".join(str(i) for i in ids)
+        try:
+            r = self._api.api_method(self.method_name, **params)
+        except Exception as e:
+            for future in batch.futures.values():
+                future.set_exception(e)
+            return
+        items = r["response"]
+        if isinstance(items, dict):
+            items = items.get("items", items.get("groups", []))
+        found = {}
+        for item in items:
+            found[self.get_id(item)] = item
+        for object_id, future in batch.futures.items():
+            future.set_result(found.get(object_id))
+
+
+class UsersLoader(Loader):
+    method_name = "users.get"
+    ids_param = "user_ids"
+    max_batch_size = conf.USERS_GET_MAX_IDS
+
+
+class GroupsLoader(Loader):
+    method_name = "groups.getById"
+    ids_param = "group_ids"
+    max_batch_size = conf.GROUPS_GET_MAX_IDS
+
+    @staticmethod
+    def normalize_id(object_id):
+        return abs(int(object_id))
+
+
+class PostsLoader(Loader):
+    """Loads wall posts by their full IDs, e.g. "-1_340364" """
+    method_name = "wall.getById"
+    ids_param = "posts"
+    max_batch_size = conf.WALL_GET_MAX_IDS
+
+    @staticmethod
+    def normalize_id(object_id):
+        owner_id, post_id = str(object_id).split("_")
+        return "{}_{}".format(int(owner_id), int(post_id))
+
+    @staticmethod
+    def get_id(item):
+        return "{}_{}".format(item["owner_id"], item["id"])
+
+
+class Loaders(object):
+    """Namespace of loaders bound to the API instance,
+    available as ``api.loaders``.
+    Usage example:
+
+    >>> user = api.loaders.users.load(1, fields="city")
+    >>> user.result()["first_name"]
+    """
+
+    def __init__(self, api, wait=conf.LOADER_WAIT):
+        self.users = UsersLoader(api, wait=wait)
+        self.groups = GroupsLoader(api, wait=wait)
+        self.posts = PostsLoader(api, wait=wait)
+
+    def dispatch(self):
+        """Sends pending requests of every loader"""
+        for loader in (self.users, self.groups, self.posts):
+            loader.dispatch()
@@ -0,0 +1,262 @@
+"""
+Long Poll clients receiving events as soon as they happen.
+
+Instead of polling methods like messages.getHistory, the client keeps
+a request to the Long Poll server open until new events arrive.
+Only obtaining the server address goes through the API and its rate
+limiter, polling requests are sent directly over the own connection.
+
+Usage example:
+
+>>> for event in LongPoll(api).listen():
+...     if event.type == "message_new":
+...         print(event.object["text"])
+
+Network errors and timeouts do not stop ``listen``, it reconnects
+with growing delay instead.
+"""
+import logging
+import time
+
+import requests
+
+from . import conf
+from . import vk_exceptions
+from .transport import HTTPTransport
+
+# Event codes of the user Long Poll, version 3
+USER_EVENT_TYPES = {
+    1: "message_flags_replace",
+    2: "message_flags_set",
+    3: "message_flags_reset",
+    4: "message_new",
+    5: "message_edit",
+    6: "message_read_in",
+    7: "message_read_out",
+    8: "friend_online",
+    9: "friend_offline",
+    10: "chat_flags_reset",
+    11: "chat_flags_replace",
+    12: "chat_flags_set",
+    13: "messages_delete",
+    14: "messages_restore",
+    51: "chat_edit",
+    52: "chat_update",
+    61: "user_typing",
+    62: "user_typing_in_chat",
+    63: "users_typing_in_chat",
+    64: "users_recording_audio",
+    70: "user_call",
+    80: "messages_counter",
+    114: "notifications_settings",
+}
+# Fields of message_new and message_edit events
+MESSAGE_EVENT_FIELDS = ("message_id", "flags", "peer_id", "timestamp",
+                        "text", "extra", "attachments", "random_id")
+
+
+class LongPollError(vk_exceptions.API_Error):
+    """Raised when Long Poll server returns unrecoverable error"""
+
+    def __init__(self, failed):
+        super(LongPollError, self).__init__(
+            "Long Poll request failed with code {}.".format(failed))
+        self.failed = failed
+
+
+class Event(object):
+    """Long Poll event
+
+    :ivar type: name of the event type, or its code if it is unknown
+    :ivar object: event data, dictionary for message and community events
+    :ivar raw: event as it has been returned by the server
+    """
+
+    __slots__ = ("type", "object", "raw")
+
+    def __init__(self, type, object, raw):
+        self.type = type
+        self.object = object
+        self.raw = raw
+
+    def __repr__(self):
+        return "Event({!r})".format(self.type)
+
+
+class LongPoll(object):
+    """User Long Poll client built on messages.getLongPollServer.
+    Server, key and ts are obtained again automatically when
+    the server asks for it.
+
+    :param api: API object instance
+    :param wait: time in seconds the server holds request open
+    :param mode: bitmask of additional data to be returned
+    :param version: Long Poll version
+    :param transport: HTTP transport polling requests are sent with
+    :param sleep: function used to wait before reconnecting
+    :type api: API
+    :type wait: int
+    :type mode: int
+    :type version: int
+    :type transport: vk_api.transport.HTTPTransport
+    """
+
+    server_method = "messages.getLongPollServer"
+    # Errors after which listen reconnects instead of raising
+    transient_errors = (requests.ConnectionError, requests.Timeout)
+
+    def __init__(self, api, wait=conf.LONGPOLL_WAIT, mode=conf.LONGPOLL_MODE,
+                 version=conf.LONGPOLL_VERSION, transport=None,
+                 sleep=time.sleep):
+        self._api = api
+        self._sleep = sleep
+        self.wait = wait
+        self.mode = mode
+        self.version = version
+        self._transport = transport
+        self.server = None
+        self.key = None
+        self.ts = None
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            # Keeps a single persistent connection, read timeout
+            # has to be longer than the time server holds request
+            read_timeout = self.wait + conf.LONGPOLL_TIMEOUT_MARGIN
+            self._transport = HTTPTransport(
+                pool_maxsize=1, timeout=(conf.HTTP_TIMEOUT[0], read_timeout))
+        return self._transport
+
+    def server_params(self):
+        return {"lp_version": self.version}
+
+    def poll_url(self):
+        return "https://{}".format(self.server)
+
+    def poll_params(self):
+        return {"act": "a_check", "key": self.key, "ts": self.ts,
+                "wait": self.wait, "mode": self.mode, "version": self.version}
+
+    def set_server(self, response):
+        """Stores server and key from the response of the
+        server method, ts is kept unless it was lost"""
+        server = response["response"]
+        self.server = server["server"]
+        self.key = server["key"]
+        if self.ts is None:
+            self.ts = server["ts"]
+
+    def update_server(self):
+        self.set_server(self._api.api_method(self.server_method,
+                                             **self.server_params()))
+
+    def parse_event(self, update):
+        code = update[0]
+        if code in (4, 5):
+            obj = dict(zip(MESSAGE_EVENT_FIELDS, update[1:]))
+        else:
+            obj = update[1:]
+        return Event(USER_EVENT_TYPES.get(code, code), obj, update)
+
+    def process_response(self, response):
+        """Handles response of the Long Poll server
+
+        :return: list of events
+        :raises LongPollError: if error can not be recovered from
+        """
+        failed = response.get("failed")
+        if failed is None:
+            self.ts = response["ts"]
+            return [self.parse_event(u) for u in response["updates"]]
+        if failed == 1:
+            # Events history is outdated or partially lost
+            self.ts = response["ts"]
+        elif failed == 2:
+            # Key has expired
+            self.key = None
+        elif failed == 3:
+            # Information is lost, key and ts have to be requested again
+            self.key = None
+            self.ts = None
+        else:
+            raise LongPollError(failed)
+        return []
+
+    def check(self):
+        """Waits for the events and returns them, list may be
+        empty if no events have happened during ``wait`` seconds
+
+        :rtype: list
+        """
+        if self.key is None:
+            self.update_server()
+        r = self.transport.get(self.poll_url(), params=self.poll_params())
+        r.raise_for_status()
+        return self.process_response(self._api.json_loads(r.content))
+
+    def reconnect_delays(self):
+        """Yields delays before the consecutive reconnection attempts"""
+        delay = conf.LONGPOLL_RECONNECT_DELAY
+        while True:
+            yield delay
+            delay = min(delay * 2, conf.LONGPOLL_RECONNECT_MAX_DELAY)
+
+    def listen(self):
+        """Yields events as they arrive, never stops by itself"""
+        delays = self.reconnect_delays()
+        while True:
+            try:
+                events = self.check()
+            except self.transient_errors as e:
+                delay = next(delays)
+                logging.warning("Long Poll request failed: {}, reconnecting "
+                                "in {} s.".format(e, delay))
+                self._sleep(delay)
+                continue
+            delays = self.reconnect_delays()
+            for event in events:
+                yield event
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class GroupLongPoll(LongPoll):
+    """Community (Bots) Long Poll client built on groups.getLongPollServer.
+    Events are dictionaries with ``type`` and ``object``, e.g. message_new,
+    wall_post_new or group_join, enabled in the community settings.
+
+    :param api: API object instance with community access token
+    :param group_id: ID of the community
+    :param wait: time in seconds the server holds request open
+    :type group_id: int
+    """
+
+    server_method = "groups.getLongPollServer"
+
+    def __init__(self, api, group_id, wait=conf.LONGPOLL_WAIT, transport=None,
+                 sleep=time.sleep):
+        super(GroupLongPoll, self).__init__(api, wait=wait, transport=transport,
+                                            sleep=sleep)
+        self.group_id = group_id
+
+    def server_params(self):
+        return {"group_id": self.group_id}
+
+    def poll_url(self):
+        return self.server
+
+    def poll_params(self):
+        return {"act": "a_check", "key": self.key, "ts": self.ts,
+                "wait": self.wait}
+
+    def parse_event(self, update):
+        return Event(update.get("type"), update.get("object"), update)
@@ -0,0 +1,329 @@
+"""
+Typed records for the most common API objects.
+
+Decoded responses are nested dictionaries, each costing hundreds
+of bytes of hash table overhead. Records keep known fields in
+``__slots__``, which is about half the size of a dictionary.
+Nested objects (city, attachments, sizes etc.) are kept as they came
+and turned into records when any of them is accessed for the first
+time. The record then switches to the class reading decoded nested
+records straight from the slots, so repeated access costs the same
+as access to the plain field.
+Fields unknown to the record are kept in the ``_extra`` dictionary.
+
+Usage example:
+
+>>> users = api.users.get.records(user_ids="1,2", fields="city")
+>>> users[0].first_name, users[0].city.title
+>>> users[0].to_dict()
+"""
+
+_record_types = {}
+
+
+class _LazyField(object):
+    """Descriptor decoding nested objects of the record
+    into records (or lists of records) on the first access"""
+
+    __slots__ = ("name", "slot", "type_name", "member")
+
+    def __init__(self, name, type_name):
+        self.name = name
+        self.slot = "_" + name
+        self.type_name = type_name
+        self.member = None  # slot descriptor, set once class is built
+
+    def decode(self, obj):
+        value = self.member.__get__(obj)
+        if type(value) is dict:
+            value = _record_types[self.type_name].from_dict(value)
+            self.member.__set__(obj, value)
+        elif type(value) is list and value and type(value[0]) is dict:
+            record_cls = _record_types[self.type_name]
+            value = [record_cls.from_dict(i) for i in value]
+            self.member.__set__(obj, value)
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        for field in obj._lazy_fields:
+            field.decode(obj)
+        obj.__class__ = obj._decoded_cls
+        return self.member.__get__(obj)
+
+    def __set__(self, obj, value):
+        self.member.__set__(obj, value)
+
+
+class _DecodedRecord(object):
+    """Base of the record classes with every nested object decoded,
+    nested fields are read by slot descriptors directly"""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        if name in self._lazy_names:
+            # Assigned object is decoded on the next access
+            object.__setattr__(self, "__class__", self._record_cls)
+        object.__setattr__(self, name, value)
+
+
+class RecordType(type):
+    """Builds ``__slots__`` of the record from its ``fields``
+    and ``nested`` declarations"""
+
+    def __new__(mcs, name, bases, namespace):
+        fields = tuple(namespace.get("fields", ()))
+        nested = dict(namespace.get("nested", {}))
+        slots = {}
+        for field in fields:
+            slots[field] = field
+        for field, type_name in nested.items():
+            namespace[field] = _LazyField(field, type_name)
+            slots[field] = "_" + field
+        namespace["__slots__"] = (tuple(namespace.get("__slots__", ())) +
+                                  tuple(slots.values()))
+        namespace["_slots_by_field"] = slots
+        namespace["_field_names"] = frozenset(slots)
+        cls = super(RecordType, mcs).__new__(mcs, name, bases, namespace)
+        for field in nested:
+            namespace[field].member = cls.__dict__["_" + field]
+        cls._record_cls = cls
+        lazy_fields = {}
+        for klass in reversed(cls.__mro__):
+            for attr, value in vars(klass).items():
+                if isinstance(value, _LazyField):
+                    lazy_fields[attr] = value
+        cls._lazy_fields = tuple(lazy_fields.values())
+        if lazy_fields:
+            decoded = {field_name: field.member
+                       for field_name, field in lazy_fields.items()}
+            decoded.update(__slots__=(), __module__=cls.__module__,
+                           __qualname__=cls.__qualname__,
+                           _lazy_names=frozenset(lazy_fields))
+            # Built by type, so it is not registered as a record type
+            cls._decoded_cls = type.__new__(mcs, name, (_DecodedRecord, cls),
+                                            decoded)
+        _record_types[name] = cls
+        return cls
+
+
+class Record(object, metaclass=RecordType):
+    """Base class of records. Missing known fields are ``None``
+    and are omitted by ``to_dict``, unknown ones are looked up
+    in ``_extra``.
+
+    Subclasses declare ``fields``, names of plain fields, and ``nested``,
+    mapping of field names to names of record types of nested objects.
+    """
+
+    __slots__ = ("_extra",)
+
+    fields = ()
+    nested = {}
+
+    def __init__(self, **fields):
+        self._fill(fields)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds record from the decoded API object
+
+        :type data: dict
+        """
+        record = cls.__new__(cls)
+        record._fill(data)
+        return record
+
+    def _fill(self, data):
+        get = data.get
+        for field, slot in self._slots_by_field.items():
+            setattr(self, slot, get(field))
+        if self._field_names.issuperset(data):
+            self._extra = None
+        else:
+            names = self._field_names
+            self._extra = {k: v for k, v in data.items() if k not in names}
+
+    def __getattr__(self, name):
+        # Called only for names which are not fields of the record
+        try:
+            extra = object.__getattribute__(self, "_extra")
+        except AttributeError:
+            extra = None
+        if extra and name in extra:
+            return extra[name]
+        raise AttributeError("{} has no field '{}'".format(
+            type(self).__name__, name))
+
+    def to_dict(self):
+        """Converts record and its nested records back to dictionaries
+
+        :rtype: dict
+        """
+        result = {}
+        for field, slot in self._slots_by_field.items():
+            value = object.__getattribute__(self, slot)
+            if value is None:
+                continue
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif isinstance(value, list) and value and \
+                    isinstance(value[0], Record):
+                value = [i.to_dict() for i in value]
+            result[field] = value
+        if self._extra:
+            result.update(self._extra)
+        return result
+
+    def __eq__(self, other):
+        if isinstance(other, Record) and \
+                self._record_cls is other._record_cls:
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Class with decoded nested objects is not importable
+        return self._record_cls.from_dict, (self.to_dict(),)
+
+    def __repr__(self):
+        field = self.fields[0]
+        return "{}({}={!r})".format(type(self).__name__, field,
+                                    getattr(self, field))
+
+
+class City(Record):
+    fields = ("id", "title")
+
+
+class Country(Record):
+    fields = ("id", "title")
+
+
+class LastSeen(Record):
+    fields = ("time", "platform")
+
+
+class Counter(Record):
+    """Likes, comments, reposts or views of the object"""
+    fields = ("count", "user_likes", "can_like", "can_publish", "can_post",
+              "groups_can_post", "user_reposted")
+
+
+class PhotoSize(Record):
+    fields = ("type", "url", "width", "height")
+
+
+class Attachment(Record):
+    fields = ("type", "video", "audio", "doc", "link", "poll", "sticker")
+    nested = {"photo": "Photo", "wall": "Post"}
+
+    @property
+    def item(self):
+        """Attached object itself"""
+        return getattr(self, self.type)
+
+
+class User(Record):
+    fields = ("id", "first_name", "last_name", "deactivated", "is_closed",
+              "can_access_closed", "sex", "screen_name", "domain", "bdate",
+              "status", "online", "verified", "followers_count",
+              "photo_50", "photo_100", "photo_200", "photo_max")
+    nested = {"city": "City", "country": "Country", "last_seen": "LastSeen"}
+
+
+class Group(Record):
+    fields = ("id", "name", "screen_name", "is_closed", "deactivated",
+              "type", "is_member", "members_count", "activity",
+              "description", "verified", "photo_50", "photo_100", "photo_200")
+    nested = {"city": "City", "country": "Country"}
+
+
+class Photo(Record):
+    fields = ("id", "album_id", "owner_id", "user_id", "text", "date",
+              "width", "height", "access_key", "post_id")
+    nested = {"sizes": "PhotoSize", "likes": "Counter",
+              "comments": "Counter", "reposts": "Counter"}
+
+
+class Post(Record):
+    fields = ("id", "owner_id", "from_id", "created_by", "date", "text",
+              "post_type", "signer_id", "reply_owner_id", "reply_post_id",
+              "friends_only", "marked_as_ads", "is_pinned", "is_favorite",
+              "postponed_id")
+    nested = {"attachments": "Attachment", "copy_history": "Post",
+              "comments": "Counter", "likes": "Counter",
+              "reposts": "Counter", "views": "Counter"}
+
+
+class Comment(Record):
+    fields = ("id", "from_id", "owner_id", "post_id", "date", "text",
+              "reply_to_user", "reply_to_comment", "parents_stack",
+              "deleted")
+    nested = {"attachments": "Attachment", "likes": "Counter"}
+
+
+class Message(Record):
+    fields = ("id", "date", "peer_id", "from_id", "text", "random_id",
+              "conversation_message_id", "out", "important", "is_hidden",
+              "update_time", "payload", "ref", "ref_source")
+    nested = {"attachments": "Attachment", "fwd_messages": "Message",
+              "reply_message": "Message"}
+
+
+METHOD_RECORDS = {
+    "users.get": User,
+    "users.search": User,
+    "friends.get": User,
+    "groups.get": Group,
+    "groups.getById": Group,
+    "groups.getMembers": User,
+    "groups.search": Group,
+    "wall.get": Post,
+    "wall.getById": Post,
+    "wall.search": Post,
+    "wall.getComments": Comment,
+    "photos.get": Photo,
+    "photos.getAll": Photo,
+    "photos.getById": Photo,
+    "messages.getHistory": Message,
+    "messages.getById": Message,
+}
+
+
+def record_type_for(method_name):
+    """Returns record type of objects returned by the method
+
+    :raises ValueError: if method has no known record type
+    """
+    try:
+        return METHOD_RECORDS[method_name]
+    except KeyError:
+        raise ValueError("No record type is known for the method {}, "
+                         "pass it explicitly.".format(method_name))
+
+
+def from_response(response, record_cls):
+    """Converts objects of the API response to records.
+    Returns list of records for list responses (including the ones
+    wrapped into ``{"count": ..., "items": [...]}``) or a single record.
+
+    :param response: response dictionary returned by api_method
+    :param record_cls: record type of the objects
+    :type response: dict
+    :type record_cls: type
+    """
+    body = response["response"]
+    if isinstance(body, dict) and "items" in body:
+        body = body["items"]
+    elif isinstance(body, dict) and "groups" in body:
+        body = body["groups"]
+    if isinstance(body, list):
+        return [record_cls.from_dict(i) for i in body]
+    return record_cls.from_dict(body)
@@ -0,0 +1,211 @@
+"""
+Lazy iteration over offset/count paginated API methods.
+
+Methods like wall.get, friends.get or groups.getMembers return
+``{"count": total, "items": [...]}`` responses and accept ``offset``
+and ``count`` parameters. Iterators defined here yield such items
+one by one while the following pages are fetched in background.
+
+Bulk iterators fetch many pages per HTTP request by generating
+VKScript loop executed on VK side with the execute method.
+"""
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import conf
+from . import vk_exceptions
+
+
+def iterate_pages(fetch_page, page_size=conf.DEFAULT_PAGE_SIZE,
+                  prefetch=conf.PAGINATION_PREFETCH, offset=0, limit=None):
+    """Yields items of every page returned by ``fetch_page``.
+
+    Up to ``prefetch`` following pages are requested in background
+    threads while the current one is being consumed, so at most
+    ``prefetch + 1`` pages are kept in memory at any time.
+
+    :param fetch_page: callable accepting offset and count, returning
+                       (total_count, items) pair
+    :param page_size: number of items requested per page
+    :param prefetch: number of pages fetched ahead of the consumer
+    :param offset: offset of the first item to be returned
+    :param limit: maximum number of items to be returned
+    :type fetch_page: callable
+    :type page_size: int
+    :type prefetch: int
+    :type offset: int
+    :type limit: int
+    """
+    first_count = page_size if limit is None else min(page_size, limit)
+    if first_count <= 0:
+        return
+    total, items = fetch_page(offset, first_count)
+    end = total if limit is None else min(total, offset + limit)
+
+    executor = ThreadPoolExecutor(max_workers=prefetch) if prefetch > 0 else None
+    pending = deque()
+    next_offset = offset + first_count
+    try:
+        while True:
+            while executor is not None and len(pending) < prefetch \
+                    and next_offset < end:
+                count = min(page_size, end - next_offset)
+                pending.append(executor.submit(fetch_page, next_offset, count))
+                next_offset += count
+
+            for item in items:
+                yield item
+
+            if not items:
+                break
+            if pending:
+                _, items = pending.popleft().result()
+            elif executor is None and next_offset < end:
+                count = min(page_size, end - next_offset)
+                _, items = fetch_page(next_offset, count)
+                next_offset += count
+            else:
+                break
+    finally:
+        for future in pending:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def iterate_method(api, method_name, page_size=conf.DEFAULT_PAGE_SIZE,
+                   prefetch=conf.PAGINATION_PREFETCH, offset=0, limit=None,
+                   **kwargs):
+    """Yields items returned by the paginated API method.
+    Usage example:
+
+    >>> for post in iterate_method(api, "wall.get", owner_id=1):
+    ...     print(post["id"])
+
+    :param api: API object instance used to make calls
+    :param method_name: name of the VK API method to be called
+    :param kwargs: method parameters passed to every call
+    :type api: API
+    :type method_name: str or unicode
+    """
+    def fetch_page(page_offset, count):
+        r = api.api_method(method_name, offset=page_offset, count=count,
+                           **kwargs)
+        r = r["response"]
+        return r["count"], r["items"]
+
+    return iterate_pages(fetch_page, page_size=page_size, prefetch=prefetch,
+                         offset=offset, limit=limit)
+
+
+def compile_pagination_code(method_name, params, offset, page_size, pages):
+    """Compiles VKScript code calling paginated method ``pages`` times
+    and returning all collected items in a single response
+
+    :param method_name: name of the paginated method
+    :param params: method parameters, apart from offset and count
+    :param offset: offset of the first page
+    :param page_size: number of items requested per call
+    :param pages: number of calls made by the script
+    :rtype: str or unicode
+    """
+    args = ["{}: {}".format(json.dumps(k), json.dumps(v, ensure_ascii=False))
+            for k, v in sorted(params.items())]
+    args.append('"count": {}'.format(page_size))
+    args.append('"offset": {} + i * {}'.format(offset, page_size))
+    code = """var i = 0;
+var total = 0;
+var items = [];
+while (i < {pages}) {{
+    var r = API.{method}({{{args}}});
+    total = r.count;
+    items = items + r.items;
+    if (r.items.length == 0) {{
+        i = {pages};
+    }}
+    i = i + 1;
+}}
+return {{"count": total, "items": items}};"""
+    return code.format(pages=pages, method=method_name, args=", ".join(args))
+
+
+class BulkPageFetcher(object):
+    """Fetches ranges of the paginated method with execute requests
+    making up to 25 calls each. Number of calls per request is
+    halved whenever VK refuses to run the script (e.g. when the
+    response is too big) and slowly grows back after successful calls.
+
+    :param api: API object instance used to make calls
+    :param method_name: name of the paginated method
+    :param page_size: number of items requested by every inner call
+    :param max_pages: maximum number of inner calls per execute request
+    :param params: method parameters passed to every inner call
+    """
+
+    def __init__(self, api, method_name, page_size,
+                 max_pages=conf.EXECUTE_MAX_CALLS, params=None):
+        self.api = api
+        self.method_name = method_name
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.pages = max_pages
+        self.params = params or {}
+
+    def _execute(self, offset, count):
+        pages = min(self.pages, -(-count // self.page_size))
+        page_size = min(self.page_size, count)
+        code = compile_pagination_code(self.method_name, self.params,
+                                       offset, page_size, pages)
+        r = self.api.api_method("execute", code=code)["response"]
+        return r["count"], r["items"][:count]
+
+    def __call__(self, offset, count):
+        """Fetches ``count`` items starting at ``offset``
+
+        :return: (total_count, items) pair
+        :rtype: tuple
+        """
+        total, items = 0, []
+        end = offset + count
+        while offset < end:
+            pages = self.pages
+            span = min(end - offset, pages * self.page_size)
+            try:
+                total, chunk = self._execute(offset, span)
+            except vk_exceptions.ExecuteRuntimeError:
+                if pages == 1:
+                    raise
+                self.pages = max(pages // 2, 1)
+                continue
+            self.pages = min(self.pages + 1, self.max_pages)
+            items.extend(chunk)
+            offset += span
+            end = min(end, total)
+            if not chunk:
+                break
+        return total, items
+
+
+def iterate_method_bulk(api, method_name, page_size=conf.DEFAULT_PAGE_SIZE,
+                        prefetch=conf.PAGINATION_PREFETCH, offset=0,
+                        limit=None, max_pages=conf.EXECUTE_MAX_CALLS,
+                        **kwargs):
+    """Yields items returned by the paginated API method, fetching up
+    to ``max_pages`` pages per HTTP request with execute method.
+    Usage example:
+
+    >>> members = iterate_method_bulk(api, "groups.getMembers",
+    ...                               group_id=1, page_size=1000)
+
+    :param api: API object instance used to make calls
+    :param method_name: name of the VK API method to be called
+    :param max_pages: maximum number of method calls per execute request
+    :param kwargs: method parameters passed to every call
+    :type api: API
+    :type method_name: str or unicode
+    """
+    fetch_page = BulkPageFetcher(api, method_name, page_size,
+                                 max_pages=max_pages, params=kwargs)
+    return iterate_pages(fetch_page, page_size=page_size * max_pages,
+                         prefetch=prefetch, offset=offset, limit=limit)
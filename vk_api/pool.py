@@ -0,0 +1,176 @@
+"""
+Spreading API calls over several access tokens.
+
+Every token has its own rate limit, so having a pool of tokens
+multiplies the number of calls that may be done per second.
+"""
+import threading
+import time
+
+from . import conf
+from . import ratelimit
+from . import vk_exceptions
+from .api import API
+
+
+class NoTokensAvailable(vk_exceptions.API_Error):
+    """Raised when every token of the pool has been removed"""
+
+
+class TokenPool(object):
+    """Pool of access tokens, each with its own rate limiter.
+    Limiters are shared with other API instances using the same tokens.
+
+    Tokens failing with authorization errors are removed from
+    the pool, while tokens hitting flood limits are sidelined
+    for ``sideline_time`` seconds.
+
+    :param tokens: access tokens
+    :param delay: minimal delay between requests made with a single token
+    :param capacity: burst size of every token's limiter
+    :param adaptive: use adaptive rate limiters
+    :param sideline_time: time in seconds throttled tokens are not used
+    :type tokens: list
+    :type delay: float
+    :type capacity: int
+    :type adaptive: bool
+    :type sideline_time: float
+    """
+
+    def __init__(self, tokens,
+                 delay=conf.API_CALL_DELAY,
+                 capacity=conf.API_CALL_BURST,
+                 adaptive=False,
+                 sideline_time=conf.TOKEN_SIDELINE_TIME,
+                 clock=ratelimit.monotonic,
+                 sleep=time.sleep):
+        self.sideline_time = sideline_time
+        self._limiters = {}
+        for token in tokens:
+            self._limiters[token] = ratelimit.get_shared_limiter(
+                token, delay=delay, capacity=capacity, adaptive=adaptive)
+        self._sidelined = {}
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        with self._lock:
+            return list(self._limiters)
+
+    def __len__(self):
+        return len(self._limiters)
+
+    def acquire(self):
+        """Picks token whose next free slot comes the soonest,
+        reserves the slot and waits for it.
+
+        :return: (access_token, rate_limiter) pair
+        :rtype: tuple
+        """
+        while True:
+            with self._lock:
+                if not self._limiters:
+                    raise NoTokensAvailable("No access tokens left in the pool.")
+                now = self._clock()
+                for token, until in list(self._sidelined.items()):
+                    if until <= now:
+                        del self._sidelined[token]
+                active = [t for t in self._limiters if t not in self._sidelined]
+                if not active:
+                    wait = min(self._sidelined.values()) - now
+                else:
+                    token = min(active, key=lambda t:
+                                self._limiters[t].time_until_available())
+                    limiter = self._limiters[token]
+                    wait = limiter.reserve()
+                    break
+            self._sleep(wait)
+        if wait > 0:
+            self._sleep(wait)
+        return token, limiter
+
+    def remove(self, token):
+        """Removes token from the pool"""
+        with self._lock:
+            self._limiters.pop(token, None)
+            self._sidelined.pop(token, None)
+
+    def sideline(self, token, seconds=None):
+        """Stops using token for the specified time"""
+        seconds = self.sideline_time if seconds is None else seconds
+        with self._lock:
+            if token in self._limiters:
+                self._sidelined[token] = self._clock() + seconds
+
+    def stats(self):
+        """Returns current state of the pool
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {"tokens": len(self._limiters),
+                    "sidelined": len(self._sidelined)}
+
+
+class PooledAPI(API):
+    """API spreading calls over the pool of access tokens.
+    Accepts the same arguments as API apart from access token.
+    Usage example:
+
+    >>> api = PooledAPI(["token1", "token2", "token3"])
+    >>> api.wall.get(owner_id=1)
+
+    A call failed because of its token is repeated with the other token.
+
+    :param tokens: list of access tokens or TokenPool instance
+    :type tokens: list or TokenPool
+    """
+
+    def __init__(self, tokens, **kwargs):
+        if not isinstance(tokens, TokenPool):
+            tokens = TokenPool(tokens,
+                               delay=kwargs.get("request_delay",
+                                                conf.API_CALL_DELAY),
+                               capacity=kwargs.get("request_burst",
+                                                   conf.API_CALL_BURST),
+                               adaptive=kwargs.get("adaptive_rate", False))
+        self.pool = tokens
+        super(PooledAPI, self).__init__(**kwargs)
+
+    def _send_request(self, method_name, params, limiter=None):
+        attempts = max(len(self.pool), 1)
+        for attempt in range(attempts):
+            token, bucket = self.pool.acquire()
+            token_params = dict(params, access_token=token)
+            try:
+                # The slot has been reserved by the pool already
+                return super(PooledAPI, self)._send_request(
+                    method_name, token_params, ratelimit.ReservedSlot(bucket))
+            except vk_exceptions.UserAuthorizationError:
+                self.pool.remove(token)
+                if attempt == attempts - 1:
+                    raise
+            except (vk_exceptions.TooManyRequestsError,
+                    vk_exceptions.FloodControlError):
+                self.pool.sideline(token)
+                if attempt == attempts - 1:
+                    raise
+
+    def _stream_items(self, method_name, params, limiter=None):
+        # Streamed call is not repeated with the other token,
+        # as some of its items may have been consumed already
+        token, bucket = self.pool.acquire()
+        token_params = dict(params, access_token=token)
+        try:
+            for item in super(PooledAPI, self)._stream_items(
+                    method_name, token_params, ratelimit.ReservedSlot(bucket)):
+                yield item
+        except vk_exceptions.UserAuthorizationError:
+            self.pool.remove(token)
+            raise
+        except (vk_exceptions.TooManyRequestsError,
+                vk_exceptions.FloodControlError):
+            self.pool.sideline(token)
+            raise
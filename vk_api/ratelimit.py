@@ -0,0 +1,339 @@
+"""
+Rate limiting of API calls.
+
+VK limits the number of requests that may be done with
+a single access token per second, so every API call
+has to acquire a slot from a rate limiter first.
+"""
+import contextlib
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from . import conf
+
+monotonic = time.monotonic
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket rate limiter.
+
+    Bucket is refilled with ``rate`` tokens per second up to
+    ``capacity`` tokens. Every caller reserves its own slot
+    under the lock and then sleeps exactly until that slot
+    becomes available, so concurrent callers are served in order
+    and nobody sleeps longer than needed.
+
+    :param rate: number of requests allowed per second, None disables limiting
+    :param capacity: burst size - how many requests may be sent at once
+    :param clock: function returning current time in seconds
+    :param sleep: function used to wait for the free slot
+    :type rate: float
+    :type capacity: int
+    """
+
+    def __init__(self, rate, capacity=conf.API_CALL_BURST,
+                 clock=monotonic, sleep=time.sleep):
+        if capacity < 1:
+            raise ValueError("Bucket capacity should be at least 1.")
+        self.rate = float(rate) if rate else None
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_delay(cls, delay, capacity=conf.API_CALL_BURST, **kwargs):
+        """Creates bucket allowing single request every ``delay`` seconds
+
+        :param delay: minimal delay between requests in seconds
+        :type delay: float
+        :rtype: TokenBucket
+        """
+        rate = 1.0 / delay if delay else None
+        return cls(rate, capacity=capacity, **kwargs)
+
+    @property
+    def delay(self):
+        return 1.0 / self.rate if self.rate else 0.0
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Guards access to the bucket state"""
+        with self._lock:
+            yield
+
+    def _refill(self, now):
+        elapsed = max(now - self._last, 0.0)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._last = now
+
+    def reserve(self, tokens=1):
+        """Reserves slot for the request and returns number of seconds
+        caller has to wait before the request may be sent
+
+        :rtype: float
+        """
+        if self.rate is None:
+            return 0.0
+        with self._locked():
+            self._refill(self._clock())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """Blocks until request may be sent"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+
+    def release(self, tokens=1):
+        """Returns previously acquired slot, e.g. when the request
+        has not reached the server"""
+        if self.rate is None:
+            return
+        with self._locked():
+            self._refill(self._clock())
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def on_success(self):
+        """Called after successful API call"""
+
+    def on_throttle(self):
+        """Called when VK reports that requests are sent too often"""
+
+    def try_acquire(self, tokens=1):
+        """Takes slot only if it is available right now
+
+        :rtype: bool
+        """
+        if self.rate is None:
+            return True
+        with self._locked():
+            self._refill(self._clock())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def time_until_available(self, tokens=1):
+        """Number of seconds until ``tokens`` slots become free
+
+        :rtype: float
+        """
+        if self.rate is None:
+            return 0.0
+        with self._locked():
+            self._refill(self._clock())
+            missing = tokens - self._tokens
+            return missing / self.rate if missing > 0 else 0.0
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """Token bucket adjusting its rate to the limits VK actually
+    applies using AIMD algorithm: rate grows by ``increase`` requests
+    per second after every successful call and is multiplied by
+    ``decrease_factor`` when "too many requests" or flood control
+    error is returned.
+
+    :param rate: initial number of requests allowed per second
+    :param min_rate: rate never goes below this value
+    :param max_rate: rate never goes above this value
+    :param increase: additive increase of the rate per successful call
+    :param decrease_factor: multiplicative decrease of the rate on errors
+    :param cooldown: time in seconds during which further errors do not
+                     decrease the rate again, as they are most likely
+                     caused by requests sent before the first decrease
+    :type min_rate: float
+    :type max_rate: float
+    :type increase: float
+    :type decrease_factor: float
+    :type cooldown: float
+    """
+
+    def __init__(self, rate, capacity=conf.API_CALL_BURST,
+                 min_rate=conf.ADAPTIVE_MIN_RATE,
+                 max_rate=conf.ADAPTIVE_MAX_RATE,
+                 increase=conf.ADAPTIVE_RATE_INCREASE,
+                 decrease_factor=conf.ADAPTIVE_RATE_DECREASE,
+                 cooldown=conf.ADAPTIVE_RATE_COOLDOWN,
+                 **kwargs):
+        if not rate:
+            raise ValueError("Adaptive bucket requires initial rate.")
+        super(AdaptiveTokenBucket, self).__init__(rate, capacity=capacity,
+                                                  **kwargs)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self._last_decrease = None
+
+    def _set_rate(self, rate, now):
+        # Tokens gained so far are accounted with the old rate
+        self._refill(now)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+
+    def on_success(self):
+        with self._locked():
+            self._set_rate(self.rate + self.increase, self._clock())
+
+    def on_throttle(self):
+        with self._locked():
+            now = self._clock()
+            if self._last_decrease is not None and \
+                    now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._set_rate(self.rate * self.decrease_factor, now)
+            # Drop accumulated burst, VK already considers us too fast
+            self._tokens = min(self._tokens, 0.0)
+
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket shared by all processes on the host.
+
+    Bucket state is kept in a small file locked with flock on every
+    operation, so processes using the same access token together stay
+    within its rate limit. By default file name is derived from the
+    access token, so every process just has to use the same token.
+    Only available on POSIX systems.
+
+    :param rate: number of requests allowed per second
+    :param capacity: burst size - how many requests may be sent at once
+    :param access_token: access token the bucket is created for
+    :param path: path to the state file, overrides access_token
+    :param lock_dir: directory state files are kept in
+    :type access_token: str or unicode
+    :type path: str or unicode
+    :type lock_dir: str or unicode
+    """
+
+    _state_format = struct.Struct("<dd")
+
+    def __init__(self, rate, capacity=conf.API_CALL_BURST,
+                 access_token=None, path=None, lock_dir=None,
+                 clock=time.time, **kwargs):
+        if fcntl is None:
+            raise RuntimeError("File locks are not supported "
+                               "on this platform.")
+        super(FileTokenBucket, self).__init__(rate, capacity=capacity,
+                                              clock=clock, **kwargs)
+        if path is None:
+            digest = hashlib.sha1((access_token or "").encode("utf-8"))
+            name = "vk_api_{}.bucket".format(digest.hexdigest()[:16])
+            path = os.path.join(lock_dir or tempfile.gettempdir(), name)
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(self._fd, self._state_format.size, 0)
+                if len(data) == self._state_format.size:
+                    self._tokens, self._last = self._state_format.unpack(data)
+                else:
+                    self._tokens, self._last = float(self.capacity), self._clock()
+                yield
+                os.pwrite(self._fd,
+                          self._state_format.pack(self._tokens, self._last), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class ReservedSlot(object):
+    """Limiter for the call whose slot has already been reserved,
+    e.g. by TokenPool. acquire does nothing, the other calls are
+    passed to the bucket the slot was reserved from.
+
+    :param bucket: token bucket the slot was reserved from
+    :type bucket: TokenBucket
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def acquire(self, tokens=1):
+        pass
+
+    def release(self, tokens=1):
+        self.bucket.release(tokens)
+
+    def on_success(self):
+        self.bucket.on_success()
+
+    def on_throttle(self):
+        self.bucket.on_throttle()
+
+
+_shared_limiters = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def get_shared_limiter(access_token,
+                       delay=conf.API_CALL_DELAY,
+                       capacity=conf.API_CALL_BURST,
+                       adaptive=False):
+    """Returns rate limiter shared by all API instances using the same
+    access token and the same limiter settings. Instances using the token
+    with different settings get their own limiter, warning is logged
+    as their calls together may exceed the limit of the token.
+
+    :param access_token: access token the limit applies to, None for public calls
+    :param delay: minimal (initial for adaptive limiter) delay between requests
+    :param capacity: burst size of the bucket
+    :param adaptive: create AdaptiveTokenBucket
+    :rtype: TokenBucket
+    """
+    key = (access_token, delay, capacity, adaptive)
+    with _shared_limiters_lock:
+        limiter = _shared_limiters.get(key)
+        if limiter is None:
+            if any(k[0] == access_token for k in _shared_limiters):
+                logging.warning("Access token is already used with other "
+                                "rate limiter settings, limiters are not "
+                                "shared and may exceed the limit together.")
+            cls = AdaptiveTokenBucket if adaptive else TokenBucket
+            limiter = cls.from_delay(delay, capacity=capacity)
+            _shared_limiters[key] = limiter
+        return limiter
+
+
+def _limiter_label(key):
+    """Label of the shared limiter, the access token is replaced
+    with a prefix of its hash"""
+    access_token, delay, capacity, adaptive = key
+    token = (hashlib.sha1(access_token.encode("utf-8")).hexdigest()[:12]
+             if access_token else "public")
+    return "{} (delay={}, burst={}{})".format(
+        token, delay, capacity, ", adaptive" if adaptive else "")
+
+
+def current_rates():
+    """Returns current rates of all shared limiters for monitoring.
+    Limiters are labeled with hashes of access tokens and their settings.
+
+    :return: mapping of limiter labels to requests per second
+    :rtype: dict
+    """
+    with _shared_limiters_lock:
+        limiters = list(_shared_limiters.items())
+    return {_limiter_label(key): limiter.rate for key, limiter in limiters}
@@ -0,0 +1,172 @@
+"""
+Retrying of API calls failed with transient errors.
+
+Errors are sorted into retryable (too many requests, flood control,
+internal server error, connection failures, 5xx responses) and fatal ones.
+Retryable calls are repeated with capped exponential backoff with jitter.
+"""
+import random
+import threading
+import time
+
+import requests
+
+from . import conf
+from . import vk_exceptions
+from .ratelimit import monotonic
+
+# Default of the budget argument, so that None disables the budget
+_DEFAULT_BUDGET = object()
+
+
+class RetryBudgetExhausted(vk_exceptions.API_Error):
+    """Raised when too many calls are retried and the
+    global retry budget circuit breaker is open"""
+
+
+class RetryBudget(object):
+    """Global limit on the number of retries, shared by all calls.
+
+    Every call deposits ``ratio`` of retry and the budget is also
+    refilled with ``min_per_second`` retries every second, while every
+    retry withdraws one. When the budget is empty calls are not
+    retried anymore until it is refilled, so a failing VK does not
+    get flooded with retries.
+
+    :param ratio: number of retries allowed per one call
+    :param min_per_second: number of retries allowed per second regardless of calls
+    :param capacity: maximum number of retries which may be accumulated
+    :type ratio: float
+    :type min_per_second: float
+    :type capacity: float
+    """
+
+    def __init__(self, ratio=conf.RETRY_BUDGET_RATIO,
+                 min_per_second=conf.RETRY_BUDGET_MIN_PER_SECOND,
+                 capacity=conf.RETRY_BUDGET_CAPACITY,
+                 clock=monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._balance = float(capacity)
+        self._clock = clock
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = max(now - self._last, 0.0)
+        self._balance = min(self.capacity,
+                            self._balance + elapsed * self.min_per_second)
+        self._last = now
+
+    def deposit(self):
+        """Records new call"""
+        with self._lock:
+            self._refill()
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self):
+        """Takes single retry from the budget
+
+        :return: False if the budget is exhausted
+        :rtype: bool
+        """
+        with self._lock:
+            self._refill()
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+    @property
+    def is_open(self):
+        """Whether circuit is open and calls are not retried"""
+        with self._lock:
+            self._refill()
+            return self._balance < 1
+
+
+class RetryPolicy(object):
+    """Policy used by API to retry failed calls.
+
+    :param max_retries: maximum number of retries of a single call
+    :param backoff_base: delay before the first retry in seconds
+    :param backoff_max: maximum delay between retries in seconds
+    :param jitter: randomize delays to spread retries of concurrent calls
+    :param retry_codes: API error codes considered transient
+    :param retry_statuses: HTTP status codes considered transient
+    :param budget: global retry budget, new RetryBudget by default,
+                   None to disable it
+    :type max_retries: int
+    :type backoff_base: float
+    :type backoff_max: float
+    :type jitter: bool
+    :type retry_codes: tuple
+    :type retry_statuses: tuple
+    :type budget: RetryBudget
+    """
+
+    def __init__(self,
+                 max_retries=conf.RETRY_MAX_RETRIES,
+                 backoff_base=conf.RETRY_BACKOFF_BASE,
+                 backoff_max=conf.RETRY_BACKOFF_MAX,
+                 jitter=True,
+                 retry_codes=conf.RETRYABLE_ERROR_CODES,
+                 retry_statuses=conf.RETRYABLE_HTTP_STATUSES,
+                 budget=_DEFAULT_BUDGET,
+                 sleep=time.sleep):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_codes = frozenset(retry_codes)
+        self.retry_statuses = frozenset(retry_statuses)
+        if budget is _DEFAULT_BUDGET:
+            budget = RetryBudget()
+        self.budget = budget
+        self._sleep = sleep
+        self._random = random.Random()
+
+    def is_retryable(self, error):
+        """Check whether call failed with the error may be retried
+
+        :param error: exception raised by the call
+        :rtype: bool
+        """
+        if isinstance(error, vk_exceptions.API_Error):
+            return getattr(error, "error_code", None) in self.retry_codes
+        if isinstance(error, requests.HTTPError):
+            response = error.response
+            return response is not None and \
+                response.status_code in self.retry_statuses
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+    def get_backoff(self, retry_number):
+        """Returns delay before the retry, exponential backoff
+        with "full jitter" is used
+
+        :param retry_number: number of the retry starting from 0
+        :rtype: float
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** retry_number)
+        if self.jitter:
+            delay = self._random.uniform(0, delay)
+        return delay
+
+    def call(self, fn, *args, **kwargs):
+        """Calls ``fn`` retrying it on transient errors"""
+        if self.budget is not None:
+            self.budget.deposit()
+        retry_number = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not self.is_retryable(e) or retry_number >= self.max_retries:
+                    raise
+                if self.budget is not None and not self.budget.withdraw():
+                    msg = "Retry budget is exhausted, last error: {!r}"
+                    raise RetryBudgetExhausted(msg.format(e))
+                self._sleep(self.get_backoff(retry_number))
+                retry_number += 1
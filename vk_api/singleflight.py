@@ -0,0 +1,87 @@
+"""
+De-duplication of identical concurrent API calls.
+
+When several threads make the same call at once, only the first
+one sends the request, while the rest wait for its result.
+"""
+import threading
+
+from .cache import is_read_method, make_cache_key
+
+
+class _Call(object):
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Collapses identical in-flight calls into a single one.
+    Every caller gets the same result or exception.
+
+    Only read methods are de-duplicated, as two identical write
+    calls (e.g. messages.send) are expected to be both executed.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.collapsed = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Calls ``fn`` unless call with the same key is already
+        in flight, in which case waits for its result
+
+        :param key: key identifying the call
+        :param fn: function making the call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.collapsed += 1
+                is_leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                is_leader = True
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def call_method(self, method_name, params, fn):
+        """De-duplicates API method call if it is a read method
+
+        :param method_name: name of the called method
+        :param params: method parameters, including access token
+        :param fn: function accepting method name and parameters
+        """
+        if not is_read_method(method_name):
+            return fn(method_name, params)
+        key = make_cache_key(method_name, params)
+        return self.do(key, fn, method_name, params)
+
+    def stats(self):
+        """Returns number of executed and collapsed calls
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {"calls": self.calls, "collapsed": self.collapsed}
@@ -0,0 +1,216 @@
+"""
+Incremental synchronization of walls and the newsfeed.
+
+Instead of downloading the whole wall every time, only posts newer
+than the newest one seen during the previous sync are fetched.
+Progress is saved to the checkpoint store after every page, so
+an interrupted sync continues where it has stopped. Posts are
+delivered at least once: posts of the page being processed when
+the job crashed are yielded again.
+
+Usage example:
+
+>>> store = CheckpointStore("checkpoints.json")
+>>> for post in WallSync(api, store).sync(owner_id=1):
+...     save(post)
+"""
+import json
+import os
+import tempfile
+import threading
+
+from . import conf
+
+
+class CheckpointStore(object):
+    """Dictionary of checkpoints persisted to JSON file. File is
+    replaced atomically, so it is never left half-written.
+    Without path checkpoints are kept in memory only.
+
+    :param path: path of the JSON file
+    :type path: str or unicode
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._data = json.load(f)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def set(self, key, value):
+        """Stores checkpoint and saves the file"""
+        with self._lock:
+            self._data[key] = value
+            self._save()
+
+    def delete(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class WallSync(object):
+    """Fetches posts published on walls since the previous sync.
+    The newest seen post ID is remembered for every wall, paging
+    stops as soon as already seen post is reached.
+
+    :param api: API object instance
+    :param store: checkpoint store
+    :param page_size: number of posts requested per call
+    :type api: API
+    :type store: CheckpointStore
+    :type page_size: int
+    """
+
+    def __init__(self, api, store, page_size=conf.WALL_SYNC_PAGE_SIZE):
+        self._api = api
+        self.store = store
+        self.page_size = page_size
+
+    @staticmethod
+    def checkpoint_key(owner_id):
+        return "wall:{}".format(owner_id)
+
+    def last_post_id(self, owner_id):
+        """Returns ID of the newest post seen on the wall"""
+        state = self.store.get(self.checkpoint_key(owner_id), {})
+        return state.get("last_id", 0)
+
+    def sync(self, owner_id, max_posts=None, **kwargs):
+        """Yields posts newer than the ones seen before, newest first.
+        Unfinished sync is resumed from the last saved page.
+
+        :param owner_id: ID of the wall owner
+        :param max_posts: maximum number of posts fetched when the wall
+                          is synchronized for the first time
+        :param kwargs: additional parameters of wall.get, e.g. filter
+        """
+        key = self.checkpoint_key(owner_id)
+        state = self.store.get(key, {})
+        last_id = state.get("last_id", 0)
+        # Progress of the unfinished sync: the newest and the oldest
+        # post IDs yielded so far and the offset of the next page
+        run = state.get("run") or {"high": last_id, "low": None, "offset": 0}
+        # Posts newer than the oldest one yielded before the sync
+        # has been interrupted are skipped when it is resumed
+        resumed_low = run["low"]
+        yielded = 0
+        done = False
+        while not done:
+            r = self._api.wall.get(owner_id=owner_id, offset=run["offset"],
+                                   count=self.page_size, **kwargs)
+            items = r["response"]["items"]
+            done = len(items) < self.page_size
+            for post in items:
+                post_id = post["id"]
+                pinned = post.get("is_pinned")
+                if post_id <= last_id:
+                    if pinned:
+                        # Old pinned post is returned first
+                        continue
+                    done = True
+                    break
+                if resumed_low is not None and post_id >= resumed_low:
+                    continue
+                if not pinned and run["low"] is not None and \
+                        post_id >= run["low"]:
+                    # Posts published while the wall is paged shift
+                    # offsets, so the last posts of the previous page
+                    # are returned again
+                    continue
+                yield post
+                run["high"] = max(run["high"], post_id)
+                if not pinned:
+                    # Pinned post is out of order, so it does not
+                    # tell how far the wall has been read
+                    run["low"] = post_id
+                yielded += 1
+                if not last_id and max_posts is not None and \
+                        yielded >= max_posts:
+                    done = True
+                    break
+            run["offset"] += len(items)
+            if not done:
+                self.store.set(key, {"last_id": last_id, "run": run})
+        self.store.set(key, {"last_id": run["high"]})
+
+
+class NewsfeedSync(object):
+    """Fetches newsfeed items published since the previous sync.
+    Date of the newest item and the ``next_from`` cursor of the
+    unfinished sync are kept in the checkpoint store.
+
+    :param api: API object instance
+    :param store: checkpoint store
+    :param key: checkpoint key, different keys should be used for
+                different filters
+    :param page_size: number of items requested per call
+    :type api: API
+    :type store: CheckpointStore
+    :type key: str or unicode
+    :type page_size: int
+    """
+
+    def __init__(self, api, store, key="newsfeed",
+                 page_size=conf.NEWSFEED_SYNC_PAGE_SIZE):
+        self._api = api
+        self.store = store
+        self.key = key
+        self.page_size = page_size
+        self.profiles = []
+        self.groups = []
+
+    def sync(self, start_time=None, **kwargs):
+        """Yields new newsfeed items, newest first. Profiles and groups
+        returned along with items are available as ``profiles`` and
+        ``groups`` attributes of the last fetched page.
+
+        :param start_time: unix time items are fetched from when the
+                           feed is synchronized for the first time
+        :param kwargs: additional parameters of newsfeed.get, e.g. filters
+        """
+        state = self.store.get(self.key, {})
+        run = state.get("run") or {
+            "start_time": state.get("start_time", start_time),
+            "newest": 0,
+            "next_from": None}
+        while True:
+            params = dict(kwargs, count=self.page_size)
+            if run["start_time"]:
+                params["start_time"] = run["start_time"]
+            if run["next_from"]:
+                params["start_from"] = run["next_from"]
+            r = self._api.newsfeed.get(**params)["response"]
+            self.profiles = r.get("profiles", [])
+            self.groups = r.get("groups", [])
+            for item in r["items"]:
+                yield item
+                run["newest"] = max(run["newest"], item["date"])
+            run["next_from"] = r.get("next_from")
+            if not run["next_from"] or not r["items"]:
+                break
+            self.store.set(self.key, {"run": run})
+        newest = run["newest"]
+        self.store.set(self.key, {
+            "start_time": newest + 1 if newest else run["start_time"]})
@@ -1,15 +1,52 @@
+import asyncio
+import binascii
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import pickle
 import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
-try:
-    from unittest.mock import patch
-except ImportError:
-    from mock import patch
+from unittest.mock import Mock, patch
 
 import httpretty
 
+import requests
+
 from .api import API, process_error_response
+from . import aio
+from .batch import compile_execute_code
+from .cache import MemoryStorage, ResponseCache, SQLiteStorage
+from .download import Downloader, iter_media
+from .errorhandlers import CaptchaHandler
+from .graph import FriendsCrawler, IDBitmap
+from .idlist import IDList
+from .loaders import GroupsLoader, UsersLoader
+from .longpoll import LongPoll, LongPollError
+from .models import City, Post, User
+from .pagination import BulkPageFetcher, compile_pagination_code
+from .pool import NoTokensAvailable, PooledAPI, TokenPool
+from .ratelimit import AdaptiveTokenBucket, FileTokenBucket, TokenBucket
+from .retry import RetryBudget, RetryBudgetExhausted, RetryPolicy
+from .singleflight import SingleFlight
+from .sync import CheckpointStore, NewsfeedSync, WallSync
+from .transport import HTTPTransport
+from .upload import MultipartBody
+from . import conf
+from . import errorhandlers
+from . import jsonlib
+from . import ratelimit
 from . import vk_exceptions
 
+skip_without_aio = unittest.skipIf(aio.aiohttp is None,
+                                   "aiohttp is not installed")
+
 
 class TestExceptions(unittest.TestCase):
 
@@ -175,5 +212,1451 @@ class TestAPImethods(unittest.TestCase):
         def test_basic_usage(self):
             pass
 
+
+class TestTransport(unittest.TestCase):
+
+    def test_every_api_instance_owns_its_transport(self):
+        first, second = API(), API()
+        self.assertIsInstance(first.transport, HTTPTransport)
+        self.assertIsNot(first.transport.session, second.transport.session)
+
+    def test_pool_size_is_passed_to_adapter(self):
+        transport = HTTPTransport(pool_connections=3, pool_maxsize=7)
+        adapter = transport.session.get_adapter("https://api.vk.com/")
+        self.assertEqual(adapter._pool_connections, 3)
+        self.assertEqual(adapter._pool_maxsize, 7)
+
+    @httpretty.activate
+    def test_injected_session_is_used_for_api_calls(self):
+        httpretty.register_uri(httpretty.GET,
+                               re.compile(r"https://api.vk.com/method/wall.get*"),
+                               body='{"response": [1, {}]}',
+                               headers={'content-type': 'text/json', })
+        session = requests.Session()
+        with patch.object(session, 'request',
+                          wraps=session.request) as request_mock:
+            api = API(session=session)
+            api.wall.get(owner_id=1)
+            self.assertTrue(request_mock.called)
+            self.assertIn("timeout", request_mock.call_args[1])
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def test_burst_is_served_without_sleeping(self):
+        clock = FakeClock()
+        bucket = TokenBucket(3, capacity=3, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(clock.slept, [])
+
+    def test_caller_sleeps_only_until_next_slot(self):
+        clock = FakeClock()
+        bucket = TokenBucket.from_delay(0.5, capacity=1,
+                                        clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        clock.now += 0.2
+        bucket.acquire()
+        self.assertEqual(len(clock.slept), 1)
+        self.assertAlmostEqual(clock.slept[0], 0.3)
+
+    def test_concurrent_callers_get_consecutive_slots(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, capacity=1, clock=clock)
+        waits = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(waits, [0.0, 0.5, 1.0, 1.5])
+
+    def test_limiter_is_shared_between_apis_with_same_token(self):
+        first = API(access_token="sharedtoken")
+        second = API(access_token="sharedtoken")
+        other = API(access_token="othertoken")
+        self.assertIs(first.rate_limiter, second.rate_limiter)
+        self.assertIsNot(first.rate_limiter, other.rate_limiter)
+        self.assertAlmostEqual(first.rate_limiter.delay, conf.API_CALL_DELAY)
+
+    def test_custom_rate_limiter_is_used(self):
+        limiter = TokenBucket(10)
+        api = API(rate_limiter=limiter)
+        self.assertIs(api.rate_limiter, limiter)
+
+    def test_shared_limiters_respect_settings(self):
+        first = API(access_token="settingstoken")
+        second = API(access_token="settingstoken", request_delay=2.0)
+        self.assertIs(first.rate_limiter,
+                      API(access_token="settingstoken").rate_limiter)
+        self.assertIsNot(first.rate_limiter, second.rate_limiter)
+        self.assertEqual(second.rate_limiter.delay, 2.0)
+
+    def test_adaptive_rate_requires_initial_delay(self):
+        api = API(access_token="adaptivetoken", adaptive_rate=True)
+        self.assertIsInstance(api.rate_limiter, AdaptiveTokenBucket)
+        with self.assertRaises(ValueError):
+            API(adaptive_rate=True, request_delay=0)
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_calls_are_compiled_into_vkscript(self):
+        code = compile_execute_code([("users.get", {"user_ids": 1}),
+                                     ("wall.get", {"owner_id": -1})])
+        self.assertEqual(code, 'return [API.users.get({"user_ids": 1}),'
+                               'API.wall.get({"owner_id": -1})];')
+
+    def test_sequences_are_sent_as_comma_separated_strings(self):
+        code = compile_execute_code([("users.get",
+                                      {"user_ids": IDList([2, 1])})])
+        self.assertEqual(code, 'return [API.users.get({"user_ids": "1,2"})];')
+
+    @patch('vk_api.api.API.api_method')
+    def test_call_with_unencodable_params_fails_alone(self, api_method_mock):
+        api_method_mock.return_value = {"response": [[{"id": 1}]]}
+        b = API().batch(max_latency=0.01)
+        broken = b.users.get(user_ids=1, fields=object())
+        users = b.users.get(user_ids=1)
+        self.assertEqual(users.result(timeout=1), {"response": [{"id": 1}]})
+        with self.assertRaises(TypeError):
+            broken.result(timeout=1)
+        self.assertEqual(api_method_mock.call_count, 1)
+
+    @patch('vk_api.api.API.api_method')
+    def test_results_are_dispatched_to_callers(self, api_method_mock):
+        api_method_mock.return_value = {
+            "response": [[{"id": 1}], False],
+            "execute_errors": [{"method": "wall.get", "error_code": 15,
+                                "error_msg": "Access denied"}]}
+        api = API()
+        with api.batch() as b:
+            users = b.users.get(user_ids=1)
+            wall = b.wall.get(owner_id=1)
+            self.assertFalse(users.done())
+        self.assertEqual(api_method_mock.call_count, 1)
+        self.assertEqual(api_method_mock.call_args[0][0], "execute")
+        self.assertEqual(users.result(), {"response": [{"id": 1}]})
+        with self.assertRaises(vk_exceptions.AccessDeniedError):
+            wall.result()
+
+    @patch('vk_api.api.API.api_method')
+    def test_batch_is_flushed_when_full(self, api_method_mock):
+        api_method_mock.return_value = {"response": [1, 2]}
+        b = API().batch(max_size=2)
+        first = b.users.get(user_ids=1)
+        second = b.users.get(user_ids=2)
+        self.assertEqual(first.result(), {"response": 1})
+        self.assertEqual(second.result(), {"response": 2})
+
+    @patch('vk_api.api.API.api_method')
+    def test_calls_without_results_are_failed(self, api_method_mock):
+        api_method_mock.return_value = {"response": [1]}
+        with API().batch() as b:
+            first = b.users.get(user_ids=1)
+            second = b.users.get(user_ids=2)
+        self.assertEqual(first.result(), {"response": 1})
+        with self.assertRaises(vk_exceptions.API_Error):
+            second.result(timeout=1)
+
+    @patch('vk_api.api.API.api_method')
+    def test_failed_execute_fails_every_call(self, api_method_mock):
+        api_method_mock.side_effect = vk_exceptions.TooManyRequestsError()
+        with API().batch() as b:
+            r = b.users.get(user_ids=1)
+        with self.assertRaises(vk_exceptions.TooManyRequestsError):
+            r.result()
+
+
+class FakeAsyncTransport(object):
+
+    def __init__(self, response):
+        self.response = response
+        self.calls = []
+
+    async def get_json(self, url, params=None, loads=None):
+        self.calls.append((url, params))
+        self.loads = loads
+        return self.response
+
+
+@skip_without_aio
+class TestAsyncAPI(unittest.TestCase):
+
+    def test_dot_methods_are_awaitable(self):
+        transport = FakeAsyncTransport({"response": [1, {}]})
+        api = aio.AsyncAPI(access_token="token", transport=transport,
+                           request_delay=0)
+        r = asyncio.run(api.wall.get(owner_id=1))
+        self.assertEqual(r["response"][0], 1)
+        url, params = transport.calls[0]
+        self.assertEqual(url, "https://api.vk.com/method/wall.get")
+        self.assertEqual(params["owner_id"], "1")
+        self.assertEqual(params["access_token"], "token")
+
+    def test_error_responses_are_dispatched_to_handlers(self):
+        transport = FakeAsyncTransport(
+            {"error": {"error_code": 15, "error_msg": "Access denied"}})
+        api = aio.AsyncAPI(transport=transport, request_delay=0)
+        with self.assertRaises(vk_exceptions.AccessDeniedError):
+            asyncio.run(api.wall.get(owner_id=1))
+
+    def test_async_limiter_does_not_block_loop(self):
+        clock = FakeClock()
+        limiter = aio.AsyncRateLimiter(
+            TokenBucket(10, capacity=1, clock=clock))
+
+        async def acquire_many():
+            await asyncio.gather(*[limiter.acquire() for _ in range(3)])
+
+        started = time.time()
+        asyncio.run(acquire_many())
+        self.assertLess(time.time() - started, 0.5)
+
+    def test_cached_responses_are_not_requested_again(self):
+        transport = FakeAsyncTransport({"response": [{"id": 1}]})
+        api = aio.AsyncAPI(transport=transport, request_delay=0,
+                           cache=ResponseCache(MemoryStorage()))
+
+        async def call_twice():
+            await api.users.get(user_ids=1)
+            return await api.users.get(user_ids=1)
+
+        self.assertEqual(asyncio.run(call_twice()), {"response": [{"id": 1}]})
+        self.assertEqual(len(transport.calls), 1)
+
+    def test_json_loads_is_passed_to_transport(self):
+        transport = FakeAsyncTransport({"response": 1})
+        api = aio.AsyncAPI(transport=transport, request_delay=0,
+                           json_loads=json.loads)
+        asyncio.run(api.wall.get(owner_id=1))
+        self.assertIs(transport.loads, json.loads)
+
+    def test_records_are_awaitable(self):
+        transport = FakeAsyncTransport({"response": [{"id": 1}]})
+        api = aio.AsyncAPI(transport=transport, request_delay=0)
+        users = asyncio.run(api.users.get.records(user_ids=1))
+        self.assertIsInstance(users[0], User)
+        self.assertEqual(users[0].id, 1)
+
+    def test_blocking_helpers_are_rejected(self):
+        api = aio.AsyncAPI(transport=FakeAsyncTransport({}), request_delay=0)
+        with self.assertRaises(NotImplementedError):
+            api.wall.get.iter(owner_id=1)
+        with self.assertRaises(NotImplementedError):
+            api.groups.getMembers.ids(group_id=1)
+        with self.assertRaises(NotImplementedError):
+            api.stream_items("groups.getMembers", group_id=1)
+        with self.assertRaises(NotImplementedError):
+            api.batch()
+        with self.assertRaises(NotImplementedError):
+            api.loaders
+        with self.assertRaises(ValueError):
+            aio.AsyncAPI(single_flight=True)
+
+
+def fake_paginated_method(total):
+    """Returns api_method replacement serving items 0..total-1"""
+    def api_method(method_name, offset=0, count=100, **kwargs):
+        items = list(range(offset, min(offset + count, total)))
+        return {"response": {"count": total, "items": items}}
+    return api_method
+
+
+class TestPagination(unittest.TestCase):
+
+    def test_all_items_are_yielded_in_order(self):
+        api = API()
+        with patch.object(api, 'api_method',
+                          side_effect=fake_paginated_method(250)) as m:
+            items = list(api.wall.get.iter(owner_id=1, page_size=100))
+        self.assertEqual(items, list(range(250)))
+        self.assertEqual(m.call_count, 3)
+        self.assertEqual(m.call_args_list[0][1]["owner_id"], 1)
+
+    def test_iteration_stops_at_limit(self):
+        api = API()
+        with patch.object(api, 'api_method',
+                          side_effect=fake_paginated_method(1000)) as m:
+            items = list(api.friends.get.iter(page_size=30, limit=45,
+                                              offset=10, prefetch=0))
+        self.assertEqual(items, list(range(10, 55)))
+        self.assertEqual([c[1]["count"] for c in m.call_args_list], [30, 15])
+
+    def test_pages_are_requested_lazily(self):
+        api = API()
+        with patch.object(api, 'api_method',
+                          side_effect=fake_paginated_method(10 ** 6)) as m:
+            it = api.groups.getMembers.iter(group_id=1, page_size=10,
+                                            prefetch=2)
+            self.assertEqual(m.call_count, 0)
+            self.assertEqual(next(it), 0)
+            it.close()
+            self.assertLessEqual(m.call_count, 3)
+
+
+class TestBulkPagination(unittest.TestCase):
+
+    def test_pagination_code_calls_method_in_loop(self):
+        code = compile_pagination_code("groups.getMembers", {"group_id": 1},
+                                       offset=2000, page_size=1000, pages=25)
+        self.assertIn('API.groups.getMembers({"group_id": 1, "count": 1000, '
+                      '"offset": 2000 + i * 1000})', code)
+        self.assertIn("while (i < 25)", code)
+
+    @patch('vk_api.api.API.api_method')
+    def test_many_pages_are_fetched_per_request(self, api_method_mock):
+        api_method_mock.return_value = {
+            "response": {"count": 250, "items": list(range(250))}}
+        api = API()
+        items = list(api.groups.getMembers.iter_bulk(group_id=1, page_size=10))
+        self.assertEqual(items, list(range(250)))
+        self.assertEqual(api_method_mock.call_count, 1)
+        self.assertEqual(api_method_mock.call_args[0][0], "execute")
+
+    @patch('vk_api.api.API.api_method')
+    def test_pages_per_request_are_halved_on_runtime_error(self,
+                                                           api_method_mock):
+        def execute(method_name, code):
+            pages = int(re.search(r"while \(i < (\d+)\)", code).group(1))
+            if pages > 5:
+                raise vk_exceptions.ExecuteRuntimeError()
+            offset = int(re.search(r'"offset": (\d+)', code).group(1))
+            items = list(range(offset, min(offset + pages * 10, 100)))
+            return {"response": {"count": 100, "items": items}}
+        api_method_mock.side_effect = execute
+        fetcher = BulkPageFetcher(API(), "groups.getMembers", page_size=10,
+                                  max_pages=20)
+        total, items = fetcher(0, 100)
+        self.assertEqual(total, 100)
+        self.assertEqual(items, list(range(100)))
+        self.assertLess(fetcher.pages, 20)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    @patch('vk_api.api.API._send_request')
+    def test_repeated_read_calls_are_served_from_cache(self, send_mock):
+        send_mock.return_value = {"response": [{"id": 1}]}
+        api = API(cache=ResponseCache())
+        first = api.users.get(user_ids=1, fields="city")
+        second = api.users.get(fields="city", user_ids="1")
+        self.assertEqual(first, second)
+        self.assertEqual(send_mock.call_count, 1)
+        self.assertEqual(api.cache.stats(), {"hits": 1, "misses": 1})
+
+    @patch('vk_api.api.API._send_request')
+    def test_write_methods_are_never_cached(self, send_mock):
+        send_mock.return_value = {"response": 1}
+        cache = ResponseCache(cacheable_prefixes=("wall.", "messages."))
+        api = API(cache=cache)
+        api.wall.post(message="hello")
+        api.wall.post(message="hello")
+        self.assertEqual(send_mock.call_count, 2)
+        self.assertEqual(cache.stats(), {"hits": 0, "misses": 0})
+
+    def test_access_token_is_ignored_for_public_methods(self):
+        cache = ResponseCache()
+        cache.set("database.getCities", {"country_id": 1,
+                                         "access_token": "first"}, "cities")
+        self.assertEqual(cache.get("database.getCities",
+                                   {"country_id": 1,
+                                    "access_token": "second"}), "cities")
+        cache.set("users.get", {"user_ids": 1, "access_token": "first"}, "me")
+        self.assertIsNone(cache.get("users.get", {"user_ids": 1,
+                                                  "access_token": "second"}))
+
+    def test_entries_expire_and_least_recently_used_are_evicted(self):
+        clock = FakeClock()
+        cache = ResponseCache(storage=MemoryStorage(max_size=2), ttl=10,
+                              clock=clock)
+        for user_id in (1, 2):
+            cache.set("users.get", {"user_ids": user_id}, user_id)
+        cache.get("users.get", {"user_ids": 1})
+        cache.set("users.get", {"user_ids": 3}, 3)
+        self.assertIsNone(cache.get("users.get", {"user_ids": 2}))
+        self.assertEqual(cache.get("users.get", {"user_ids": 1}), 1)
+        clock.now += 11
+        self.assertIsNone(cache.get("users.get", {"user_ids": 1}))
+
+    def test_modifying_returned_response_does_not_change_cache(self):
+        cache = ResponseCache(storage=MemoryStorage())
+        response = {"response": [{"id": 1}]}
+        cache.set("users.get", {"user_ids": 1}, response)
+        response["response"].append({"id": 2})
+        cache.get("users.get", {"user_ids": 1})["response"][0]["id"] = 3
+        self.assertEqual(cache.get("users.get", {"user_ids": 1}),
+                         {"response": [{"id": 1}]})
+
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_responses_survive_restarts(self):
+        storage = SQLiteStorage(self.path)
+        ResponseCache(storage=storage).set("database.getCountries", {},
+                                           {"response": ["Belarus"]})
+        storage.close()
+        cache = ResponseCache(storage=SQLiteStorage(self.path))
+        self.assertEqual(cache.get("database.getCountries", {}),
+                         {"response": ["Belarus"]})
+
+    def test_expired_entries_are_not_returned(self):
+        storage = SQLiteStorage(self.path)
+        storage.set("key", {"response": 1}, expires_at=100)
+        self.assertEqual(storage.get("key", now=99), {"response": 1})
+        self.assertIsNone(storage.get("key", now=101))
+        self.assertEqual(len(storage), 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        storage = SQLiteStorage(self.path, max_bytes=150)
+        for i in range(5):
+            value = binascii.hexlify(os.urandom(100)).decode()
+            storage.set("key{}".format(i), value, expires_at=1e12)
+        storage.evict()
+        self.assertEqual(len(storage), 1)
+        self.assertIsNotNone(storage.get("key4", now=0))
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def _run_concurrently(self, fn, count):
+        results, errors = [], []
+
+        def target():
+            try:
+                results.append(fn())
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results, errors
+
+    def test_identical_concurrent_calls_share_single_request(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def send_request(method_name, params):
+            started.set()
+            release.wait()
+            return {"response": [{"id": 1}]}
+
+        api = API(single_flight=True)
+        with patch.object(api, '_send_request', side_effect=send_request) as m:
+            leader = threading.Thread(target=api.users.get, kwargs={"user_ids": 1})
+            leader.start()
+            started.wait()
+            followers = threading.Thread(
+                target=lambda: self._run_concurrently(
+                    lambda: api.users.get(user_ids="1"), 5))
+            followers.start()
+            while api.single_flight.stats()["collapsed"] < 5:
+                time.sleep(0.001)
+            release.set()
+            leader.join()
+            followers.join()
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(api.single_flight.stats(), {"calls": 1, "collapsed": 5})
+
+    def test_exception_is_raised_for_every_caller(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def failing():
+            release.wait()
+            raise vk_exceptions.InternalServerError()
+
+        threading.Timer(0.05, release.set).start()
+        results, errors = self._run_concurrently(
+            lambda: flight.do("key", failing), 3)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 3)
+
+    def test_write_methods_are_not_collapsed(self):
+        flight = SingleFlight()
+        send = lambda method_name, params: params
+        flight.call_method("messages.send", {"message": "hi"}, send)
+        flight.call_method("messages.send", {"message": "hi"}, send)
+        self.assertEqual(flight.stats(), {"calls": 0, "collapsed": 0})
+
+
+class TestLoaders(unittest.TestCase):
+
+    @patch('vk_api.api.API.api_method')
+    def test_ids_are_loaded_with_single_call(self, api_method_mock):
+        api_method_mock.return_value = {"response": [
+            {"id": 1, "first_name": "Pavel"},
+            {"id": 5, "first_name": "Ilya", "deactivated": "deleted"}]}
+        api = API()
+        futures = [api.loaders.users.load(user_id, fields="city")
+                   for user_id in (1, "5", 7, 1)]
+        self.assertEqual(futures[0].result(timeout=1)["first_name"], "Pavel")
+        self.assertEqual(futures[1].result()["deactivated"], "deleted")
+        self.assertIsNone(futures[2].result())
+        self.assertIs(futures[0], futures[3])
+        api_method_mock.assert_called_once_with("users.get", fields="city",
+                                                user_ids="1,5,7")
+
+    @patch('vk_api.api.API.api_method')
+    def test_batch_is_sent_when_full(self, api_method_mock):
+        api_method_mock.return_value = {"response": [{"id": 1}, {"id": 2}]}
+        loader = UsersLoader(API(), wait=60, max_batch_size=2)
+        first, second = loader.load_many([1, 2])
+        self.assertTrue(first.done() and second.done())
+
+    @patch('vk_api.api.API.api_method')
+    def test_different_parameters_are_loaded_separately(self, api_method_mock):
+        api_method_mock.return_value = {"response": [{"id": 1}]}
+        loader = GroupsLoader(API(), wait=60)
+        loader.load(-1, fields="city")
+        loader.load(1)
+        loader.dispatch()
+        self.assertEqual(api_method_mock.call_count, 2)
+
+    @patch('vk_api.api.API.api_method')
+    def test_posts_are_matched_by_full_id(self, api_method_mock):
+        api_method_mock.return_value = {"response": [
+            {"owner_id": -1, "id": 10, "text": "post"}]}
+        post = API().loaders.posts.load("-1_10")
+        self.assertEqual(post.result(timeout=1)["text"], "post")
+        self.assertEqual(api_method_mock.call_args[1]["posts"], "-1_10")
+
+    @patch('vk_api.api.API.api_method')
+    def test_failed_call_fails_every_request(self, api_method_mock):
+        api_method_mock.side_effect = vk_exceptions.AccessDeniedError()
+        futures = API().loaders.users.load_many([1, 2])
+        for future in futures:
+            with self.assertRaises(vk_exceptions.AccessDeniedError):
+                future.result(timeout=1)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def _policy(self, **kwargs):
+        self.sleeps = []
+        kwargs.setdefault("sleep", self.sleeps.append)
+        return RetryPolicy(**kwargs)
+
+    @patch('vk_api.api.API._send_request')
+    def test_transient_errors_are_retried(self, send_mock):
+        send_mock.side_effect = [vk_exceptions.TooManyRequestsError(),
+                                 vk_exceptions.InternalServerError(),
+                                 {"response": 1}]
+        api = API(retry_policy=self._policy(jitter=False, backoff_base=1))
+        self.assertEqual(api.users.get(user_ids=1), {"response": 1})
+        self.assertEqual(self.sleeps, [1, 2])
+
+    @patch('vk_api.api.API._send_request')
+    def test_fatal_errors_are_not_retried(self, send_mock):
+        send_mock.side_effect = vk_exceptions.AccessDeniedError()
+        api = API(retry_policy=self._policy())
+        with self.assertRaises(vk_exceptions.AccessDeniedError):
+            api.users.get(user_ids=1)
+        self.assertEqual(send_mock.call_count, 1)
+
+    def test_retries_are_limited_per_call(self):
+        policy = self._policy(max_retries=2)
+        fn = Mock(side_effect=requests.ConnectionError())
+        with self.assertRaises(requests.ConnectionError):
+            policy.call(fn)
+        self.assertEqual(fn.call_count, 3)
+
+    def test_backoff_is_capped_and_jittered(self):
+        policy = self._policy(backoff_base=1, backoff_max=5)
+        for retry_number in range(10):
+            self.assertLessEqual(policy.get_backoff(retry_number), 5)
+        policy.jitter = False
+        self.assertEqual(policy.get_backoff(10), 5)
+
+    def test_exhausted_budget_stops_retries(self):
+        clock = FakeClock()
+        budget = RetryBudget(ratio=0, min_per_second=0, capacity=1,
+                             clock=clock)
+        policy = self._policy(budget=budget)
+        fn = Mock(side_effect=vk_exceptions.FloodControlError())
+        with self.assertRaises(RetryBudgetExhausted):
+            policy.call(fn)
+        self.assertEqual(fn.call_count, 2)
+        self.assertTrue(budget.is_open)
+
+    def test_budget_may_be_disabled(self):
+        self.assertIsInstance(self._policy().budget, RetryBudget)
+        policy = self._policy(budget=None, max_retries=20)
+        self.assertIsNone(policy.budget)
+        fn = Mock(side_effect=[vk_exceptions.FloodControlError()] * 20 + [1])
+        self.assertEqual(policy.call(fn), 1)
+        self.assertEqual(fn.call_count, 21)
+
+    @httpretty.activate
+    def test_server_errors_are_retried(self):
+        httpretty.register_uri(httpretty.GET,
+                               re.compile(r"https://api.vk.com/method/wall.get*"),
+                               responses=[
+                                   httpretty.Response(body="", status=502),
+                                   httpretty.Response(body='{"response": 1}')])
+        api = API(request_delay=0, retry_policy=self._policy())
+        self.assertEqual(api.wall.get(owner_id=1), {"response": 1})
+
+    def test_slot_is_returned_when_request_does_not_reach_server(self):
+        limiter = TokenBucket(1, capacity=1, clock=FakeClock())
+        api = API(rate_limiter=limiter)
+        with patch.object(api.transport, 'get',
+                          side_effect=requests.ConnectionError()):
+            with self.assertRaises(requests.ConnectionError):
+                api.wall.get(owner_id=1)
+        self.assertTrue(limiter.try_acquire())
+
+
+class TestErrorHandlersRegistry(unittest.TestCase):
+
+    def tearDown(self):
+        errorhandlers.register_handler(CaptchaHandler.ERROR_CODE,
+                                       CaptchaHandler)
+        errorhandlers._handlers.pop(999, None)
+
+    def test_builtin_handlers_are_registered(self):
+        self.assertIs(errorhandlers.get_handler_by_error_code(14),
+                      CaptchaHandler)
+        self.assertIs(errorhandlers.get_handler_by_error_code("100"),
+                      errorhandlers.DefaultHandler)
+
+    def test_custom_handler_is_used_for_error_responses(self):
+        handled = []
+
+        class CustomHandler(object):
+            def __init__(self, vk, error_response):
+                self.error_response = error_response
+
+            def handle(self):
+                handled.append(self.error_response["error_code"])
+                return {"response": "handled"}
+
+        errorhandlers.register_handler(999, CustomHandler)
+        r = process_error_response(None, {"error": {"error_code": 999,
+                                                    "error_msg": ""}})
+        self.assertEqual(r, {"response": "handled"})
+        self.assertEqual(handled, [999])
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_nothing_is_printed_on_dispatch(self, stdout_mock):
+        errorhandlers.get_handler_by_error_code(6)
+        self.assertEqual(stdout_mock.getvalue(), "")
+
+
+class TestAdaptiveRateLimit(unittest.TestCase):
+
+    def _bucket(self, **kwargs):
+        self.clock = FakeClock()
+        return AdaptiveTokenBucket(2, clock=self.clock, sleep=self.clock.sleep,
+                                   **kwargs)
+
+    def test_rate_grows_additively_on_success(self):
+        bucket = self._bucket(increase=0.5, max_rate=3)
+        bucket.on_success()
+        self.assertEqual(bucket.rate, 2.5)
+        bucket.on_success()
+        bucket.on_success()
+        self.assertEqual(bucket.rate, 3)
+
+    def test_rate_drops_multiplicatively_on_throttle(self):
+        bucket = self._bucket(decrease_factor=0.5, min_rate=0.6, cooldown=1)
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 1)
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 1)
+        self.clock.now += 2
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 0.6)
+
+    def test_throttling_errors_slow_down_api(self):
+        limiter = self._bucket(decrease_factor=0.5)
+        api = API(rate_limiter=limiter)
+        error = {"error": {"error_code": 6, "error_msg": ""}}
+        with self.assertRaises(vk_exceptions.TooManyRequestsError):
+            process_error_response(api, error)
+        self.assertEqual(limiter.rate, 1)
+
+    def test_current_rates_are_reported_per_token(self):
+        api = API(access_token="adaptivetoken", adaptive_rate=True,
+                  request_delay=0.5)
+        self.assertIsInstance(api.rate_limiter, AdaptiveTokenBucket)
+        self.assertNotIsInstance(
+            API(access_token="adaptivetoken", request_delay=0.5).rate_limiter,
+            AdaptiveTokenBucket)
+        API(access_token="adaptivetoken2", request_delay=0.25).rate_limiter
+        rates = ratelimit.current_rates()
+        label = hashlib.sha1(b"adaptivetoken").hexdigest()[:12]
+        self.assertEqual(rates[label + " (delay=0.5, burst=1, adaptive)"], 2)
+        self.assertEqual(rates[label + " (delay=0.5, burst=1)"], 2)
+        label = hashlib.sha1(b"adaptivetoken2").hexdigest()[:12]
+        self.assertEqual(rates[label + " (delay=0.25, burst=1)"], 4)
+
+
+class TestTokenPool(unittest.TestCase):
+
+    def _pool(self, tokens, **kwargs):
+        self.clock = FakeClock()
+        pool = TokenPool(tokens, clock=self.clock, sleep=self.clock.sleep,
+                         **kwargs)
+        for token in tokens:
+            pool._limiters[token] = TokenBucket(1, clock=self.clock)
+        return pool
+
+    def test_calls_go_to_token_with_soonest_free_slot(self):
+        pool = self._pool(["pool1", "pool2", "pool3"])
+        used = [pool.acquire()[0] for _ in range(6)]
+        self.assertEqual(sorted(used[:3]), ["pool1", "pool2", "pool3"])
+        self.assertEqual(sorted(used[3:]), ["pool1", "pool2", "pool3"])
+        self.assertEqual(self.clock.now, 1)
+
+    def test_sidelined_tokens_are_skipped(self):
+        pool = self._pool(["pool1", "pool2"], sideline_time=10)
+        pool.sideline("pool1")
+        self.assertEqual([pool.acquire()[0] for _ in range(2)],
+                         ["pool2", "pool2"])
+        pool.sideline("pool2")
+        self.assertEqual(pool.acquire()[0], "pool1")
+        self.assertEqual(self.clock.now, 10)
+
+    def test_empty_pool_raises_error(self):
+        pool = self._pool(["pool1"])
+        pool.remove("pool1")
+        with self.assertRaises(NoTokensAvailable):
+            pool.acquire()
+
+    @patch('vk_api.api.API._send_request')
+    def test_failed_tokens_are_removed_and_call_repeated(self, send_mock):
+        pool = self._pool(["pool1", "pool2"])
+
+        def send_request(method_name, params, limiter=None):
+            if params["access_token"] == "pool1":
+                raise vk_exceptions.UserAuthorizationError()
+            return {"response": params["access_token"]}
+        send_mock.side_effect = send_request
+        api = PooledAPI(pool)
+        self.assertEqual(api.users.get(user_ids=1), {"response": "pool2"})
+        self.assertEqual(api.users.get(user_ids=1), {"response": "pool2"})
+        self.assertEqual(pool.tokens, ["pool2"])
+
+    @patch('vk_api.api.API._send_request')
+    def test_flood_limited_tokens_are_sidelined(self, send_mock):
+        pool = self._pool(["pool1"])
+        send_mock.side_effect = vk_exceptions.FloodControlError()
+        with self.assertRaises(vk_exceptions.FloodControlError):
+            PooledAPI(pool).wall.post(message="hi")
+        self.assertEqual(pool.stats(), {"tokens": 1, "sidelined": 1})
+
+    @httpretty.activate
+    def test_every_call_uses_single_slot(self):
+        httpretty.register_uri(httpretty.GET,
+                               "https://api.vk.com/method/users.get",
+                               body='{"response": {"count": 1, "items": [1]}}')
+        pool = self._pool(["pool1", "pool2"])
+        buckets = dict(pool._limiters)
+        api = PooledAPI(pool)
+        with patch.object(buckets["pool1"], 'reserve',
+                          wraps=buckets["pool1"].reserve) as reserve1, \
+                patch.object(buckets["pool2"], 'reserve',
+                             wraps=buckets["pool2"].reserve) as reserve2:
+            api.users.get(user_ids=1)
+            api.users.get(user_ids=1)
+            items = list(api.stream_items("users.get", user_ids=1))
+        self.assertEqual(reserve1.call_count + reserve2.call_count, 3)
+        self.assertEqual(items, [1])
+        self.assertIn(httpretty.last_request().querystring["access_token"][0],
+                      ["pool1", "pool2"])
+        self.assertEqual(self.clock.now, 1)
+
+
+class TestConcurrentUsage(unittest.TestCase):
+
+    @patch('vk_api.api.API._send_request')
+    def test_map_yields_results_in_order(self, send_mock):
+        def send_request(method_name, params):
+            time.sleep(0.001 * (10 - int(params["user_ids"])))
+            return {"response": params["user_ids"]}
+        send_mock.side_effect = send_request
+        api = API()
+        results = api.map(api.users.get,
+                          ({"user_ids": i} for i in range(10)), workers=4)
+        self.assertEqual([r["response"] for r in results], list(range(10)))
+
+    @patch('vk_api.api.API._send_request')
+    def test_map_yields_results_as_completed(self, send_mock):
+        send_mock.side_effect = lambda method_name, params: \
+            {"response": params["user_ids"]}
+        results = API().map("users.get", [{"user_ids": i} for i in range(10)],
+                            ordered=False)
+        self.assertEqual(sorted(r["response"] for r in results),
+                         list(range(10)))
+
+    @patch('vk_api.api.API._send_request')
+    def test_map_keeps_bounded_number_of_calls_in_flight(self, send_mock):
+        send_mock.return_value = {"response": 1}
+        consumed = []
+
+        def kwargs_iterable():
+            for i in range(100):
+                consumed.append(i)
+                yield {"user_ids": i}
+        results = API().map("users.get", kwargs_iterable(), workers=2)
+        next(results)
+        self.assertLessEqual(len(consumed), 5)
+        results.close()
+
+    @patch('vk_api.api.API._send_request')
+    def test_map_may_return_exceptions(self, send_mock):
+        send_mock.side_effect = vk_exceptions.AccessDeniedError()
+        results = list(API().map("users.get", [{"user_ids": 1}],
+                                 return_exceptions=True))
+        self.assertIsInstance(results[0], vk_exceptions.AccessDeniedError)
+
+    @httpretty.activate
+    def test_last_method_url_is_kept_per_thread(self):
+        httpretty.register_uri(httpretty.GET,
+                               re.compile(r"https://api.vk.com/method/.*"),
+                               body='{"response": 1}')
+        api = API(request_delay=0)
+        api.wall.get(owner_id=1)
+        thread = threading.Thread(target=api.users.get,
+                                  kwargs={"user_ids": 1})
+        thread.start()
+        thread.join()
+        self.assertIn("wall.get", api.last_method_url)
+
+
+def _acquire_from_file_bucket(path, count):
+    bucket = FileTokenBucket(50, capacity=1, path=path)
+    for _ in range(count):
+        bucket.acquire()
+    bucket.close()
+
+
+@unittest.skipIf(ratelimit.fcntl is None, "flock is not available")
+class TestFileRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_buckets_with_same_token_share_state(self):
+        clock = FakeClock()
+        first = FileTokenBucket(2, access_token="filetoken",
+                                lock_dir=self.tmp_dir, clock=clock)
+        second = FileTokenBucket(2, access_token="filetoken",
+                                 lock_dir=self.tmp_dir, clock=clock)
+        other = FileTokenBucket(2, access_token="othertoken",
+                                lock_dir=self.tmp_dir, clock=clock)
+        self.assertEqual(first.path, second.path)
+        self.assertEqual(first.reserve(), 0)
+        self.assertEqual(second.reserve(), 0.5)
+        self.assertEqual(first.reserve(), 1.0)
+        self.assertEqual(other.reserve(), 0)
+
+    def test_processes_stay_within_common_limit(self):
+        path = os.path.join(self.tmp_dir, "bucket")
+        processes = [multiprocessing.Process(target=_acquire_from_file_bucket,
+                                             args=(path, 5))
+                     for _ in range(2)]
+        started = time.time()
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        # 10 requests at 50 per second with no burst take at least 0.18s
+        self.assertGreaterEqual(time.time() - started, 0.17)
+
+
+class TestMethodProxies(unittest.TestCase):
+
+    def test_repeated_access_returns_same_proxy(self):
+        api = API()
+        self.assertIs(api.users.get, api.users.get)
+        self.assertIs(api.wall, api.wall)
+        self.assertIsNot(api.users.get, API().users.get)
+
+    def test_method_name_is_precomputed(self):
+        chunk = API().photos.getAlbums
+        self.assertEqual(chunk._method_name, "photos.getAlbums")
+        self.assertEqual(chunk.resolve_method_name(), "photos.getAlbums")
+
+    def test_unknown_attributes_are_not_resolved_to_methods(self):
+        with self.assertRaises(AttributeError):
+            API().unknown_domain
+
+
+def split_into_chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestJSONDecoding(unittest.TestCase):
+
+    def test_first_installed_library_is_used(self):
+        self.assertIs(jsonlib.get_loads(("nonexistent_json", "json")),
+                      json.loads)
+        self.assertIs(jsonlib.get_loads(("nonexistent_json",)), json.loads)
+
+    @httpretty.activate
+    def test_custom_decoder_is_used(self):
+        httpretty.register_uri(httpretty.GET,
+                               re.compile(r"https://api.vk.com/method/wall.get*"),
+                               body='{"response": 1}')
+        loads = Mock(return_value={"response": 2})
+        api = API(json_loads=loads, request_delay=0)
+        self.assertEqual(api.wall.get(), {"response": 2})
+        loads.assert_called_with(b'{"response": 1}')
+
+    def test_items_are_decoded_incrementally(self):
+        items = [{"id": i, "name": "Имя {}".format(i), "nested": [i, {}]}
+                 for i in range(50)] + [12345, "str", None]
+        body = json.dumps({"response": {"count": 53, "items": items}},
+                          ensure_ascii=False).encode("utf-8")
+        for size in (1, 7, 4096):
+            decoded = list(jsonlib.iter_items(split_into_chunks(body, size)))
+            self.assertEqual(decoded, items)
+
+    def test_responses_without_items_are_rejected(self):
+        bodies = [b'{"response": [{"id": 1}]}',
+                  b'{"response": {"count": 1}}',
+                  b'{"response": {"count": 1, "profiles": [], "items": []}}',
+                  b'[1, 2]']
+        for body in bodies:
+            with self.assertRaises(ValueError):
+                list(jsonlib.iter_items(split_into_chunks(body, 3)))
+
+    def test_error_response_is_detected_in_stream(self):
+        body = b'{"error": {"error_code": 15, "error_msg": "Access denied"}}'
+        with self.assertRaises(jsonlib.StreamedErrorResponse) as cm:
+            list(jsonlib.iter_items(split_into_chunks(body, 5)))
+        self.assertEqual(cm.exception.response["error"]["error_code"], 15)
+
+    @httpretty.activate
+    def test_method_response_is_streamed(self):
+        httpretty.register_uri(
+            httpretty.GET,
+            re.compile(r"https://api.vk.com/method/groups.getMembers*"),
+            body='{"response": {"count": 3, "items": [1, 22, 333]}}')
+        api = API(request_delay=0)
+        self.assertEqual(list(api.groups.getMembers.stream(group_id=1)),
+                         [1, 22, 333])
+        httpretty.register_uri(
+            httpretty.GET,
+            re.compile(r"https://api.vk.com/method/groups.getMembers*"),
+            body='{"error": {"error_code": 203, "error_msg": "denied"}}')
+        with self.assertRaises(vk_exceptions.GroupAccessError):
+            list(api.groups.getMembers.stream(group_id=1))
+
+    def test_slot_is_released_when_stream_is_not_sent(self):
+        limiter = Mock()
+        api = API(rate_limiter=limiter)
+        with patch.object(api.transport, 'get',
+                          side_effect=requests.ConnectionError()):
+            with self.assertRaises(requests.ConnectionError):
+                list(api.stream_items("groups.getMembers", group_id=1))
+        self.assertEqual(limiter.acquire.call_count, 1)
+        self.assertEqual(limiter.release.call_count, 1)
+        self.assertFalse(limiter.on_success.called)
+
+
+class TestIDList(unittest.TestCase):
+
+    def test_ids_are_sorted_and_unique(self):
+        ids = IDList([5, 3, 5, 1, 3])
+        self.assertEqual(list(ids), [1, 3, 5])
+        self.assertEqual(ids.array.typecode, "q")
+        self.assertIn(3, ids)
+        self.assertNotIn(4, ids)
+        self.assertNotIn(6, ids)
+
+    @patch('vk_api.idlist.conf.IDLIST_SORT_CHUNK', 3)
+    def test_big_lists_are_sorted_in_chunks(self):
+        self.assertEqual(list(IDList.from_iterable(iter([9, 2, 7, 2, 5, 1, 8]))),
+                         [1, 2, 5, 7, 8, 9])
+
+    def test_set_operations(self):
+        first, second = IDList([1, 2, 3, 4]), IDList([3, 4, 5])
+        self.assertEqual(list(first & second), [3, 4])
+        self.assertEqual(list(first - second), [1, 2])
+        self.assertEqual(list(first | second), [1, 2, 3, 4, 5])
+
+    def test_export_does_not_copy_ids(self):
+        ids = IDList([1, 2, 3])
+        view = ids.memoryview()
+        self.assertTrue(view.readonly)
+        self.assertEqual(view.tolist(), [1, 2, 3])
+        self.assertEqual(IDList.frombytes(ids.tobytes()), ids)
+
+    def test_ids_are_built_from_responses(self):
+        self.assertEqual(list(IDList.from_response(
+            {"response": {"count": 2, "items": [2, 1]}})), [1, 2])
+        api = API()
+        with patch.object(api, 'api_method',
+                          side_effect=fake_paginated_method(2500)) as m:
+            ids = api.friends.get.ids(user_id=1)
+        self.assertEqual(len(ids), 2500)
+        self.assertEqual(m.call_args_list[0][1]["count"], 1000)
+
+
+class TestRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = {"id": 1, "first_name": "Pavel", "city": {"id": 2, "title": "SPb"},
+                    "counters": {"friends": 5}}
+
+    def test_fields_are_kept_in_slots(self):
+        user = User.from_dict(self.raw)
+        self.assertFalse(hasattr(user, "__dict__"))
+        self.assertEqual(user.first_name, "Pavel")
+        self.assertIsNone(user.last_name)
+        self.assertEqual(user.counters, {"friends": 5})
+        with self.assertRaises(AttributeError):
+            user.unknown_field
+
+    def test_nested_fields_are_decoded_lazily(self):
+        user = User.from_dict(self.raw)
+        self.assertIs(user._city, self.raw["city"])
+        self.assertIsInstance(user.city, City)
+        self.assertEqual(user.city.title, "SPb")
+        self.assertIs(user.city, user.city)
+
+        post = Post.from_dict({"id": 1, "attachments": [
+            {"type": "photo", "photo": {"id": 3, "sizes": [{"type": "x", "url": "u"}]}}]})
+        self.assertEqual(post.attachments[0].item.sizes[0].url, "u")
+
+    def test_decoded_nested_fields_are_read_from_slots(self):
+        user = User.from_dict(self.raw)
+        self.assertEqual(user.city.title, "SPb")
+        # Decoded records are read by the slot descriptor itself
+        self.assertIsInstance(type(user).__dict__["city"],
+                              type(User.__dict__["_city"]))
+        self.assertIsInstance(user, User)
+        self.assertEqual(repr(user), "User(id=1)")
+        self.assertEqual(user, User.from_dict(self.raw))
+        user.city = {"id": 3, "title": "Minsk"}
+        self.assertEqual(user.city.title, "Minsk")
+
+    def test_to_dict_round_trip(self):
+        user = User.from_dict(self.raw)
+        user.city
+        self.assertEqual(user.to_dict(), self.raw)
+        self.assertEqual(pickle.loads(pickle.dumps(user)), user)
+
+    def test_method_results_are_mapped(self):
+        api = API()
+        response = {"response": {"count": 1, "items": [{"id": 7, "text": "hi"}]}}
+        with patch.object(api, 'api_method', return_value=response):
+            posts = api.wall.get.records(owner_id=1)
+            self.assertEqual([p.text for p in posts], ["hi"])
+            self.assertIsInstance(posts[0], Post)
+            with self.assertRaises(ValueError):
+                api.status.get.records()
+
+
+class TestPhotoUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.images = []
+        for i in range(7):
+            path = os.path.join(self.tmpdir, "{}.jpg".format(i))
+            with open(path, "wb") as f:
+                f.write(os.urandom(1000 + i))
+            self.images.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_multipart_body_is_streamed(self):
+        body = MultipartBody([("file1", self.images[0]), ("file2", self.images[1])],
+                             chunk_size=100)
+        data = body.read(10) + body.read()
+        self.assertEqual(len(data), len(body))
+        self.assertIn(open(self.images[1], "rb").read(), data)
+        self.assertTrue(data.endswith("--{}--\r\n".format(body.boundary).encode()))
+
+    @httpretty.activate
+    def test_images_are_uploaded_in_groups(self):
+        uploaded_files = []
+
+        def upload_callback(request, uri, headers):
+            self.assertIn(str(len(request.body)), request.headers["Content-Length"])
+            files = re.findall(rb'name="(file\d)"', request.body)
+            uploaded_files.append(len(files))
+            response = {"server": 1, "hash": "h",
+                        "photos_list": json.dumps(list(range(len(files))))}
+            return 200, headers, json.dumps(response)
+
+        httpretty.register_uri(httpretty.POST, "https://upload.vk.com/",
+                               body=upload_callback)
+
+        def api_method(method_name, **kwargs):
+            if method_name == "photos.getUploadServer":
+                return {"response": {"upload_url": "https://upload.vk.com/"}}
+            count = len(json.loads(kwargs["photos_list"]))
+            return {"response": [{"id": i} for i in range(count)]}
+
+        api = API()
+        missing = os.path.join(self.tmpdir, "missing.jpg")
+        # httpretty is not thread-safe, so groups are uploaded one by one
+        with patch.object(api, 'api_method', side_effect=api_method) as m:
+            results = api.upload_photos_to_user_album(
+                album_id=1, images=self.images + [missing], workers=1)
+        self.assertEqual(sorted(uploaded_files), [2, 5])
+        self.assertEqual([r.path for r in results], self.images + [missing])
+        self.assertTrue(all(r.ok for r in results[:-1]))
+        self.assertIsInstance(results[-1].error, IOError)
+        self.assertEqual(len([c for c in m.call_args_list
+                              if c[0][0] == "photos.save"]), 2)
+
+
+class TestDownloader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_best_media_is_chosen(self):
+        photo = {"id": 1, "owner_id": 2, "sizes": [
+            {"type": "s", "url": "small", "width": 75, "height": 50},
+            {"type": "w", "url": "big", "width": 2560, "height": 1700},
+            {"type": "x", "url": "medium", "width": 604, "height": 400}]}
+        old_photo = {"id": 3, "owner_id": 2, "photo_130": "a", "photo_604": "b"}
+        doc = {"id": 4, "owner_id": 2, "ext": "gif", "url": "doc", "type": 3}
+        message = {"id": 5, "attachments": [{"type": "photo", "photo": photo},
+                                            {"type": "doc", "doc": doc}],
+                   "fwd_messages": [{"id": 6, "attachments": [
+                       {"type": "video", "video": {"id": 7, "owner_id": 2, "files": {
+                           "mp4_240": "v240", "mp4_720": "v720", "external": "e"}}}]}]}
+        self.assertEqual(list(iter_media([photo, old_photo, message])), [
+            ("big", "2_1.jpg"), ("b", "2_3.jpg"), ("big", "2_1.jpg"),
+            ("doc", "2_4.gif"), ("v720", "2_7.mp4")])
+
+    @httpretty.activate
+    def test_download_resumes_partial_files(self):
+        content = os.urandom(5000)
+
+        def callback(request, uri, headers):
+            start = int(request.headers.get("Range", "bytes=0-")[6:-1])
+            return (206 if start else 200), headers, content[start:]
+
+        httpretty.register_uri(httpretty.GET, "https://sun.userapi.com/1.jpg",
+                               body=callback)
+        with open(os.path.join(self.tmpdir, "1_1.jpg.part"), "wb") as f:
+            f.write(content[:1000])
+        photo = {"id": 1, "owner_id": 1,
+                 "sizes": [{"type": "x", "url": "https://sun.userapi.com/1.jpg"}]}
+        with Downloader(workers=2) as downloader:
+            results = list(downloader.download([photo], self.tmpdir))
+        self.assertTrue(results[0].ok)
+        self.assertEqual(results[0].size, 4000)
+        self.assertEqual(httpretty.last_request().headers["Range"], "bytes=1000-")
+        with open(results[0].path, "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(self.tmpdir), ["1_1.jpg"])
+        stats = downloader.stats()
+        self.assertEqual((stats["files"], stats["failed"], stats["bytes"]), (1, 0, 4000))
+
+
+class TestLongPoll(unittest.TestCase):
+
+    @httpretty.activate
+    def test_server_is_requested_again_on_failures(self):
+        responses = [{"ts": 11, "updates": [[4, 100, 1, 5, 1500000000, "hi", {}, {}, 0]]},
+                     {"failed": 1, "ts": 20},
+                     {"failed": 2},
+                     {"failed": 3},
+                     {"ts": 41, "updates": [[8, -5, 1]]}]
+        httpretty.register_uri(httpretty.GET, "https://im.vk.com/nim1",
+                               responses=[httpretty.Response(body=json.dumps(r))
+                                          for r in responses])
+        servers = iter([{"server": "im.vk.com/nim1", "key": "k1", "ts": 10},
+                        {"server": "im.vk.com/nim1", "key": "k2", "ts": 99},
+                        {"server": "im.vk.com/nim1", "key": "k3", "ts": 40}])
+        api = API()
+        with patch.object(api, 'api_method',
+                          side_effect=lambda *a, **kw: {"response": next(servers)}) as m, \
+                patch.object(API, 'rate_limiter') as limiter:
+            longpoll = LongPoll(api)
+            events = [longpoll.check() for _ in responses]
+        self.assertEqual(m.call_count, 3)
+        self.assertFalse(limiter.acquire.called)
+        self.assertEqual(events[0][0].type, "message_new")
+        self.assertEqual(events[0][0].object["text"], "hi")
+        self.assertEqual(events[1:4], [[], [], []])
+        self.assertEqual(events[4][0].type, "friend_online")
+        self.assertEqual(httpretty.last_request().querystring["key"], ["k3"])
+        self.assertEqual(httpretty.last_request().querystring["ts"], ["40"])
+
+    def test_unrecoverable_errors_are_raised(self):
+        with self.assertRaises(LongPollError):
+            LongPoll(API()).process_response({"failed": 4})
+
+    def test_listen_reconnects_after_network_errors(self):
+        sleep = Mock()
+        longpoll = LongPoll(API(), sleep=sleep)
+        event = longpoll.parse_event([8, -5, 1])
+        checks = [requests.ReadTimeout(), requests.ConnectionError(), [event],
+                  requests.ConnectionError(), [event]]
+        with patch.object(longpoll, 'check', side_effect=checks):
+            listener = longpoll.listen()
+            self.assertEqual([next(listener), next(listener)], [event, event])
+        delay = conf.LONGPOLL_RECONNECT_DELAY
+        # Delay is reset once the server has responded
+        self.assertEqual([c[0][0] for c in sleep.call_args_list],
+                         [delay, delay * 2, delay])
+
+    @skip_without_aio
+    def test_async_listen_reconnects_after_network_errors(self):
+        transport = FakeAsyncTransport({"ts": "5", "updates": [
+            {"type": "group_join", "object": {"user_id": 1}}]})
+        get_json = transport.get_json
+        errors = [aio.aiohttp.ClientConnectionError(), asyncio.TimeoutError()]
+
+        async def flaky_get_json(url, params=None, loads=None):
+            if errors:
+                raise errors.pop(0)
+            return await get_json(url, params=params, loads=loads)
+
+        transport.get_json = flaky_get_json
+        delays = []
+
+        async def sleep(delay):
+            delays.append(delay)
+
+        async def server(*args, **kwargs):
+            return {"response": {"server": "https://lp.vk.com/wh1", "key": "k", "ts": "4"}}
+
+        api = aio.AsyncAPI(request_delay=0)
+        longpoll = aio.AsyncGroupLongPoll(api, 1, transport=transport,
+                                          sleep=sleep)
+
+        async def first_event():
+            async for event in longpoll:
+                return event
+
+        with patch.object(api, 'api_method', side_effect=server):
+            event = asyncio.run(first_event())
+        self.assertEqual(event.type, "group_join")
+        delay = conf.LONGPOLL_RECONNECT_DELAY
+        self.assertEqual(delays, [delay, delay * 2])
+
+    @skip_without_aio
+    def test_async_group_events_are_iterated(self):
+        transport = FakeAsyncTransport({"ts": "5", "updates": [
+            {"type": "message_new", "object": {"text": "hi"}, "group_id": 1}]})
+        api = aio.AsyncAPI(request_delay=0)
+
+        async def server(*args, **kwargs):
+            return {"response": {"server": "https://lp.vk.com/wh1", "key": "k", "ts": "4"}}
+
+        async def first_event():
+            async for event in aio.AsyncGroupLongPoll(api, 1, transport=transport):
+                return event
+
+        with patch.object(api, 'api_method', side_effect=server):
+            event = asyncio.run(first_event())
+        self.assertEqual((event.type, event.object), ("message_new", {"text": "hi"}))
+        self.assertEqual(transport.calls[0][0], "https://lp.vk.com/wh1")
+        self.assertEqual(transport.calls[0][1]["ts"], "4")
+
+
+def fake_wall(posts):
+    """Returns api_method replacement serving wall.get from posts list"""
+    def api_method(method_name, owner_id, offset=0, count=100, **kwargs):
+        return {"response": {"count": len(posts),
+                             "items": posts[offset:offset + count]}}
+    return api_method
+
+
+class TestSync(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "checkpoints.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_only_new_posts_are_fetched(self):
+        posts = [{"id": i} for i in range(30, 0, -1)]
+        api = API()
+        sync = WallSync(api, CheckpointStore(self.path), page_size=10)
+        with patch.object(api, 'api_method', side_effect=fake_wall(posts)):
+            self.assertEqual(len(list(sync.sync(owner_id=1))), 30)
+            posts[:0] = [{"id": 40, "is_pinned": 1}, {"id": 32}, {"id": 31}]
+            posts.insert(3, {"id": 5, "is_pinned": 1})
+            with patch.object(api, 'api_method',
+                              side_effect=fake_wall(posts)) as m:
+                new = [p["id"] for p in WallSync(api, CheckpointStore(self.path)).sync(1)]
+        self.assertEqual(new, [40, 32, 31])
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(CheckpointStore(self.path).get("wall:1"), {"last_id": 40})
+
+    def test_old_pinned_post_does_not_stop_first_sync(self):
+        posts = [{"id": 50, "is_pinned": 1}] + [{"id": i} for i in range(200, 190, -1)]
+        api = API()
+        store = CheckpointStore()
+        with patch.object(api, 'api_method', side_effect=fake_wall(posts)):
+            synced = [p["id"] for p in WallSync(api, store, page_size=4).sync(1)]
+        self.assertEqual(synced, [50] + list(range(200, 190, -1)))
+        self.assertEqual(store.get("wall:1"), {"last_id": 200})
+
+    def test_post_published_between_pages_is_not_duplicated(self):
+        posts = [{"id": i} for i in range(200, 190, -1)]
+        serve = fake_wall(posts)
+
+        def api_method(method_name, owner_id, offset=0, count=100, **kwargs):
+            r = serve(method_name, owner_id, offset, count)
+            if offset == 0:
+                posts.insert(0, {"id": 201})
+            return r
+
+        api = API()
+        sync = WallSync(api, CheckpointStore(), page_size=4)
+        with patch.object(api, 'api_method', side_effect=api_method):
+            synced = [p["id"] for p in sync.sync(1)]
+        self.assertEqual(synced, list(range(200, 190, -1)))
+        with patch.object(api, 'api_method', side_effect=fake_wall(posts)):
+            self.assertEqual([p["id"] for p in sync.sync(1)], [201])
+
+    def test_interrupted_sync_is_resumed(self):
+        posts = [{"id": i} for i in range(25, 0, -1)]
+        api = API()
+        with patch.object(api, 'api_method', side_effect=fake_wall(posts)):
+            sync = WallSync(api, CheckpointStore(self.path), page_size=10)
+            first = []
+            for post in sync.sync(owner_id=1):
+                first.append(post["id"])
+                if len(first) == 15:
+                    break  # job has crashed while processing 15th post
+            posts.insert(0, {"id": 26})
+            sync = WallSync(api, CheckpointStore(self.path), page_size=10)
+            second = [p["id"] for p in sync.sync(owner_id=1)]
+            third = [p["id"] for p in sync.sync(owner_id=1)]
+        self.assertEqual(second, list(range(15, 0, -1)))
+        self.assertEqual(third, [26])
+
+    def test_newsfeed_cursors_are_followed(self):
+        pages = {None: {"items": [{"date": 30}, {"date": 20}], "next_from": "a"},
+                 "a": {"items": [{"date": 10}], "next_from": ""}}
+        api = API()
+        calls = []
+
+        def newsfeed_get(method_name, **kwargs):
+            calls.append(kwargs)
+            return {"response": pages[kwargs.get("start_from")]}
+
+        store = CheckpointStore()
+        with patch.object(api, 'api_method', side_effect=newsfeed_get):
+            items = list(NewsfeedSync(api, store, page_size=2).sync(start_time=5))
+            pages[None] = {"items": [], "next_from": ""}
+            list(NewsfeedSync(api, store, page_size=2).sync())
+        self.assertEqual(len(items), 3)
+        self.assertEqual(calls[1]["start_from"], "a")
+        self.assertEqual(calls[0]["start_time"], 5)
+        self.assertEqual(calls[2]["start_time"], 31)
+        self.assertEqual(store.get("newsfeed"), {"start_time": 31})
+
+
+def fake_friends_execute(adjacency):
+    """Returns api_method replacement serving friends.get calls inside
+    execute from the adjacency dict, missing users have private profiles"""
+    def api_method(method_name, code):
+        results, errors = [], []
+        for params in re.findall(r'API\.friends\.get\((\{.*?\})\)', code):
+            params = json.loads(params)
+            friends = adjacency.get(params["user_id"])
+            if friends is None:
+                results.append(False)
+                errors.append({"method": "friends.get", "error_code": 30,
+                               "error_msg": "This profile is private"})
+            else:
+                offset = params["offset"]
+                results.append({"count": len(friends),
+                                "items": friends[offset:offset + params["count"]]})
+        return {"response": results, "execute_errors": errors}
+    return api_method
+
+
+class TestFriendsCrawler(unittest.TestCase):
+
+    adjacency = {1: [3, 2], 2: [1, 4], 4: [2, 5], 5: [4]}
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_bitmap(self):
+        seen = IDBitmap([5, 70000], page_size=16)
+        self.assertTrue(seen.add(6))
+        self.assertFalse(seen.add(5))
+        self.assertIn(70000, seen)
+        self.assertNotIn(7, seen)
+        self.assertEqual(len(seen), 3)
+        self.assertEqual(seen.nbytes, 32)
+
+    def test_graph_is_crawled_to_csr_files(self):
+        api = API()
+        with patch.object(api, 'api_method',
+                          side_effect=fake_friends_execute(self.adjacency)):
+            crawler = FriendsCrawler(api, self.tmpdir, max_depth=1, page_size=1)
+            graph = crawler.crawl(seeds=[1])
+        with graph:
+            self.assertEqual(list(graph.nodes), [1, 2, 3])
+            self.assertEqual(list(graph.offsets), [0, 2, 4, 4])
+            self.assertEqual(list(graph.neighbors(1)), [2, 3])
+            self.assertEqual(list(graph.neighbors(2)), [1, 4])
+            self.assertEqual(len(graph.neighbors(3)), 0)
+            with self.assertRaises(KeyError):
+                graph.neighbors(4)
+        stats = crawler.stats()
+        self.assertEqual((stats["nodes"], stats["edges"], stats["failed"]), (3, 4, 1))
+        self.assertTrue(stats["finished"])
+
+    def test_stopped_crawl_is_resumed(self):
+        api = API()
+        with patch.object(api, 'api_method',
+                          side_effect=fake_friends_execute(self.adjacency)) as m:
+            crawler = FriendsCrawler(api, self.tmpdir, max_depth=3,
+                                     max_nodes=2, batch_size=1)
+            crawler.crawl(seeds=[1]).close()
+            self.assertEqual(crawler.stats()["nodes"], 2)
+            # Data written after the checkpoint is dropped
+            with open(os.path.join(self.tmpdir, "nodes.bin"), "ab") as f:
+                f.write(b"\xff" * 16)
+            crawler = FriendsCrawler(api, self.tmpdir, max_depth=3, batch_size=1)
+            graph = crawler.crawl()
+        with graph:
+            self.assertEqual(list(graph.nodes), [1, 2, 3, 4, 5])
+            self.assertEqual(sorted(graph.iter_edges())[:3], [(1, 2), (1, 3), (2, 1)])
+        self.assertEqual(m.call_count, 5)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ["edges.bin", "nodes.bin", "offsets.bin", "state.json"])
+
+
 if __name__ == '__main__':
     unittest.main()
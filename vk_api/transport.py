@@ -0,0 +1,91 @@
+"""
+HTTP transport layer used by the API object.
+
+Every API instance owns a transport which keeps its own
+requests session, so all API and upload traffic reuses
+pooled keep-alive connections instead of opening a new
+TLS connection on every call.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import conf
+
+
+class HTTPTransport(object):
+    """Pooled HTTP transport built on top of requests.Session
+
+    :param pool_connections: number of per-host connection pools to cache
+    :param pool_maxsize: maximum number of connections kept in every pool
+    :param pool_block: block when no free connections are left in the pool
+    :param timeout: (connect, read) timeout tuple or a single number
+    :param keep_alive: whether connections should be kept open between calls
+    :param max_retries: low-level connection retries done by the adapter
+    :param session: already configured session to be used instead of default
+    :param adapter: transport adapter to be mounted for http and https
+    :type pool_connections: int
+    :type pool_maxsize: int
+    :type pool_block: bool
+    :type timeout: tuple or float
+    :type keep_alive: bool
+    :type max_retries: int
+    :type session: requests.Session
+    :type adapter: requests.adapters.BaseAdapter
+    """
+
+    def __init__(self,
+                 pool_connections=conf.HTTP_POOL_CONNECTIONS,
+                 pool_maxsize=conf.HTTP_POOL_MAXSIZE,
+                 pool_block=False,
+                 timeout=conf.HTTP_TIMEOUT,
+                 keep_alive=True,
+                 max_retries=0,
+                 session=None,
+                 adapter=None):
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._owns_session = session is None
+
+        if session is None:
+            session = requests.Session()
+            if adapter is None:
+                adapter = HTTPAdapter(pool_connections=pool_connections,
+                                      pool_maxsize=pool_maxsize,
+                                      pool_block=pool_block,
+                                      max_retries=max_retries)
+        if adapter is not None:
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        """Sends HTTP request through the pooled session,
+        default timeout is used unless specified explicitly
+
+        :param method: HTTP method name
+        :param url: URL to send request to
+        :param kwargs: any additional arguments accepted by requests
+        :rtype: requests.Response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request("GET", url, params=params, **kwargs)
+
+    def post(self, url, data=None, files=None, **kwargs):
+        return self.request("POST", url, data=data, files=files, **kwargs)
+
+    def close(self):
+        """Closes all pooled connections. Injected sessions are left
+        untouched as they are owned by the caller"""
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,225 @@
+"""
+Bulk photo uploads.
+
+VK accepts at most 5 photos per upload request, so images are split
+into groups which are uploaded in parallel, streaming files from disk.
+``photos.save`` calls are made as soon as the group is uploaded,
+while the other groups are still being sent.
+"""
+import mimetypes
+import os
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import conf
+
+
+class MultipartBody(object):
+    """Streaming ``multipart/form-data`` body. Files are read chunk by
+    chunk while the body is being sent and closed once they are read.
+    Length of the body is known in advance, so it is sent with
+    Content-Length header.
+
+    :param files: sequence of (field_name, file_path) pairs
+    :param chunk_size: size of chunks files are read in
+    :type files: list
+    :type chunk_size: int
+    """
+
+    def __init__(self, files, chunk_size=conf.UPLOAD_CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self._parts = []
+        for name, path in files:
+            content_type = (mimetypes.guess_type(path)[0] or
+                            "application/octet-stream")
+            header = ('--{}\r\n'
+                      'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+                      'Content-Type: {}\r\n\r\n').format(
+                self.boundary, name, os.path.basename(path), content_type)
+            self._parts.append((header.encode("utf-8"), path,
+                                os.path.getsize(path)))
+        self._closing = "--{}--\r\n".format(self.boundary).encode("ascii")
+        self._chunks = self._iter_chunks()
+        self._buffer = b""
+
+    @property
+    def content_type(self):
+        return "multipart/form-data; boundary={}".format(self.boundary)
+
+    def __len__(self):
+        return (sum(len(header) + size + 2 for header, _, size in self._parts) +
+                len(self._closing))
+
+    def _iter_chunks(self):
+        for header, path, _ in self._parts:
+            yield header
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                    yield chunk
+            yield b"\r\n"
+        yield self._closing
+
+    def __iter__(self):
+        if self._buffer:
+            yield self._buffer
+            self._buffer = b""
+        for chunk in self._chunks:
+            yield chunk
+
+    def read(self, size=-1):
+        data = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            chunk = next(self._chunks, b"")
+            if not chunk:
+                break
+            data.append(chunk)
+            length += len(chunk)
+        data = b"".join(data)
+        if size < 0:
+            self._buffer = b""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def close(self):
+        """Closes the file being read, if any"""
+        self._chunks.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class UploadResult(object):
+    """Outcome of a single file upload
+
+    :ivar path: path of the uploaded file
+    :ivar photo: saved photo object as returned by photos.save
+    :ivar error: exception raised while uploading or saving the file
+    """
+
+    __slots__ = ("path", "photo", "error")
+
+    def __init__(self, path, photo=None, error=None):
+        self.path = path
+        self.photo = photo
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "UploadResult({!r}, ok={})".format(self.path, self.ok)
+
+
+class PhotoUploader(object):
+    """Uploads any number of photos to the album.
+    Usage example:
+
+    >>> uploader = PhotoUploader(api, album_id=1)
+    >>> for result in uploader.upload(paths):
+    ...     print(result.path, result.ok)
+
+    :param api: API object instance
+    :param album_id: ID of the album
+    :param group_id: ID of the community owning the album
+    :param workers: number of uploads made at once
+    :param group_size: number of files sent in a single upload request
+    :type api: API
+    :type workers: int
+    :type group_size: int
+    """
+
+    def __init__(self, api, album_id, group_id=None,
+                 workers=conf.UPLOAD_WORKERS,
+                 group_size=conf.MAX_ALBUM_UPLOAD_IMAGES):
+        if not 1 <= group_size <= conf.MAX_ALBUM_UPLOAD_IMAGES:
+            msg = "Group size should be between 1 and {}."
+            raise ValueError(msg.format(conf.MAX_ALBUM_UPLOAD_IMAGES))
+        self._api = api
+        self.workers = workers
+        self.group_size = group_size
+        self.params = {"album_id": album_id}
+        if group_id:
+            self.params["group_id"] = group_id
+
+    def get_upload_url(self):
+        r = self._api.photos.getUploadServer(**self.params)
+        return r["response"]["upload_url"]
+
+    def _upload_group(self, upload_url, paths):
+        files = [("file{}".format(i + 1), p) for i, p in enumerate(paths)]
+        with MultipartBody(files) as body:
+            r = self._api.transport.post(
+                upload_url, data=body,
+                headers={"Content-Type": body.content_type})
+        r.raise_for_status()
+        return self._api.json_loads(r.content)
+
+    def _save_group(self, paths, uploaded):
+        if uploaded.get("photos_list") in (None, "", "[]"):
+            error = ValueError("Upload server has not accepted the files.")
+            return [UploadResult(p, error=error) for p in paths]
+        r = self._api.photos.save(server=uploaded["server"],
+                                  photos_list=uploaded["photos_list"],
+                                  hash=uploaded["hash"],
+                                  **self.params)
+        photos = r["response"]
+        results = [UploadResult(p, photo=photo)
+                   for p, photo in zip(paths, photos)]
+        if len(photos) < len(paths):
+            error = ValueError("Photo has not been saved.")
+            results.extend(UploadResult(p, error=error)
+                           for p in paths[len(photos):])
+        return results
+
+    def upload(self, paths):
+        """Uploads files yielding UploadResult for every file
+        in order of completion. Errors are reported in results
+        instead of being raised.
+
+        :param paths: paths of image files
+        :type paths: list
+        """
+        paths = list(paths)
+        existing = []
+        for path in paths:
+            if os.path.isfile(path):
+                existing.append(path)
+            else:
+                yield UploadResult(path, error=IOError(
+                    "File {} does not exist.".format(path)))
+        if not existing:
+            return
+        try:
+            upload_url = self.get_upload_url()
+        except Exception as e:
+            for path in existing:
+                yield UploadResult(path, error=e)
+            return
+
+        groups = [existing[i:i + self.group_size]
+                  for i in range(0, len(existing), self.group_size)]
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            pending = {executor.submit(self._upload_group, upload_url, g): g
+                       for g in groups}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    group = pending.pop(future)
+                    try:
+                        results = self._save_group(group, future.result())
+                    except Exception as e:
+                        results = [UploadResult(p, error=e) for p in group]
+                    for result in results:
+                        yield result
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
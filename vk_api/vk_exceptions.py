@@ -21,20 +21,14 @@ def get_exception_class_by_code(code):
     :type code: int
     :return: Return Exception class associated with the specified API error.
     """
-    code = int(code)
+    return _exception_classes.get(int(code), UnknownError)
 
-    module_classes = inspect.getmembers(sys.modules[__name__], inspect.isclass)
-    exception_classes = (h[1] for h in module_classes
-                         if is_valid_error_cls(h[1]))
 
-    exception_cls = None
-    for e_c in exception_classes:
-        if e_c.error_code == code:
-            exception_cls = e_c
-            break
-    if exception_cls is None:
-        exception_cls = UnknownError
-    return exception_cls
+def _collect_exception_classes():
+    """Builds error code to exception class mapping once on import"""
+    module_classes = inspect.getmembers(sys.modules[__name__], inspect.isclass)
+    return {cls.error_code: cls for _, cls in module_classes
+            if is_valid_error_cls(cls)}
 
 
 class API_Error(Exception):
@@ -139,6 +133,22 @@ Switch the app off in Settings: https://vk.com/editapp?id={Your API_ID}.
 """
 
 
+class ExecuteCompileError(API_Error):
+    error_code = 12
+    error_msg = """
+Unable to compile code
+Check the code of the execute method, it should be valid VKScript.
+"""
+
+
+class ExecuteRuntimeError(API_Error):
+    error_code = 13
+    error_msg = """
+Runtime error occurred during code invocation
+Check the code of the execute method. The error is also returned if the response size is too big.
+"""
+
+
 class CaptchaNeededError(API_Error):
     error_code = 14
     error_msg = """
@@ -172,6 +182,14 @@ Make sure that you don't use a token received with http://vk.com/dev/auth_mobile
 """
 
 
+class UserDeletedError(API_Error):
+    error_code = 18
+    error_msg = """
+User was deleted or banned
+The user's page has been deleted or blocked, its content is not available.
+"""
+
+
 class NonStandaloneAppPermissionError(API_Error):
     error_code = 20
     error_msg = """
@@ -204,6 +222,14 @@ Confirmation process is described on the separate page
 """
 
 
+class PrivateProfileError(API_Error):
+    error_code = 30
+    error_msg = """
+This profile is private
+Information of the private profile is available only to the user's friends.
+"""
+
+
 class MissingOrInvalidParameterError(API_Error):
     error_code = 100
     error_msg = """
@@ -289,3 +315,6 @@ class AdsError(API_Error):
     error_msg = """
 Some ads error occured
 """
+
+
+_exception_classes = _collect_exception_classes()